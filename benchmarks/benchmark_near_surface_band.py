@@ -0,0 +1,117 @@
+# Hunyuan 3D is licensed under the TENCENT HUNYUAN NON-COMMERCIAL LICENSE AGREEMENT
+# except for the third-party components listed below.
+# Hunyuan 3D does not impose any additional limitations beyond what is outlined
+# in the repsective licenses of these third-party components.
+# Users must comply with all terms and conditions of original licenses of these third-party
+# components and must ensure that the usage of the third party components adheres to
+# all relevant laws and regulations.
+
+# For avoidance of doubts, Hunyuan 3D means the large language models and
+# their software and algorithms, including trained model weights, parameters (including
+# optimizer states), machine-learning model code, inference-enabling code, training-enabling code,
+# fine-tuning enabling code and other elements of the foregoing made publicly available
+# by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
+
+"""
+CPU benchmark of near-surface band detection + dilation during hierarchical volume decoding.
+
+Compares `extract_near_surface_volume_fn` followed by all-ones Conv3d dilations (the previous
+implementation) with `extract_near_surface_mask` + `dilate_mask`. Every run happens in a fresh process
+so the peak RSS reflects that variant only.
+
+    python benchmarks/benchmark_near_surface_band.py --resolutions 128 256 384 --dtype float16
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+# run from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hy3dgen.shapegen.models.autoencoders.volume_decoders import extract_near_surface_volume_fn, \
+    extract_near_surface_mask, dilate_mask
+
+
+def make_grid(resolution, dtype):
+    # filled slab by slab so that building the input does not dominate the peak RSS
+    axis = torch.linspace(-1.01, 1.01, resolution + 1)
+    y, z = torch.meshgrid(axis, axis, indexing='ij')
+    grid = torch.empty((resolution + 1,) * 3, dtype=dtype)
+    for i, x in enumerate(axis):
+        radius = (x ** 2 + y ** 2 + z ** 2).sqrt()
+        wobble = 0.05 * torch.sin(8 * x) * torch.cos(6 * y)
+        grid[i] = ((0.6 + wobble - radius) * 20).to(dtype)
+    return grid
+
+
+def run_baseline(grid, mc_level, dilation):
+    dilate = nn.Conv3d(1, 1, 3, padding=1, bias=False, dtype=grid.dtype)
+    dilate.weight = nn.Parameter(torch.ones(dilate.weight.shape, dtype=grid.dtype))
+    with torch.no_grad():
+        points = extract_near_surface_volume_fn(grid, mc_level)
+        points += grid.abs() < 0.95
+        points = points.to(grid.dtype)
+        for _ in range(dilation):
+            points = dilate(points.unsqueeze(0)).squeeze(0)
+    return points > 0
+
+
+def run_pooled(grid, mc_level, dilation):
+    points = extract_near_surface_mask(grid, mc_level) | (grid.abs() < 0.95)
+    return dilate_mask(points, dilation)
+
+
+def worker(variant, resolution, dtype, mc_level, dilation, threads, queue):
+    if threads is not None:
+        torch.set_num_threads(threads)
+    grid = make_grid(resolution, getattr(torch, dtype))
+    fn = run_baseline if variant == 'baseline' else run_pooled
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    mask = fn(grid, mc_level, dilation)
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # packed NumPy bytes are pickled by value, a tensor would be shared with a process that exits right away
+    queue.put((elapsed, (peak_rss - base_rss) / 1024, int(mask.sum()), np.packbits(mask.numpy())))
+
+
+def measure(variant, resolution, dtype, mc_level, dilation, threads=None):
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=worker, args=(variant, resolution, dtype, mc_level, dilation, threads, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[128, 256])
+    parser.add_argument('--dtype', type=str, default='float16', choices=['float16', 'float32'])
+    parser.add_argument('--mc_level', type=float, default=0.0)
+    parser.add_argument('--dilation', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+
+    print(f'{"res":>5} {"variant":>9} {"time (s)":>9} {"peak RSS (MB)":>14} {"band cells":>11}')
+    for resolution in args.resolutions:
+        masks = {}
+        for variant in ('baseline', 'pooled'):
+            elapsed, peak_mb, count, masks[variant] = measure(
+                variant, resolution, args.dtype, args.mc_level, args.dilation, args.threads)
+            print(f'{resolution:>5} {variant:>9} {elapsed:>9.3f} {peak_mb:>14.1f} {count:>11}')
+        if not np.array_equal(masks['baseline'], masks['pooled']):
+            raise RuntimeError(f'band mismatch at resolution {resolution}')
+
+
+if __name__ == '__main__':
+    main()
@@ -21,7 +21,7 @@ bl_info = {
     "description": "Generate/Texturing 3D models from text descriptions or images",
     "category": "3D View",
 }
-import base64
+import json
 import os
 import tempfile
 import threading
@@ -103,7 +103,7 @@ class Hunyuan3DOperator(bpy.types.Operator):
     num_inference_steps = 20
     guidance_scale = 5.5
     texture = False  # 新增属性
-    selected_mesh_base64 = ""
+    selected_mesh_data = b""
     selected_mesh = None  # 新增属性，用于存储选中的 mesh
 
     thread = None
@@ -147,10 +147,8 @@ class Hunyuan3DOperator(bpy.types.Operator):
             temp_glb_file.close()
             bpy.ops.export_scene.gltf(filepath=temp_glb_file.name, use_selection=True)
             with open(temp_glb_file.name, "rb") as file:
-                mesh_data = file.read()
-            mesh_b64_str = base64.b64encode(mesh_data).decode()
+                self.selected_mesh_data = file.read()
             os.unlink(temp_glb_file.name)
-            self.selected_mesh_base64 = mesh_b64_str
 
         props.is_processing = True
 
@@ -183,74 +181,41 @@ class Hunyuan3DOperator(bpy.types.Operator):
         base_url = self.api_url.rstrip('/')
 
         try:
-            if self.selected_mesh_base64 and self.texture:
+            params = {
+                "octree_resolution": self.octree_resolution,
+                "num_inference_steps": self.num_inference_steps,
+                "guidance_scale": self.guidance_scale,
+                "texture": self.texture  # 传递 texture 参数
+            }
+            # 以 multipart 上传原始文件，避免 Base64 编码
+            files = {}
+            image_path = self.image_path
+            if self.selected_mesh_data and self.texture:
                 # Texturing the selected mesh
+                files["mesh"] = ("mesh.glb", self.selected_mesh_data, "model/gltf-binary")
                 if self.image_path and os.path.exists(self.image_path):
                     self.report({'INFO'}, f"Post Texturing with Image")
-                    # 打开图片文件并以二进制模式读取
-                    with open(self.image_path, "rb") as file:
-                        # 读取文件内容
-                        image_data = file.read()
-                    # 对图片数据进行 Base64 编码
-                    img_b64_str = base64.b64encode(image_data).decode()
-                    response = requests.post(
-                        f"{base_url}/generate",
-                        json={
-                            "mesh": self.selected_mesh_base64,
-                            "image": img_b64_str,
-                            "octree_resolution": self.octree_resolution,
-                            "num_inference_steps": self.num_inference_steps,
-                            "guidance_scale": self.guidance_scale,
-                            "texture": self.texture  # 传递 texture 参数
-                        },
-                    )
                 else:
                     self.report({'INFO'}, f"Post Texturing with Text")
-                    response = requests.post(
-                        f"{base_url}/generate",
-                        json={
-                            "mesh": self.selected_mesh_base64,
-                            "text": self.prompt,
-                            "octree_resolution": self.octree_resolution,
-                            "num_inference_steps": self.num_inference_steps,
-                            "guidance_scale": self.guidance_scale,
-                            "texture": self.texture  # 传递 texture 参数
-                        },
-                    )
+                    params["text"] = self.prompt
+                    image_path = ""
             else:
                 if self.image_path:
                     if not os.path.exists(self.image_path):
                         self.report({'ERROR'}, f"Image path does not exist {self.image_path}")
                         raise Exception(f'Image path does not exist {self.image_path}')
                     self.report({'INFO'}, f"Post Start Image to 3D")
-                    # 打开图片文件并以二进制模式读取
-                    with open(self.image_path, "rb") as file:
-                        # 读取文件内容
-                        image_data = file.read()
-                    # 对图片数据进行 Base64 编码
-                    img_b64_str = base64.b64encode(image_data).decode()
-                    response = requests.post(
-                        f"{base_url}/generate",
-                        json={
-                            "image": img_b64_str,
-                            "octree_resolution": self.octree_resolution,
-                            "num_inference_steps": self.num_inference_steps,
-                            "guidance_scale": self.guidance_scale,
-                            "texture": self.texture  # 传递 texture 参数
-                        },
-                    )
                 else:
                     self.report({'INFO'}, f"Post Start Text to 3D")
-                    response = requests.post(
-                        f"{base_url}/generate",
-                        json={
-                            "text": self.prompt,
-                            "octree_resolution": self.octree_resolution,
-                            "num_inference_steps": self.num_inference_steps,
-                            "guidance_scale": self.guidance_scale,
-                            "texture": self.texture  # 传递 texture 参数
-                        },
-                    )
+                    params["text"] = self.prompt
+
+            if image_path:
+                with open(image_path, "rb") as file:
+                    files["image"] = (os.path.basename(image_path), file.read())
+            if files:
+                response = requests.post(f"{base_url}/generate", data={"params": json.dumps(params)}, files=files)
+            else:
+                response = requests.post(f"{base_url}/generate", json=params)
             self.report({'INFO'}, f"Post Done")
             self.task_finished = True
             props = context.scene.gen_3d_props
@@ -260,7 +225,7 @@ class Hunyuan3DOperator(bpy.types.Operator):
                 self.report({'ERROR'}, f"Generation failed: {response.text}")
                 return
 
-            # Decode base64 and save to temporary file
+            # Save the binary GLB to a temporary file
             temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".glb")
             temp_file.write(response.content)
             temp_file.close()
@@ -293,7 +258,7 @@ class Hunyuan3DOperator(bpy.types.Operator):
             self.task_finished = True
             props = context.scene.gen_3d_props
             props.is_processing = False
-            self.selected_mesh_base64 = ""
+            self.selected_mesh_data = b""
 
 
 class Hunyuan3DPanel(bpy.types.Panel):
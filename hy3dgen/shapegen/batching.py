@@ -0,0 +1,314 @@
+# Hunyuan 3D is licensed under the TENCENT HUNYUAN NON-COMMERCIAL LICENSE AGREEMENT
+# except for the third-party components listed below.
+# Hunyuan 3D does not impose any additional limitations beyond what is outlined
+# in the repsective licenses of these third-party components.
+# Users must comply with all terms and conditions of original licenses of these third-party
+# components and must ensure that the usage of the third party components adheres to
+# all relevant laws and regulations.
+
+# For avoidance of doubts, Hunyuan 3D means the large language models and
+# their software and algorithms, including trained model weights, parameters (including
+# optimizer states), machine-learning model code, inference-enabling code, training-enabling code,
+# fine-tuning enabling code and other elements of the foregoing made publicly available
+# by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
+
+"""
+Iteration-level continuous batching for `Hunyuan3DDiTFlowMatchingPipeline`.
+
+Requests are merged at the granularity of single denoising steps: every iteration runs one DiT forward
+over all in-flight requests, each at its own timestep, then new requests join and finished ones leave.
+Finished latents go to a separate thread for VAE decoding and surface extraction, so meshing overlaps
+with the next denoising steps.
+
+Example:
+```python
+engine = ContinuousBatchingEngine(pipeline, max_batch_size=8)
+mesh = engine.generate(image, num_inference_steps=5, generator=torch.manual_seed(0))
+```
+"""
+
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Optional
+
+import numpy as np
+import torch
+
+from .schedulers import FlowMatchEulerDiscreteScheduler, ConsistencyFlowMatchEulerDiscreteScheduler
+from .utils import logger, map_tensors
+
+# schedulers whose step is a plain Euler update, the only one that can be applied per row; subclasses
+# such as the Heun, midpoint and multistep schedulers keep state across steps and are not included
+BATCHED_SCHEDULERS = (FlowMatchEulerDiscreteScheduler, ConsistencyFlowMatchEulerDiscreteScheduler)
+
+
+def cat_cond(conds):
+    """Concatenate (possibly nested) conditioning dicts along the batch dimension."""
+    first = conds[0]
+    if isinstance(first, torch.Tensor):
+        return torch.cat(conds, dim=0)
+    if isinstance(first, dict):
+        return {k: cat_cond([c[k] for c in conds]) for k in first}
+    return first
+
+
+def flow_matching_sigmas(scheduler, num_inference_steps: int) -> torch.Tensor:
+    """The sigmas, with the trailing 1, that `scheduler.set_timesteps` builds for the pipeline's schedule."""
+    if type(scheduler) is FlowMatchEulerDiscreteScheduler:
+        # the pipeline passes sigmas=linspace(0, 1), which set_timesteps shifts
+        sigmas = np.linspace(0, 1, num_inference_steps)
+        shift = scheduler.config.shift
+        sigmas = torch.from_numpy(shift * sigmas / (1 + (shift - 1) * sigmas)).to(torch.float32)
+    elif type(scheduler) is ConsistencyFlowMatchEulerDiscreteScheduler:
+        inference_indices = np.linspace(0, scheduler.config.pcm_timesteps, num=num_inference_steps, endpoint=False)
+        inference_indices = torch.from_numpy(np.floor(inference_indices).astype(np.int64))
+        sigmas = scheduler.sigmas[inference_indices]
+    else:
+        raise ValueError(f'Continuous batching does not support {type(scheduler).__name__}, '
+                         f'available: {[cls.__name__ for cls in BATCHED_SCHEDULERS]}')
+    return torch.cat([sigmas, torch.ones(1)])
+
+
+class BatchedRequest:
+    def __init__(self, image, num_inference_steps, guidance_scale, generator, export_kwargs):
+        self.image = image
+        self.num_inference_steps = num_inference_steps
+        self.guidance_scale = guidance_scale
+        self.generator = generator
+        self.export_kwargs = export_kwargs
+        self.future = Future()
+        self.step = 0
+        self.sigmas = None
+        self.latents = None
+        self.cond = None
+        self.uncond = None
+
+    @property
+    def export_key(self):
+        return tuple(sorted(self.export_kwargs.items()))
+
+
+class ContinuousBatchingEngine:
+    """
+    Serve many generation requests with one shared denoising loop.
+
+    Each request keeps its own step count, guidance scale, generator and sigma schedule. The update is
+    the Euler flow-matching step of the pipeline's scheduler, applied per row, so only the schedulers in
+    `BATCHED_SCHEDULERS` are supported. Requests that
+    use classifier-free guidance add their unconditional rows to the same forward pass. Finished
+    requests with the same export settings are decoded together.
+
+    Args:
+        pipeline: a `Hunyuan3DDiTFlowMatchingPipeline`. Its block cache must be disabled, because the rows
+            of one batch sit at different timesteps.
+        max_batch_size: maximum number of requests denoised together.
+    """
+
+    def __init__(self, pipeline, max_batch_size: int = 8):
+        if getattr(pipeline.model, 'block_cache', None) is not None:
+            raise ValueError('Continuous batching mixes timesteps in one batch, disable the block cache first.')
+        if type(pipeline.scheduler) not in BATCHED_SCHEDULERS:
+            raise ValueError(f'Continuous batching does not support {type(pipeline.scheduler).__name__}, '
+                             f'available: {[cls.__name__ for cls in BATCHED_SCHEDULERS]}')
+        if pipeline.scheduler.config.get('use_dynamic_shifting', False):
+            raise ValueError('Continuous batching does not support dynamic shifting schedulers.')
+        self.pipeline = pipeline
+        self.max_batch_size = max_batch_size
+        self.guidance_embed = getattr(pipeline.model, 'guidance_embed', False) is True
+        self.num_train_timesteps = pipeline.scheduler.config.num_train_timesteps
+
+        self.pending = queue.Queue()
+        self.decode_queue = queue.Queue()
+        self.active = []
+        self.stopped = threading.Event()
+        self.stats = {'iterations': 0, 'model_batch_evals': 0, 'completed': 0}
+        self.denoise_thread = threading.Thread(target=self._denoise_loop, name='denoise', daemon=True)
+        self.decode_thread = threading.Thread(target=self._decode_loop, name='decode', daemon=True)
+        self.denoise_thread.start()
+        self.decode_thread.start()
+
+    def submit(
+        self,
+        image,
+        num_inference_steps: int = 5,
+        guidance_scale: float = 5.0,
+        generator=None,
+        box_v=1.01,
+        octree_resolution=384,
+        mc_level=0.0,
+        num_chunks=8000,
+        output_type: str = 'trimesh',
+        memory_budget: Optional[int] = None,
+    ) -> Future:
+        """Queue one request; the future resolves to its mesh (or latents with `output_type='latent'`)."""
+        export_kwargs = dict(
+            output_type=output_type,
+            box_v=box_v,
+            octree_resolution=octree_resolution,
+            mc_level=mc_level,
+            num_chunks=num_chunks,
+            memory_budget=memory_budget,
+        )
+        request = BatchedRequest(image, num_inference_steps, guidance_scale, generator, export_kwargs)
+        self.pending.put(request)
+        return request.future
+
+    def generate(self, image, **kwargs):
+        return self.submit(image, **kwargs).result()
+
+    def get_status(self):
+        return {
+            'pending': self.pending.qsize(),
+            'active': len(self.active),
+            'decoding': self.decode_queue.qsize(),
+            **self.stats,
+        }
+
+    def shutdown(self):
+        self.stopped.set()
+        self.decode_queue.put(None)
+        self.denoise_thread.join()
+        self.decode_thread.join()
+
+    def _admit(self):
+        while len(self.active) < self.max_batch_size:
+            try:
+                # wait for work only when nothing is in flight
+                request = self.pending.get(timeout=0.1) if not self.active else self.pending.get_nowait()
+            except queue.Empty:
+                return
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            try:
+                self._prepare(request)
+            except Exception as e:
+                logger.exception('Failed to prepare a batched request')
+                request.future.set_exception(e)
+                continue
+            self.active.append(request)
+
+    @torch.no_grad()
+    def _prepare(self, request: BatchedRequest):
+        pipeline = self.pipeline
+        do_classifier_free_guidance = request.guidance_scale >= 0 and not self.guidance_embed
+        cond_inputs = pipeline.prepare_image(request.image)
+        image = cond_inputs.pop('image')
+        if image.shape[0] != 1:
+            raise ValueError('Each batched request takes a single image (or a single set of views).')
+        cond = pipeline.encode_cond(
+            image=image,
+            additional_cond_inputs=cond_inputs,
+            do_classifier_free_guidance=do_classifier_free_guidance,
+            dual_guidance=False,
+        )
+        if do_classifier_free_guidance:
+            request.cond = map_tensors(lambda t: t[:1], cond)
+            request.uncond = map_tensors(lambda t: t[1:], cond)
+        else:
+            request.cond = cond
+        request.latents = pipeline.prepare_latents(1, pipeline.dtype, pipeline.device, request.generator)
+        request.sigmas = flow_matching_sigmas(pipeline.scheduler, request.num_inference_steps)
+        request.image = None
+
+    @torch.no_grad()
+    def _step(self):
+        active = self.active
+        device = self.pipeline.device
+        num_rows = len(active)
+        latents = torch.cat([r.latents for r in active])
+        sigma = torch.stack([r.sigmas[r.step] for r in active]).to(device)
+        sigma_next = torch.stack([r.sigmas[r.step + 1] for r in active]).to(device)
+        # same rounding as the pipeline, which feeds `t.to(dtype) / num_train_timesteps` with t = sigma * N
+        timestep = (sigma * self.num_train_timesteps).to(latents.dtype) / self.num_train_timesteps
+
+        cond = cat_cond([r.cond for r in active])
+        guided = [i for i, r in enumerate(active) if r.uncond is not None]
+        model_input, model_timestep, model_cond = latents, timestep, cond
+        if guided:
+            index = torch.tensor(guided, device=device)
+            model_input = torch.cat([latents, latents[index]])
+            model_timestep = torch.cat([timestep, timestep[index]])
+            model_cond = cat_cond([cond, cat_cond([active[i].uncond for i in guided])])
+
+        guidance = None
+        if self.guidance_embed:
+            guidance = torch.tensor([r.guidance_scale for r in active], device=device, dtype=latents.dtype)
+
+        noise_pred = self.pipeline.model(model_input, model_timestep, model_cond, guidance=guidance)
+        self.stats['iterations'] += 1
+        self.stats['model_batch_evals'] += model_input.shape[0]
+
+        pred = noise_pred[:num_rows]
+        if guided:
+            pred = pred.clone()
+            uncond = noise_pred[num_rows:]
+            scale = torch.tensor([active[i].guidance_scale for i in guided], device=device, dtype=pred.dtype)
+            scale = scale.view(-1, *([1] * (pred.dim() - 1)))
+            pred[index] = uncond + scale * (pred[index] - uncond)
+
+        # the Euler step of both batched schedulers, with one sigma pair per row
+        delta = (sigma_next - sigma).view(-1, *([1] * (pred.dim() - 1)))
+        latents = (latents.to(torch.float32) + delta * pred).to(pred.dtype)
+
+        still_active = []
+        for i, request in enumerate(active):
+            request.latents = latents[i:i + 1]
+            request.step += 1
+            if request.step == request.num_inference_steps:
+                request.cond = request.uncond = None
+                self.decode_queue.put(request)
+            else:
+                still_active.append(request)
+        self.active = still_active
+
+    def _denoise_loop(self):
+        while not self.stopped.is_set():
+            self._admit()
+            if not self.active:
+                continue
+            try:
+                self._step()
+            except Exception as e:
+                logger.exception('Denoising step failed, dropping the running batch')
+                for request in self.active:
+                    request.future.set_exception(e)
+                self.active = []
+
+    def _decode_loop(self):
+        done = False
+        while not done:
+            batch = [self.decode_queue.get()]
+            # decode whatever else finished meanwhile in the same pass
+            while True:
+                try:
+                    batch.append(self.decode_queue.get_nowait())
+                except queue.Empty:
+                    break
+            done = None in batch
+            groups = {}
+            for request in batch:
+                if request is not None:
+                    groups.setdefault(request.export_key, []).append(request)
+            for requests in groups.values():
+                self._decode(requests)
+
+    @torch.no_grad()
+    def _decode(self, requests):
+        kwargs = requests[0].export_kwargs
+        try:
+            outputs = self.pipeline._export(
+                torch.cat([r.latents for r in requests]),
+                kwargs['output_type'],
+                kwargs['box_v'], kwargs['mc_level'], kwargs['num_chunks'], kwargs['octree_resolution'], None,
+                enable_pbar=False,
+                memory_budget=kwargs['memory_budget'],
+            )
+        except Exception as e:
+            logger.exception('Decoding failed')
+            for request in requests:
+                request.future.set_exception(e)
+            return
+        for i, request in enumerate(requests):
+            request.future.set_result(outputs[i])
+            self.stats['completed'] += 1
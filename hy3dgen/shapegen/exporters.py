@@ -0,0 +1,166 @@
+# Hunyuan 3D is licensed under the TENCENT HUNYUAN NON-COMMERCIAL LICENSE AGREEMENT
+# except for the third-party components listed below.
+# Hunyuan 3D does not impose any additional limitations beyond what is outlined
+# in the repsective licenses of these third-party components.
+# Users must comply with all terms and conditions of original licenses of these third-party
+# components and must ensure that the usage of the third party components adheres to
+# all relevant laws and regulations.
+
+# For avoidance of doubts, Hunyuan 3D means the large language models and
+# their software and algorithms, including trained model weights, parameters (including
+# optimizer states), machine-learning model code, inference-enabling code, training-enabling code,
+# fine-tuning enabling code and other elements of the foregoing made publicly available
+# by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
+
+"""
+Writers that serialize `Latent2MeshOutput` arrays straight to GLB, PLY or OBJ.
+
+Unlike `trimesh.Trimesh(...).export(...)` nothing is validated or merged: the vertex buffer is written
+as is when it is already little-endian float32, and the face buffer is converted once to uint32 (which
+also applies the winding flip of `export_to_trimesh`).
+"""
+
+import json
+import os
+import struct
+from typing import BinaryIO, Optional, Union
+
+import numpy as np
+
+from .models.autoencoders import Latent2MeshOutput
+
+MESH_FILE_TYPES = ['glb', 'ply', 'obj']
+
+
+def weld_vertices(vertices: np.ndarray, faces: np.ndarray):
+    """Merge vertices with identical positions and drop the ones no face references."""
+    unique, inverse = np.unique(vertices, axis=0, return_inverse=True)
+    faces = inverse.reshape(-1)[faces]
+    used = np.zeros(len(unique), dtype=bool)
+    used[faces.reshape(-1)] = True
+    new_index = np.cumsum(used) - 1
+    return unique[used], new_index[faces]
+
+
+def _mesh_arrays(mesh: Latent2MeshOutput, weld: bool, flip_faces: bool):
+    vertices = np.asarray(mesh.mesh_v)
+    faces = np.asarray(mesh.mesh_f)
+    if weld:
+        vertices, faces = weld_vertices(vertices, faces)
+    if flip_faces:
+        faces = faces[:, ::-1]
+    vertices = np.ascontiguousarray(vertices, dtype='<f4')
+    faces = np.ascontiguousarray(faces, dtype='<u4')
+    return vertices, faces
+
+
+def _pad4(data: bytes, fill: bytes) -> bytes:
+    return data + fill * (-len(data) % 4)
+
+
+def write_glb(file_obj: BinaryIO, vertices: np.ndarray, faces: np.ndarray):
+    positions_size = vertices.nbytes
+    indices_size = faces.nbytes
+    gltf = {
+        'asset': {'version': '2.0', 'generator': 'hy3dgen'},
+        'scene': 0,
+        'scenes': [{'nodes': [0]}],
+        'nodes': [{'mesh': 0}],
+        'meshes': [{'primitives': [{'attributes': {'POSITION': 0}, 'indices': 1, 'mode': 4}]}],
+        'accessors': [
+            {
+                'bufferView': 0,
+                'componentType': 5126,
+                'count': len(vertices),
+                'type': 'VEC3',
+                'min': vertices.min(axis=0).tolist() if len(vertices) else [0.0] * 3,
+                'max': vertices.max(axis=0).tolist() if len(vertices) else [0.0] * 3,
+            },
+            {
+                'bufferView': 1,
+                'componentType': 5125,
+                'count': faces.size,
+                'type': 'SCALAR',
+            },
+        ],
+        'bufferViews': [
+            {'buffer': 0, 'byteOffset': 0, 'byteLength': positions_size, 'target': 34962},
+            {'buffer': 0, 'byteOffset': positions_size, 'byteLength': indices_size, 'target': 34963},
+        ],
+        'buffers': [{'byteLength': positions_size + indices_size}],
+    }
+    # float32 and uint32 buffers are 4-byte sized, so only the JSON chunk needs padding
+    json_chunk = _pad4(json.dumps(gltf, separators=(',', ':')).encode('utf-8'), b' ')
+    bin_size = positions_size + indices_size
+    total_size = 12 + 8 + len(json_chunk) + 8 + bin_size
+    file_obj.write(struct.pack('<4sII', b'glTF', 2, total_size))
+    file_obj.write(struct.pack('<I4s', len(json_chunk), b'JSON'))
+    file_obj.write(json_chunk)
+    file_obj.write(struct.pack('<I4s', bin_size, b'BIN\x00'))
+    file_obj.write(vertices.data)
+    file_obj.write(faces.data)
+
+
+def write_ply(file_obj: BinaryIO, vertices: np.ndarray, faces: np.ndarray):
+    header = (
+        'ply\n'
+        'format binary_little_endian 1.0\n'
+        f'element vertex {len(vertices)}\n'
+        'property float x\n'
+        'property float y\n'
+        'property float z\n'
+        f'element face {len(faces)}\n'
+        'property list uchar uint vertex_indices\n'
+        'end_header\n'
+    )
+    file_obj.write(header.encode('ascii'))
+    file_obj.write(vertices.data)
+    # each face record is a uchar count followed by the three indices
+    records = np.empty(len(faces), dtype=[('count', 'u1'), ('indices', '<u4', (3,))])
+    records['count'] = 3
+    records['indices'] = faces
+    file_obj.write(records.data)
+
+
+def write_obj(file_obj: BinaryIO, vertices: np.ndarray, faces: np.ndarray):
+    np.savetxt(file_obj, vertices, fmt='v %.7g %.7g %.7g')
+    np.savetxt(file_obj, faces.astype(np.int64) + 1, fmt='f %d %d %d')
+
+
+MESH_WRITERS = {
+    'glb': write_glb,
+    'ply': write_ply,
+    'obj': write_obj,
+}
+
+
+def export_mesh_output(
+    mesh: Latent2MeshOutput,
+    file_obj: Union[str, BinaryIO],
+    file_type: Optional[str] = None,
+    weld: bool = False,
+    flip_faces: bool = True,
+):
+    """Write a `Latent2MeshOutput` to a path or binary file object.
+
+    Args:
+        file_type: one of `MESH_FILE_TYPES`, inferred from the path suffix when omitted.
+        weld: merge vertices with identical positions, which `trimesh.Trimesh` does by default.
+        flip_faces: reverse the face winding like `export_to_trimesh` does.
+    """
+    if file_type is None:
+        if not isinstance(file_obj, str):
+            raise ValueError('file_type is required when writing to a file object')
+        file_type = os.path.splitext(file_obj)[1][1:]
+    file_type = file_type.lower()
+    if file_type not in MESH_WRITERS:
+        raise ValueError(f'Unsupported mesh file type {file_type}, available: {MESH_FILE_TYPES}')
+
+    vertices, faces = _mesh_arrays(mesh, weld=weld, flip_faces=flip_faces)
+    writer = MESH_WRITERS[file_type]
+    if isinstance(file_obj, str):
+        with open(file_obj, 'wb') as f:
+            writer(f, vertices, faces)
+    else:
+        writer(file_obj, vertices, faces)
+    return file_obj
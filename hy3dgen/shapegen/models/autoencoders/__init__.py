@@ -15,6 +15,9 @@
 from .attention_blocks import CrossAttentionDecoder
 from .attention_processors import FlashVDMCrossAttentionProcessor, CrossAttentionProcessor, \
     FlashVDMTopMCrossAttentionProcessor
+from .memory_budget import calibrate_bytes_per_query, estimate_bytes_per_query, num_chunks_for_budget
 from .model import ShapeVAE, VectsetVAE
-from .surface_extractors import SurfaceExtractors, MCSurfaceExtractor, DMCSurfaceExtractor, Latent2MeshOutput
-from .volume_decoders import HierarchicalVolumeDecoding, FlashVDMVolumeDecoding, VanillaVolumeDecoder
+from .surface_extractors import SurfaceExtractors, MCSurfaceExtractor, DMCSurfaceExtractor, SparseMCSurfaceExtractor, \
+    ParallelMCSurfaceExtractor, Latent2MeshOutput
+from .volume_decoders import HierarchicalVolumeDecoding, FlashVDMVolumeDecoding, VanillaVolumeDecoder, SparseVolume, \
+    QueryGridCache
@@ -182,6 +182,40 @@ class MLP(nn.Module):
         return self.drop_path(self.c_proj(self.gelu(self.c_fc(x))))
 
 
+class CachedLatentKV:
+    """Cross-attention keys and values of a batch of latents, projected once and reused for every query chunk.
+
+    Produced by `CrossAttentionDecoder.prepare_latents` and accepted wherever the decoder takes `latents`.
+    A batch of one is broadcast against any number of query batches. Cell-wise FlashVDM calls may also pack
+    the queries of every sample into a single batch; the processor then picks each cell's sample.
+    """
+
+    def __init__(self, k: torch.Tensor, v: torch.Tensor):
+        self.k = k
+        self.v = v
+
+    @property
+    def shape(self):
+        bs, heads, n_data, head_dim = self.k.shape
+        return torch.Size([bs, n_data, heads * head_dim])
+
+    @property
+    def dtype(self):
+        return self.k.dtype
+
+    @property
+    def device(self):
+        return self.k.device
+
+    def __len__(self):
+        return self.k.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            index = slice(index, index + 1)
+        return CachedLatentKV(self.k[index], self.v[index])
+
+
 class QKVMultiheadCrossAttention(nn.Module):
     def __init__(
         self,
@@ -200,17 +234,26 @@ class QKVMultiheadCrossAttention(nn.Module):
 
         self.attn_processor = CrossAttentionProcessor()
 
-    def forward(self, q, kv):
-        _, n_ctx, _ = q.shape
+    def prepare_kv(self, kv):
         bs, n_data, width = kv.shape
         attn_ch = width // self.heads // 2
-        q = q.view(bs, n_ctx, self.heads, -1)
         kv = kv.view(bs, n_data, self.heads, -1)
         k, v = torch.split(kv, attn_ch, dim=-1)
+        k = self.k_norm(k)
+        k, v = map(lambda t: rearrange(t, 'b n h d -> b h n d', h=self.heads), (k, v))
+        return CachedLatentKV(k, v)
 
+    def forward(self, q, kv):
+        bs, n_ctx, _ = q.shape
+        if not isinstance(kv, CachedLatentKV):
+            kv = self.prepare_kv(kv)
+        k, v = kv.k, kv.v
+        if k.shape[0] == 1 and bs != 1:
+            k = k.expand(bs, -1, -1, -1)
+            v = v.expand(bs, -1, -1, -1)
+        q = q.view(bs, n_ctx, self.heads, -1)
         q = self.q_norm(q)
-        k = self.k_norm(k)
-        q, k, v = map(lambda t: rearrange(t, 'b n h d -> b h n d', h=self.heads), (q, k, v))
+        q = rearrange(q, 'b n h d -> b h n d', h=self.heads)
         out = self.attn_processor(self, q, k, v)
         out = out.transpose(1, 2).reshape(bs, n_ctx, -1)
         return out
@@ -247,14 +290,18 @@ class MultiheadCrossAttention(nn.Module):
         self.kv_cache = kv_cache
         self.data = None
 
+    def prepare_kv(self, data):
+        return self.attention.prepare_kv(self.c_kv(data))
+
     def forward(self, x, data):
         x = self.c_q(x)
-        if self.kv_cache:
+        cached = isinstance(data, CachedLatentKV)
+        if self.kv_cache and not cached:
             if self.data is None:
                 self.data = self.c_kv(data)
                 logger.info('Save kv cache,this should be called only once for one mesh')
             data = self.data
-        else:
+        elif not cached:
             data = self.c_kv(data)
         x = self.attention(x, data)
         x = self.c_proj(x)
@@ -293,8 +340,13 @@ class ResidualCrossAttentionBlock(nn.Module):
         self.ln_3 = norm_layer(width, elementwise_affine=True, eps=1e-6)
         self.mlp = MLP(width=width, expand_ratio=mlp_expand_ratio)
 
-    def forward(self, x: torch.Tensor, data: torch.Tensor):
-        x = x + self.attn(self.ln_1(x), self.ln_2(data))
+    def prepare_kv(self, data: torch.Tensor):
+        return self.attn.prepare_kv(self.ln_2(data))
+
+    def forward(self, x: torch.Tensor, data: Union[torch.Tensor, CachedLatentKV]):
+        if not isinstance(data, CachedLatentKV):
+            data = self.ln_2(data)
+        x = x + self.attn(self.ln_1(x), data)
         x = x + self.mlp(self.ln_3(x))
         return x
 
@@ -481,11 +533,24 @@ class CrossAttentionDecoder(nn.Module):
     def set_default_cross_attention_processor(self):
         self.cross_attn_decoder.attn.attention.attn_processor = CrossAttentionProcessor
 
+    def prepare_latents(self, latents: torch.Tensor) -> CachedLatentKV:
+        """Project the latents to cross-attention keys and values once per mesh.
+
+        Pass the result as `latents` to stream any number of query chunks against it without
+        re-running `latents_proj` and the K/V projection for every chunk.
+        """
+        if self.downsample_ratio != 1:
+            latents = self.latents_proj(latents)
+        return self.cross_attn_decoder.prepare_kv(latents)
+
+    def embed_queries(self, queries: torch.Tensor, dtype: torch.dtype):
+        return self.query_proj(self.fourier_embedder(queries).to(dtype))
+
     def forward(self, queries=None, query_embeddings=None, latents=None):
         if query_embeddings is None:
-            query_embeddings = self.query_proj(self.fourier_embedder(queries).to(latents.dtype))
+            query_embeddings = self.embed_queries(queries, latents.dtype)
         self.count += query_embeddings.shape[1]
-        if self.downsample_ratio != 1:
+        if self.downsample_ratio != 1 and not isinstance(latents, CachedLatentKV):
             latents = self.latents_proj(latents)
         x = self.cross_attn_decoder(query_embeddings, latents)
         if self.enable_ln_post:
@@ -33,8 +33,24 @@ class CrossAttentionProcessor:
 
 
 class FlashVDMCrossAttentionProcessor:
+    """Cross attention restricted to the latent tokens most relevant to each group of queries.
+
+    `topk` selects the mode of the next call:
+        - True: every query batch (one mini grid each) picks its own top-k tokens;
+        - False: plain attention over all tokens;
+        - a 1D tensor of per-cell query counts: the queries are contiguous runs of grid cells and every
+          cell attends to its own selected tokens. All cells of the call are handled in one batched
+          attention over cell-padded queries. The legacy ``[grid_indices, counts]`` lists are accepted too.
+
+    With per-cell counts, `cell_batch` may hold the sample index of every cell. The queries of all samples
+    are then packed into a single batch and each cell attends to the tokens of its own sample.
+    """
+
+    sample_stride = 50
+
     def __init__(self, topk=None):
         self.topk = topk
+        self.cell_batch = None
 
     def __call__(self, attn, q, k, v):
         if k.shape[-2] == 3072:
@@ -56,41 +72,105 @@ class FlashVDMCrossAttentionProcessor:
         elif self.topk is False:
             out = scaled_dot_product_attention(q, k, v)
         else:
-            idx, counts = self.topk
-            start = 0
-            outs = []
-            for grid_coord, count in zip(idx, counts):
-                end = start + count
-                q_chunk = q[:, :, start:end, :]
-                k0, v0 = self.select_topkv(q_chunk, k, v, topk)
-                out = scaled_dot_product_attention(q_chunk, k0, v0)
-                outs.append(out)
-                start += count
-            out = torch.cat(outs, dim=-2)
+            counts = self.topk
+            if isinstance(counts, (list, tuple)):
+                counts = torch.as_tensor(counts[1], device=q.device)
+            out = self.cellwise_attention(q, k, v, counts, topk, self.cell_batch)
         self.topk = False
+        self.cell_batch = None
         return out
 
-    def select_topkv(self, q_chunk, k, v, topk):
-        q1 = q_chunk[:, :, ::50, :]
-        sim = q1 @ k.transpose(-1, -2)
-        sim = torch.mean(sim, -2)
-        topk_ind = torch.topk(sim, dim=-1, k=topk).indices.squeeze(-2).unsqueeze(-1)
-        topk_ind = topk_ind.expand(-1, -1, -1, v.shape[-1])
-        v0 = torch.gather(v, dim=-2, index=topk_ind)
-        k0 = torch.gather(k, dim=-2, index=topk_ind)
-        return k0, v0
+    @staticmethod
+    def cell_similarity(q, k, cell_batch=None):
+        """Scores of cell queries ``(bs, heads, cells, n, d)`` against the tokens of each cell's sample."""
+        if cell_batch is None:
+            return q @ k.unsqueeze(2).transpose(-1, -2)
+        sim = None
+        for b in range(k.shape[0]):
+            sim_b = q @ k[b:b + 1].unsqueeze(2).transpose(-1, -2)
+            sim = sim_b if sim is None else torch.where((cell_batch == b)[:, None, None], sim_b, sim)
+        return sim
+
+    @staticmethod
+    def gather_cell_tokens(t, index, cell_batch=None):
+        """Gather ``(bs, heads, cells, n, d)`` tokens of `t` at the per-cell token `index` ``(bs, heads, cells, n)``."""
+        num_cells = index.shape[2]
+        if cell_batch is not None:
+            # address the tokens of all samples at once
+            index = index + (cell_batch * t.shape[-2])[:, None]
+            t = t.transpose(0, 1).reshape(1, t.shape[1], -1, t.shape[-1])
+        index = index.unsqueeze(-1).expand(-1, -1, -1, -1, t.shape[-1])
+        return torch.gather(t.unsqueeze(2).expand(-1, -1, num_cells, -1, -1), dim=-2, index=index)
+
+    def cellwise_attention(self, q, k, v, counts, topk, cell_batch=None):
+        bs, heads, num_queries, head_dim = q.shape
+        num_cells = counts.shape[0]
+        device = q.device
+
+        # scatter the contiguous cell runs into a [cells, max_count] padded layout
+        max_count = int(counts.max())
+        if num_cells == 1:
+            padded_index = None
+            padded = q.unsqueeze(2)
+        else:
+            cell_of_query = torch.repeat_interleave(torch.arange(num_cells, device=device), counts)
+            starts = torch.cumsum(counts, 0) - counts
+            padded_index = torch.arange(num_queries, device=device) + cell_of_query * max_count - starts[cell_of_query]
+            padded = q.new_zeros((bs, heads, num_cells * max_count, head_dim))
+            padded.index_copy_(2, padded_index, q)
+            padded = padded.view(bs, heads, num_cells, max_count, head_dim)
+
+        # every `sample_stride`-th query of a cell (from its first one) votes for the cell's tokens
+        samples = padded[:, :, :, ::self.sample_stride]
+        sample_offsets = torch.arange(0, max_count, self.sample_stride, device=device)
+        sample_mask = sample_offsets[None, :] < counts[:, None]
+
+        k0, v0, attn_mask = self.select_cell_kv(samples, sample_mask, k, v, topk, cell_batch)
+        padded = padded.reshape(bs, heads * num_cells, max_count, head_dim)
+        if attn_mask is None:
+            out = scaled_dot_product_attention(padded, k0, v0)
+        else:
+            out = F.scaled_dot_product_attention(padded, k0, v0, attn_mask=attn_mask)
+        out = out.view(bs, heads, num_cells * max_count, head_dim)
+        if padded_index is None:
+            return out
+        return out.index_select(2, padded_index)
+
+    def select_cell_kv(self, samples, sample_mask, k, v, topk, cell_batch=None):
+        """Gather the top-k tokens by mean similarity to each cell's sampled queries."""
+        bs, heads, num_cells, _, head_dim = samples.shape
+        weights = sample_mask.to(samples.dtype)[None, None, :, :, None]
+        q_mean = (samples * weights).sum(-2, keepdim=True) / weights.sum(-2, keepdim=True)
+        sim = self.cell_similarity(q_mean, k, cell_batch).squeeze(-2)
+        topk_ind = torch.topk(sim, dim=-1, k=topk).indices
+        k0 = self.gather_cell_tokens(k, topk_ind, cell_batch)
+        v0 = self.gather_cell_tokens(v, topk_ind, cell_batch)
+        k0 = k0.reshape(bs, heads * num_cells, topk, head_dim)
+        v0 = v0.reshape(bs, heads * num_cells, topk, head_dim)
+        return k0, v0, None
 
 
 class FlashVDMTopMCrossAttentionProcessor(FlashVDMCrossAttentionProcessor):
-    def select_topkv(self, q_chunk, k, v, topk):
-        q1 = q_chunk[:, :, ::30, :]
-        sim = q1 @ k.transpose(-1, -2)
-        # sim = sim.to(torch.float32)
+    sample_stride = 30
+
+    def select_cell_kv(self, samples, sample_mask, k, v, topk, cell_batch=None):
+        """Keep every token that any sampled query of the cell attends to with weight > 1e-6."""
+        bs, heads, num_cells, _, head_dim = samples.shape
+        sim = self.cell_similarity(samples, k, cell_batch)
         sim = sim.softmax(-1)
         sim = torch.mean(sim, 1)
-        activated_token = torch.where(sim > 1e-6)[2]
-        index = torch.unique(activated_token, return_counts=True)[0].unsqueeze(0).unsqueeze(0).unsqueeze(-1)
-        index = index.expand(-1, v.shape[1], -1, v.shape[-1])
-        v0 = torch.gather(v, dim=-2, index=index)
-        k0 = torch.gather(k, dim=-2, index=index)
-        return k0, v0
+        activated = (sim > 1e-6) & sample_mask[None, :, :, None]
+        activated = activated.any(dim=2).any(dim=0)
+
+        # activated tokens first (in token order), padded to the largest selection and masked out
+        num_selected = activated.sum(-1)
+        max_selected = int(num_selected.max())
+        index = torch.argsort((~activated).to(torch.uint8), dim=-1, stable=True)[:, :max_selected]
+        attn_mask = torch.arange(max_selected, device=k.device)[None, :] < num_selected[:, None]
+        index = index[None, None].expand(bs, heads, -1, -1)
+        k0 = self.gather_cell_tokens(k, index, cell_batch)
+        v0 = self.gather_cell_tokens(v, index, cell_batch)
+        k0 = k0.reshape(bs, heads * num_cells, max_selected, head_dim)
+        v0 = v0.reshape(bs, heads * num_cells, max_selected, head_dim)
+        attn_mask = attn_mask.unsqueeze(0).expand(heads, -1, -1).reshape(1, heads * num_cells, 1, max_selected)
+        return k0, v0, attn_mask
@@ -0,0 +1,157 @@
+# Hunyuan 3D is licensed under the TENCENT HUNYUAN NON-COMMERCIAL LICENSE AGREEMENT
+# except for the third-party components listed below.
+# Hunyuan 3D does not impose any additional limitations beyond what is outlined
+# in the repsective licenses of these third-party components.
+# Users must comply with all terms and conditions of original licenses of these third-party
+# components and must ensure that the usage of the third party components adheres to
+# all relevant laws and regulations.
+
+# For avoidance of doubts, Hunyuan 3D means the large language models and
+# their software and algorithms, including trained model weights, parameters (including
+# optimizer states), machine-learning model code, inference-enabling code, training-enabling code,
+# fine-tuning enabling code and other elements of the foregoing made publicly available
+# by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
+
+"""
+Derive the volume decoders' `num_chunks` from a memory budget in bytes.
+
+The activation memory of a geo decoder call grows linearly with the number of queries, so a budget maps
+to a chunk size through the bytes needed per query. That figure is estimated from the decoder config, or
+measured once with `calibrate_bytes_per_query` and persisted per model config:
+
+    vae.calibrate_decoder_memory()
+    mesh = pipeline(image=image, memory_budget=4 * 1024 ** 3)[0]
+"""
+
+import json
+import os
+from typing import Optional, Tuple
+
+import torch
+
+from .attention_blocks import CrossAttentionDecoder
+from ...utils import logger
+
+CALIBRATION_FILE = 'decoder_memory_calibration.json'
+
+
+def calibration_path():
+    base_dir = os.environ.get('HY3DGEN_MODELS', '~/.cache/hy3dgen')
+    return os.path.expanduser(os.path.join(base_dir, CALIBRATION_FILE))
+
+
+def load_calibration(path: Optional[str] = None):
+    path = path or calibration_path()
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _check_decoder(geo_decoder):
+    if not isinstance(geo_decoder, CrossAttentionDecoder):
+        raise ValueError(f'memory budgets need a CrossAttentionDecoder, got {type(geo_decoder).__name__}')
+
+
+def decoder_config_key(geo_decoder: CrossAttentionDecoder, num_latents: int, dtype: torch.dtype, device):
+    attention = geo_decoder.cross_attn_decoder.attn.attention
+    width = geo_decoder.query_proj.out_features
+    device = torch.device(device)
+    device_name = torch.cuda.get_device_name(device) if device.type == 'cuda' else device.type
+    return f'w{width}-h{attention.heads}-l{num_latents}-{str(dtype).replace("torch.", "")}-{device_name}'
+
+
+def estimate_bytes_per_query(geo_decoder: CrossAttentionDecoder, num_latents: int, dtype: torch.dtype):
+    """Analytic activation bytes per query of one geo decoder call.
+
+    Counts the largest set of per-query tensors alive at once: the Fourier features, the residual stream
+    and either the MLP hidden states or the attention scores over all latent tokens, whichever is larger.
+    Attention backends that do not materialize the scores need less, so this errs on the safe side.
+    """
+    _check_decoder(geo_decoder)
+    block = geo_decoder.cross_attn_decoder
+    width = geo_decoder.query_proj.out_features
+    heads = block.attn.attention.heads
+    hidden = block.mlp.c_fc.out_features
+    element_size = torch.empty((), dtype=dtype).element_size()
+    # the Fourier features are computed in float32 before the cast to the decoder dtype
+    fourier = (3 + geo_decoder.fourier_embedder.out_dim) * 4
+    mlp = 2 * hidden
+    attention = 2 * width + 2 * heads * num_latents
+    return fourier + element_size * (2 * width + max(mlp, attention))
+
+
+@torch.no_grad()
+def calibrate_bytes_per_query(
+    geo_decoder: CrossAttentionDecoder,
+    dtype: torch.dtype,
+    device,
+    num_latents: Optional[int] = None,
+    num_queries: Tuple[int, int] = (8192, 32768),
+    path: Optional[str] = None,
+):
+    """Measure the peak memory per query of `geo_decoder` and persist it for its config.
+
+    Decodes two chunk sizes against random latents and takes the slope of the peak allocated memory, so
+    the weights and cached K/V are not counted. Only CUDA memory can be measured; on other devices the
+    analytic estimate is stored instead.
+    """
+    _check_decoder(geo_decoder)
+    if num_latents is None:
+        num_latents = geo_decoder.cross_attn_decoder.attn.attention.n_data
+    device = torch.device(device)
+    if device.type == 'cuda':
+        width = geo_decoder.query_proj.out_features * geo_decoder.downsample_ratio
+        latents = torch.randn((1, num_latents, width), dtype=dtype, device=device)
+        latents = geo_decoder.prepare_latents(latents)
+        peaks = []
+        for n in num_queries:
+            queries = torch.rand((1, n, 3), dtype=dtype, device=device) * 2 - 1
+            torch.cuda.synchronize(device)
+            torch.cuda.reset_peak_memory_stats(device)
+            base = torch.cuda.memory_allocated(device)
+            geo_decoder(queries=queries, latents=latents)
+            torch.cuda.synchronize(device)
+            peaks.append(torch.cuda.max_memory_allocated(device) - base)
+            del queries
+        bytes_per_query = (peaks[1] - peaks[0]) / (num_queries[1] - num_queries[0])
+        measured = True
+    else:
+        bytes_per_query = estimate_bytes_per_query(geo_decoder, num_latents, dtype)
+        measured = False
+
+    path = path or calibration_path()
+    calibration = load_calibration(path)
+    key = decoder_config_key(geo_decoder, num_latents, dtype, device)
+    calibration[key] = {'bytes_per_query': bytes_per_query, 'measured': measured}
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(calibration, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+    logger.info(f'Calibrated {key}: {bytes_per_query:.0f} bytes per query (measured: {measured})')
+    return bytes_per_query
+
+
+def num_chunks_for_budget(
+    geo_decoder: CrossAttentionDecoder,
+    latents,
+    memory_budget: int,
+    path: Optional[str] = None,
+):
+    """Largest `num_chunks` whose query activations for the whole batch of `latents` fit in `memory_budget` bytes.
+
+    Uses the calibrated bytes per query of the decoder config when there is one, else the analytic estimate.
+    """
+    _check_decoder(geo_decoder)
+    if memory_budget <= 0:
+        raise ValueError(f'memory_budget must be positive, got {memory_budget}')
+    batch_size, num_latents = latents.shape[0], latents.shape[1]
+    entry = load_calibration(path).get(decoder_config_key(geo_decoder, num_latents, latents.dtype, latents.device))
+    if entry is not None:
+        bytes_per_query = entry['bytes_per_query']
+    else:
+        bytes_per_query = estimate_bytes_per_query(geo_decoder, num_latents, latents.dtype)
+    num_chunks = max(int(memory_budget // (bytes_per_query * batch_size)), 1)
+    logger.info(f'num_chunks={num_chunks} for a {memory_budget / 1024 ** 2:.0f} MiB budget')
+    return num_chunks
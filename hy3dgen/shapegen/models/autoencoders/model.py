@@ -14,7 +14,7 @@
 
 
 import os
-from typing import Union, List
+from typing import Union, List, Optional
 
 import numpy as np
 import torch
@@ -22,8 +22,9 @@ import torch.nn as nn
 import yaml
 
 from .attention_blocks import FourierEmbedder, Transformer, CrossAttentionDecoder, PointCrossAttentionEncoder
+from .memory_budget import calibrate_bytes_per_query
 from .surface_extractors import MCSurfaceExtractor, SurfaceExtractors
-from .volume_decoders import VanillaVolumeDecoder, FlashVDMVolumeDecoding, HierarchicalVolumeDecoding
+from .volume_decoders import VanillaVolumeDecoder, FlashVDMVolumeDecoding, HierarchicalVolumeDecoding, QueryGridCache
 from ...utils import logger, synchronize_timer, smart_load_model
 
 
@@ -167,26 +168,43 @@ class VectsetVAE(nn.Module):
             surface_extractor = MCSurfaceExtractor()
         self.volume_decoder = volume_decoder
         self.surface_extractor = surface_extractor
+        self.query_grid_cache = None
 
-    def latents2mesh(self, latents: torch.FloatTensor, **kwargs):
+    def enable_query_grid_cache(self, enabled: bool = True, max_bytes: int = 1024 ** 3):
+        self.query_grid_cache = QueryGridCache(max_bytes=max_bytes) if enabled else None
+
+    def calibrate_decoder_memory(self, dtype: Optional[torch.dtype] = None, device=None):
+        """Measure the geo decoder's memory per query once, for `memory_budget` in the volume decoders."""
+        param = next(self.geo_decoder.parameters())
+        return calibrate_bytes_per_query(self.geo_decoder, dtype or param.dtype, device or param.device)
+
+    def latents2grid(self, latents: torch.FloatTensor, **kwargs):
         with synchronize_timer('Volume decoding'):
-            grid_logits = self.volume_decoder(latents, self.geo_decoder, **kwargs)
+            grid_logits = self.volume_decoder(latents, self.geo_decoder, grid_cache=self.query_grid_cache, **kwargs)
+        return grid_logits
+
+    def grid2mesh(self, grid_logits, **kwargs):
         with synchronize_timer('Surface extraction'):
             outputs = self.surface_extractor(grid_logits, **kwargs)
         return outputs
 
+    def latents2mesh(self, latents: torch.FloatTensor, **kwargs):
+        grid_logits = self.latents2grid(latents, **kwargs)
+        return self.grid2mesh(grid_logits, **kwargs)
+
     def enable_flashvdm_decoder(
         self,
         enabled: bool = True,
         adaptive_kv_selection=True,
         topk_mode='mean',
         mc_algo='dmc',
+        sparse_output=False,
     ):
         if enabled:
             if adaptive_kv_selection:
-                self.volume_decoder = FlashVDMVolumeDecoding(topk_mode)
+                self.volume_decoder = FlashVDMVolumeDecoding(topk_mode, sparse_output=sparse_output)
             else:
-                self.volume_decoder = HierarchicalVolumeDecoding()
+                self.volume_decoder = HierarchicalVolumeDecoding(sparse_output=sparse_output)
             if mc_algo not in SurfaceExtractors.keys():
                 raise ValueError(f'Unsupported mc_algo {mc_algo}, available: {list(SurfaceExtractors.keys())}')
             self.surface_extractor = SurfaceExtractors[mc_algo]()
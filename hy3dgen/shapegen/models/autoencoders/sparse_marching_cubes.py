@@ -0,0 +1,198 @@
+# Hunyuan 3D is licensed under the TENCENT HUNYUAN NON-COMMERCIAL LICENSE AGREEMENT
+# except for the third-party components listed below.
+# Hunyuan 3D does not impose any additional limitations beyond what is outlined
+# in the repsective licenses of these third-party components.
+# Users must comply with all terms and conditions of original licenses of these third-party
+# components and must ensure that the usage of the third party components adheres to
+# all relevant laws and regulations.
+
+# For avoidance of doubts, Hunyuan 3D means the large language models and
+# their software and algorithms, including trained model weights, parameters (including
+# optimizer states), machine-learning model code, inference-enabling code, training-enabling code,
+# fine-tuning enabling code and other elements of the foregoing made publicly available
+# by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
+
+"""
+Vectorized marching cubes over an explicit list of active cells.
+
+Only the cells whose corners straddle the iso level are visited, so the cost scales with the surface area
+instead of the volume. Vertices live on lattice edges and are welded by a global edge id, so neighbouring
+cells share them and the output is watertight wherever the input band is closed.
+"""
+
+import numpy as np
+
+# corner i of a cell sits at offset (i & 1, (i >> 1) & 1, (i >> 2) & 1) from the cell origin
+CORNER_OFFSETS = np.array([[(i >> k) & 1 for k in range(3)] for i in range(8)], dtype=np.int64)
+# the 12 cell edges as (lower corner, upper corner, axis)
+EDGES = np.array([(a, a | (1 << k), k) for k in range(3) for a in range(8) if not a & (1 << k)], dtype=np.int64)
+
+
+def _cell_faces():
+    """The 6 cell faces as corner cycles that run counter-clockwise seen from outside the cell."""
+    faces = []
+    for k in range(3):
+        u, v = (k + 1) % 3, (k + 2) % 3
+        for side in (0, 1):
+            cycle = [(side << k) | (du << u) | (dv << v) for du, dv in ((0, 0), (1, 0), (1, 1), (0, 1))]
+            faces.append(cycle if side else cycle[::-1])
+    return faces
+
+
+def _fan_start(loop, face_edges):
+    """Rotate a loop so that no fan diagonal joins two points of the same cell face.
+
+    Such a diagonal would lie in the face shared with the neighbouring cell, which may emit the same
+    diagonal and make the edge non-manifold.
+    """
+    for shift in range(len(loop)):
+        rotated = loop[shift:] + loop[:shift]
+        if not any({rotated[0], e} <= edges for e in rotated[2:-1] for edges in face_edges):
+            return rotated
+    raise RuntimeError(f'no valid fan triangulation for loop {loop}')
+
+
+def _build_triangle_table():
+    """Triangulate all 256 sign configurations of a cell.
+
+    On every face the iso-line cuts off each run of inside corners, which separates inside corners on
+    ambiguous faces. The rule only depends on the face itself, so adjacent cells always agree and the
+    surface closes up. The face segments are chained into loops around the inside corners and every loop
+    is fan-triangulated.
+    """
+    edge_index = {(a, b): i for i, (a, b, _) in enumerate(EDGES)}
+
+    def edge(a, b):
+        return edge_index[(min(a, b), max(a, b))]
+
+    faces = _cell_faces()
+    face_edges = [{edge(cycle[i], cycle[(i + 1) % 4]) for i in range(4)} for cycle in faces]
+    table = []
+    for case in range(256):
+        inside = [bool(case >> c & 1) for c in range(8)]
+        successor = {}
+        for cycle in faces:
+            for i in range(4):
+                a, b = cycle[i], cycle[(i + 1) % 4]
+                if inside[a] and not inside[b]:
+                    j = i
+                    while inside[cycle[(j - 1) % 4]]:
+                        j -= 1
+                    successor[edge(cycle[(j - 1) % 4], cycle[j % 4])] = edge(a, b)
+        triangles = []
+        while successor:
+            start = next(iter(successor))
+            loop = [start]
+            while successor[loop[-1]] != start:
+                loop.append(successor[loop[-1]])
+            for e in loop:
+                del successor[e]
+            loop = _fan_start(loop, face_edges)
+            for i in range(1, len(loop) - 1):
+                triangles.append((loop[0], loop[i + 1], loop[i]))
+        table.append(triangles)
+
+    max_triangles = max(len(triangles) for triangles in table)
+    padded = np.full((256, max_triangles, 3), -1, dtype=np.int64)
+    for case, triangles in enumerate(table):
+        if triangles:
+            padded[case, :len(triangles)] = triangles
+    return padded
+
+
+TRIANGLE_TABLE = _build_triangle_table()
+
+
+def _lattice_keys(coords: np.ndarray, size: int):
+    return (coords[..., 0] * size + coords[..., 1]) * size + coords[..., 2]
+
+
+def dense_active_cells(grid: np.ndarray, level: float = 0.0):
+    """Find the cells of a dense grid that straddle ``level``; cells with a NaN corner are skipped.
+
+    Returns the cell origins ``(M, 3)`` and their corner values ``(M, 8)``.
+    """
+    nx, ny, nz = (s - 1 for s in grid.shape)
+    case = np.zeros((nx, ny, nz), dtype=np.uint8)
+    valid = np.ones((nx, ny, nz), dtype=bool)
+    for c, (dx, dy, dz) in enumerate(CORNER_OFFSETS):
+        corner = grid[dx:dx + nx, dy:dy + ny, dz:dz + nz]
+        case |= (corner > level).astype(np.uint8) << c
+        valid &= ~np.isnan(corner)
+    origins = np.argwhere(valid & (case != 0) & (case != 255))
+    corner_values = np.stack([grid[origins[:, 0] + dx, origins[:, 1] + dy, origins[:, 2] + dz]
+                              for dx, dy, dz in CORNER_OFFSETS], axis=-1)
+    return origins, corner_values
+
+
+def sparse_active_cells(coords: np.ndarray, values: np.ndarray, size: int, level: float = 0.0):
+    """Find the cells of a sparse lattice that straddle ``level``.
+
+    ``coords`` are the ``(N, 3)`` lattice coordinates of the known points on a ``size ** 3`` lattice and
+    ``values`` their scalars. The lattice edges crossing the level are found first, and only the cells
+    around them are checked; a cell is used only if all eight of its corners are known.
+    """
+    keys = _lattice_keys(coords, size)
+    order = np.argsort(keys, kind='stable')
+    keys, coords, values = keys[order], coords[order], values[order]
+    if len(keys) == 0:
+        return np.zeros((0, 3), dtype=np.int64), np.zeros((0, 8), dtype=values.dtype)
+    inside = values > level
+
+    candidates = []
+    for axis in range(3):
+        neighbor_keys = keys + size ** (2 - axis)
+        idx = np.searchsorted(keys, neighbor_keys).clip(max=len(keys) - 1)
+        crossing = (keys[idx] == neighbor_keys) & (coords[:, axis] < size - 1) & (inside != inside[idx])
+        points = coords[crossing]
+        u, v = (axis + 1) % 3, (axis + 2) % 3
+        for du in (0, 1):
+            for dv in (0, 1):
+                origins = points.copy()
+                origins[:, u] -= du
+                origins[:, v] -= dv
+                valid = (origins[:, [u, v]] >= 0).all(axis=-1) & (origins[:, [u, v]] < size - 1).all(axis=-1)
+                candidates.append(_lattice_keys(origins[valid], size))
+    cell_keys = np.unique(np.concatenate(candidates))
+    origins = np.stack([cell_keys // (size * size), (cell_keys // size) % size, cell_keys % size], axis=-1)
+
+    corner_keys = cell_keys[:, None] + _lattice_keys(CORNER_OFFSETS, size)[None]
+    idx = np.searchsorted(keys, corner_keys).clip(max=len(keys) - 1)
+    found = (keys[idx] == corner_keys).all(axis=-1)
+    return origins[found], values[idx[found]]
+
+
+def marching_cubes_cells(origins: np.ndarray, corner_values: np.ndarray, size: int, level: float = 0.0):
+    """Run marching cubes on a list of cells and weld the vertices they share.
+
+    Args:
+        origins: ``(M, 3)`` integer lattice coordinates of the cells' lower corners.
+        corner_values: ``(M, 8)`` scalars at the cell corners, in ``CORNER_OFFSETS`` order.
+        size: lattice size along each axis, used to build unique edge ids.
+        level: iso level; values above it are inside.
+
+    Returns:
+        vertices ``(V, 3)`` in lattice index space and faces ``(F, 3)``.
+    """
+    if len(origins) == 0:
+        return np.zeros((0, 3), dtype=np.float32), np.zeros((0, 3), dtype=np.int64)
+
+    case = ((corner_values > level) << np.arange(8)).sum(axis=-1)
+    triangles = TRIANGLE_TABLE[case]
+    cell_idx, tri_idx = np.nonzero(triangles[..., 0] >= 0)
+    face_edges = triangles[cell_idx, tri_idx]
+
+    lower = origins[cell_idx][:, None, :] + CORNER_OFFSETS[EDGES[face_edges, 0]]
+    edge_ids = _lattice_keys(lower, size) * 3 + EDGES[face_edges, 2]
+    edge_ids, first, faces = np.unique(edge_ids.ravel(), return_index=True, return_inverse=True)
+
+    cells = np.repeat(cell_idx, 3)[first]
+    local_edges = face_edges.ravel()[first]
+    lo, hi, axis = EDGES[local_edges].T
+    v_lo = corner_values[cells, lo]
+    v_hi = corner_values[cells, hi]
+    t = (level - v_lo) / (v_hi - v_lo)
+
+    vertices = (origins[cells] + CORNER_OFFSETS[lo]).astype(np.float64)
+    vertices[np.arange(len(vertices)), axis] += t
+    return vertices, faces.reshape(-1, 3)
@@ -12,12 +12,18 @@
 # fine-tuning enabling code and other elements of the foregoing made publicly available
 # by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
 
-from typing import Union, Tuple, List
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Union, Tuple, List, Optional
 
 import numpy as np
 import torch
 from skimage import measure
 
+from .sparse_marching_cubes import dense_active_cells, sparse_active_cells, marching_cubes_cells
+from .volume_decoders import SparseVolume
+
 
 class Latent2MeshOutput:
 
@@ -64,13 +70,161 @@ class SurfaceExtractor:
         return outputs
 
 
+def crop_sparse_volume(volume: SparseVolume, padding: int = 1):
+    """Densify a single-sample sparse volume inside the bounding box of its points only.
+
+    Returns the NaN-filled crop and the lattice offset of its first corner. Every cell touching a decoded
+    point lies inside the crop, so marching cubes on it matches the full dense grid up to the offset.
+    """
+    coords = volume.coords
+    size = volume.grid_size[0]
+    if coords.shape[0] == 0:
+        raise ValueError('sparse volume contains no points')
+    lo = (coords.min(dim=0).values - padding).clamp(min=0)
+    hi = (coords.max(dim=0).values + padding + 1).clamp(max=size)
+    crop = torch.full(tuple((hi - lo).tolist()), float('nan'), dtype=volume.dtype, device=volume.device)
+    local = coords - lo
+    crop[local[:, 0], local[:, 1], local[:, 2]] = volume.values
+    return crop, lo.cpu().numpy()
+
+
 class MCSurfaceExtractor(SurfaceExtractor):
     def run(self, grid_logit, *, mc_level, bounds, octree_resolution, **kwargs):
+        offset = 0
+        if isinstance(grid_logit, SparseVolume):
+            grid_logit, offset = crop_sparse_volume(grid_logit)
         vertices, faces, normals, _ = measure.marching_cubes(
             grid_logit.cpu().numpy(),
             mc_level,
             method="lewiner"
         )
+        vertices = vertices + offset
+        grid_size, bbox_min, bbox_size = self._compute_box_stat(bounds, octree_resolution)
+        vertices = vertices / grid_size * bbox_size + bbox_min
+        return vertices, faces
+
+
+def _slab_marching_cubes(slab: np.ndarray, level: float, start: int):
+    """Lewiner marching cubes on one slab, with the vertices moved to grid coordinates."""
+    if not np.nanmin(slab) <= level <= np.nanmax(slab):
+        return np.zeros((0, 3), dtype=np.float32), np.zeros((0, 3), dtype=np.int64)
+    vertices, faces, _, _ = measure.marching_cubes(slab, level, method="lewiner")
+    vertices[:, 0] += start
+    return vertices, faces
+
+
+def weld_slab_meshes(parts: List[Tuple[np.ndarray, np.ndarray]], seams: List[int]):
+    """Concatenate the meshes of consecutive slabs and merge the vertices they share on their seams.
+
+    Slab ``i`` and ``i + 1`` overlap on the grid plane ``x = seams[i]``. Both slabs interpolate the
+    vertices of that plane from the same corner values, so the duplicates match exactly and are welded
+    by position.
+    """
+    offsets = np.cumsum([0] + [len(vertices) for vertices, _ in parts])
+    vertices = np.concatenate([vertices for vertices, _ in parts], axis=0)
+    faces = np.concatenate([faces + offset for (_, faces), offset in zip(parts, offsets)], axis=0)
+    remap = np.arange(len(vertices))
+    for i, seam in enumerate(seams):
+        lower = offsets[i] + np.nonzero(parts[i][0][:, 0] == seam)[0]
+        upper = offsets[i + 1] + np.nonzero(parts[i + 1][0][:, 0] == seam)[0]
+        if len(lower) == 0 or len(upper) == 0:
+            continue
+        candidates = np.concatenate([lower, upper])
+        _, first, inverse = np.unique(vertices[candidates], axis=0, return_index=True, return_inverse=True)
+        target = candidates[first[inverse.reshape(-1)]]
+        remap[upper] = target[len(lower):]
+    keep = remap == np.arange(len(vertices))
+    new_index = np.cumsum(keep) - 1
+    return vertices[keep], new_index[remap[faces]]
+
+
+def parallel_marching_cubes(grid: np.ndarray, level: float, executor, num_slabs: int):
+    """Run marching cubes on ``num_slabs`` slabs of ``grid`` along its first axis and weld the results.
+
+    Neighbouring slabs share one grid plane, so every cell belongs to exactly one slab and the welded
+    mesh has the same triangles as a single marching cubes run over the whole grid.
+    """
+    num_slabs = max(min(num_slabs, grid.shape[0] - 1), 1)
+    bounds = np.linspace(0, grid.shape[0] - 1, num_slabs + 1).round().astype(int)
+    futures = [executor.submit(_slab_marching_cubes, grid[start:end + 1], level, start)
+               for start, end in zip(bounds[:-1], bounds[1:])]
+    parts = [future.result() for future in futures]
+    if all(len(faces) == 0 for _, faces in parts):
+        raise ValueError('No surface found at the given iso value.')
+    return weld_slab_meshes(parts, bounds[1:-1].tolist())
+
+
+class ParallelMCSurfaceExtractor(MCSurfaceExtractor):
+    """`MCSurfaceExtractor` that splits the grid into slabs and runs them on a CPU worker pool.
+
+    Args:
+        num_workers: pool size, all cores by default.
+        executor: ``'thread'`` to share the grid without copies, or ``'process'`` for a pool of spawned
+            processes. Forking is avoided, since the parent usually holds CUDA state and running threads.
+        slabs_per_worker: slabs queued per worker, so that slabs with more surface do not stall the pool.
+    """
+
+    def __init__(self, num_workers: Optional[int] = None, executor: str = 'thread', slabs_per_worker: int = 4):
+        if executor not in ['process', 'thread']:
+            raise ValueError(f'Unsupported executor {executor}, available: {["process", "thread"]}')
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.executor_type = executor
+        self.slabs_per_worker = slabs_per_worker
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.executor_type == 'process':
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.num_workers, mp_context=multiprocessing.get_context('spawn'))
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.num_workers)
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def run(self, grid_logit, *, mc_level, bounds, octree_resolution, **kwargs):
+        offset = 0
+        if isinstance(grid_logit, SparseVolume):
+            grid_logit, offset = crop_sparse_volume(grid_logit)
+        vertices, faces = parallel_marching_cubes(
+            grid_logit.cpu().numpy(),
+            mc_level,
+            self.executor,
+            self.num_workers * self.slabs_per_worker,
+        )
+        vertices = vertices + offset
+        grid_size, bbox_min, bbox_size = self._compute_box_stat(bounds, octree_resolution)
+        vertices = vertices / grid_size * bbox_size + bbox_min
+        return vertices, faces
+
+
+class SparseMCSurfaceExtractor(SurfaceExtractor):
+    """Marching cubes that only visits the cells straddling the iso level.
+
+    Takes a `SparseVolume` straight from the hierarchical decoders, or a dense grid in which case the
+    active cells are found with a vectorized scan. Shared vertices are welded across cells.
+    """
+
+    def run(self, grid_logit, *, mc_level, bounds, octree_resolution, **kwargs):
+        if isinstance(grid_logit, SparseVolume):
+            size = grid_logit.grid_size[0]
+            origins, corner_values = sparse_active_cells(
+                grid_logit.coords.cpu().numpy(),
+                grid_logit.values.float().cpu().numpy(),
+                size,
+                mc_level,
+            )
+        else:
+            size = grid_logit.shape[0]
+            origins, corner_values = dense_active_cells(grid_logit.float().cpu().numpy(), mc_level)
+        if len(origins) == 0:
+            raise ValueError('No surface found at the given iso value.')
+        vertices, faces = marching_cubes_cells(origins, corner_values, size, mc_level)
         grid_size, bbox_min, bbox_size = self._compute_box_stat(bounds, octree_resolution)
         vertices = vertices / grid_size * bbox_size + bbox_min
         return vertices, faces
@@ -78,6 +232,8 @@ class MCSurfaceExtractor(SurfaceExtractor):
 
 class DMCSurfaceExtractor(SurfaceExtractor):
     def run(self, grid_logit, *, octree_resolution, **kwargs):
+        if isinstance(grid_logit, SparseVolume):
+            grid_logit = grid_logit.to_dense()[0]
         device = grid_logit.device
         if not hasattr(self, 'dmc'):
             try:
@@ -97,4 +253,6 @@ class DMCSurfaceExtractor(SurfaceExtractor):
 SurfaceExtractors = {
     'mc': MCSurfaceExtractor,
     'dmc': DMCSurfaceExtractor,
+    'sparse_mc': SparseMCSurfaceExtractor,
+    'parallel_mc': ParallelMCSurfaceExtractor,
 }
@@ -12,18 +12,20 @@
 # fine-tuning enabling code and other elements of the foregoing made publicly available
 # by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
 
-from typing import Union, Tuple, List, Callable
+from collections import OrderedDict
+from functools import partial
+from typing import Union, Tuple, List, Callable, Optional
 
 import numpy as np
 import torch
-import torch.nn as nn
 import torch.nn.functional as F
 from einops import repeat
 from tqdm import tqdm
 
 from .attention_blocks import CrossAttentionDecoder
 from .attention_processors import FlashVDMCrossAttentionProcessor, FlashVDMTopMCrossAttentionProcessor
-from ...utils import logger
+from .memory_budget import num_chunks_for_budget
+from ...utils import logger, tensor_nbytes
 
 
 def extract_near_surface_volume_fn(input_tensor: torch.Tensor, alpha: float):
@@ -119,6 +121,51 @@ def extract_near_surface_volume_fn(input_tensor: torch.Tensor, alpha: float):
     return mask * valid_mask.to(torch.int32)
 
 
+def _or_neighbors(dst: torch.BoolTensor, src: torch.BoolTensor, axis: int):
+    """In place ``dst |= src`` shifted by one cell in both directions along ``axis``."""
+    n = src.shape[axis]
+    if n < 2:
+        return dst
+    dst.narrow(axis, 1, n - 1).logical_or_(src.narrow(axis, 0, n - 1))
+    dst.narrow(axis, 0, n - 1).logical_or_(src.narrow(axis, 1, n - 1))
+    return dst
+
+
+def extract_near_surface_mask(input_tensor: torch.Tensor, alpha: float):
+    """Boolean version of `extract_near_surface_volume_fn`.
+
+    Flags the valid cells whose sign differs from one of their six neighbours, ignoring invalid (<= -9000)
+    neighbours. Instead of six shifted float copies it ORs one-byte masks of the neighbouring cells
+    in place, so the transient memory is a few bytes per cell.
+
+    The last three dimensions are the grid, any leading ones are batch dimensions.
+    """
+    val = input_tensor + alpha if alpha != 0 else input_tensor
+    valid = val > -9000
+    mask = torch.zeros_like(valid)
+    for indicator in (val > 0, val < 0):
+        # a neighbour has the sign class of `indicator` while this cell does not, or the other way round
+        for present in (indicator & valid, ~indicator & valid):
+            neighbors = torch.zeros_like(valid)
+            for axis in range(-3, 0):
+                _or_neighbors(neighbors, present, axis)
+            present.logical_not_()
+            mask |= neighbors & present
+    return mask & valid
+
+
+def dilate_mask(mask: torch.BoolTensor, radius: int = 1):
+    """Box-dilate a boolean volume by ``radius`` cells, one axis at a time.
+
+    Same result as ``radius`` rounds of an all-ones 3x3x3 ``Conv3d`` followed by ``> 0``.
+    """
+    mask = mask.clone()
+    for _ in range(radius):
+        for axis in range(mask.dim()):
+            _or_neighbors(mask, mask.clone(), axis)
+    return mask
+
+
 def generate_dense_grid_points(
     bbox_min: np.ndarray,
     bbox_max: np.ndarray,
@@ -138,6 +185,312 @@ def generate_dense_grid_points(
     return xyz, grid_size, length
 
 
+class QueryGridCache:
+    """ LRU cache of dense query grids and their embedded queries for volume decoding.
+
+        Entries are keyed by the geo decoder, bounds, resolution, grid layout, dtype
+        and device. Repeated requests at the same octree resolution then skip building
+        the meshgrid, copying it to the device and running the Fourier embedder and
+        `query_proj` on it. Embeddings are only kept when they fit in `max_bytes`;
+        otherwise just the points are cached and the queries are embedded per chunk.
+        Call `clear()` after loading new decoder weights in place.
+
+        Example:
+        ```python
+        pipeline.vae.enable_query_grid_cache(max_bytes=2 * 1024 ** 3)
+        ```
+    """
+
+    def __init__(self, max_bytes: int = 1024 ** 3):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, entry):
+        nbytes = tensor_nbytes(entry)
+        if nbytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self.nbytes -= tensor_nbytes(self._entries.pop(key))
+        self._entries[key] = entry
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= tensor_nbytes(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'nbytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+def get_query_grid(
+    geo_decoder: Callable,
+    bbox_min: np.ndarray,
+    bbox_max: np.ndarray,
+    octree_resolution: int,
+    dtype: torch.dtype,
+    device: torch.device,
+    mini_grid_num: Optional[int] = None,
+    grid_cache: Optional[QueryGridCache] = None,
+    num_chunks: int = 10000,
+):
+    """Dense query points of a level, flat ``(P, 3)`` or grouped into ``mini_grid_num ** 3`` mini grids.
+
+    Returns the points and, when `grid_cache` holds them, the matching query embeddings (else None).
+    """
+    key = None
+    if grid_cache is not None:
+        key = (id(geo_decoder), tuple(np.asarray(bbox_min).tolist()), tuple(np.asarray(bbox_max).tolist()),
+               octree_resolution, mini_grid_num, str(dtype), str(device))
+        entry = grid_cache.get(key)
+        if entry is not None:
+            return entry['points'], entry['embeddings']
+
+    xyz_samples, grid_size, length = generate_dense_grid_points(
+        bbox_min=bbox_min,
+        bbox_max=bbox_max,
+        octree_resolution=octree_resolution,
+        indexing="ij"
+    )
+    xyz_samples = torch.from_numpy(xyz_samples).to(device, dtype=dtype)
+    if mini_grid_num is None:
+        xyz_samples = xyz_samples.contiguous().reshape(-1, 3)
+    else:
+        mini_grid_size = xyz_samples.shape[0] // mini_grid_num
+        xyz_samples = xyz_samples.view(
+            mini_grid_num, mini_grid_size,
+            mini_grid_num, mini_grid_size,
+            mini_grid_num, mini_grid_size, 3
+        ).permute(
+            0, 2, 4, 1, 3, 5, 6
+        ).reshape(
+            -1, mini_grid_size * mini_grid_size * mini_grid_size, 3
+        )
+
+    embeddings = None
+    if grid_cache is not None:
+        if isinstance(geo_decoder, CrossAttentionDecoder):
+            num_points = xyz_samples.shape[:-1].numel()
+            element_size = torch.empty((), dtype=dtype).element_size()
+            nbytes = num_points * (geo_decoder.query_proj.out_features * element_size + 3 * xyz_samples.element_size())
+            if nbytes <= grid_cache.max_bytes:
+                flat = xyz_samples.reshape(-1, 3)
+                embeddings = torch.cat([
+                    geo_decoder.embed_queries(flat[start: start + num_chunks], dtype)
+                    for start in range(0, flat.shape[0], num_chunks)
+                ], dim=0).reshape(*xyz_samples.shape[:-1], -1)
+        grid_cache.put(key, {'points': xyz_samples, 'embeddings': embeddings})
+    return xyz_samples, embeddings
+
+
+class SparseVolume:
+    """Sparse near-surface samples of a batch of volumes on a ``(resolution + 1) ** 3`` lattice.
+
+    ``coords`` holds the integer lattice coordinates of every decoded point, ``values`` their logits and
+    ``offsets`` where every sample starts, so sample ``i`` is ``coords[offsets[i]:offsets[i + 1]]``.
+    Lattice points that were never decoded are empty (NaN in the dense equivalent). Coordinates are
+    sorted in row-major order within every sample.
+    """
+
+    def __init__(self, coords: torch.LongTensor, values: torch.Tensor, offsets: List[int], resolution: int):
+        self.coords = coords
+        self.values = values
+        self.offsets = list(offsets)
+        self.resolution = resolution
+
+    @classmethod
+    def from_packed(cls, coords: torch.LongTensor, values: torch.Tensor, batch_size: int, resolution: int):
+        """Build from ``(N, 4)`` coordinates whose first column is the sample index, sorted by sample."""
+        counts = torch.bincount(coords[:, 0], minlength=batch_size)
+        offsets = [0] + torch.cumsum(counts, 0).tolist()
+        return cls(coords[:, 1:], values, offsets, resolution)
+
+    @property
+    def batch_size(self):
+        return len(self.offsets) - 1
+
+    @property
+    def grid_size(self):
+        return [self.resolution + 1] * 3
+
+    @property
+    def shape(self):
+        return torch.Size([self.batch_size, *self.grid_size])
+
+    @property
+    def device(self):
+        return self.values.device
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    def __len__(self):
+        return self.batch_size
+
+    def __getitem__(self, index: int):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return SparseVolume(self.coords[start:end], self.values[start:end], [0, end - start], self.resolution)
+
+    def to(self, *args, **kwargs):
+        values = self.values.to(*args, **kwargs)
+        return SparseVolume(self.coords.to(values.device), values, self.offsets, self.resolution)
+
+    def to_dense(self, fill_value: float = float('nan')):
+        grid = torch.full(tuple(self.shape), fill_value, dtype=self.dtype, device=self.device)
+        for b in range(self.batch_size):
+            start, end = self.offsets[b], self.offsets[b + 1]
+            x, y, z = self.coords[start:end].unbind(-1)
+            grid[b, x, y, z] = self.values[start:end]
+        return grid
+
+
+def _lattice_keys(coords: torch.LongTensor, size: int):
+    # row-major over all columns, so a leading sample column keeps the samples apart and in order
+    keys = coords[:, 0]
+    for axis in range(1, coords.shape[1]):
+        keys = keys * size + coords[:, axis]
+    return keys
+
+
+def _keys_to_coords(keys: torch.LongTensor, size: int, num_axes: int = 3):
+    coords = []
+    for _ in range(num_axes - 1):
+        coords.append(keys % size)
+        keys = keys // size
+    coords.append(keys)
+    return torch.stack(coords[::-1], dim=-1)
+
+
+def dilate_sparse_coords(coords: torch.LongTensor, radius: int, size: int):
+    """Box-dilate a set of lattice coordinates by ``radius`` cells, clipped to ``[0, size)``.
+
+    ``coords`` is ``(N, 3)``, or ``(N, 4)`` with a leading sample index that is left untouched. The box is
+    separable, so the dilation runs one axis at a time and never holds more than ``2 * radius + 1``
+    candidates per output point. The result is unique and row-major sorted.
+    """
+    if radius == 0 or coords.shape[0] == 0:
+        return coords
+    num_axes = coords.shape[1]
+    offsets = torch.arange(-radius, radius + 1, device=coords.device)
+    for axis in range(num_axes - 3, num_axes):
+        expanded = coords.unsqueeze(0).repeat(offsets.shape[0], 1, 1)
+        expanded[..., axis] += offsets[:, None]
+        expanded = expanded.reshape(-1, num_axes)
+        expanded = expanded[(expanded[:, axis] >= 0) & (expanded[:, axis] < size)]
+        coords = _keys_to_coords(torch.unique(_lattice_keys(expanded, size)), size, num_axes)
+    return coords
+
+
+def extract_near_surface_points(coords: torch.LongTensor, values: torch.Tensor, size: int, alpha: float):
+    """Sparse counterpart of `extract_near_surface_volume_fn`.
+
+    Flags the points whose sign differs from one of their six lattice neighbours. Neighbours that were
+    not decoded count as having the same sign, like the invalid cells of the dense version. ``coords``
+    must be row-major sorted and may carry a leading sample index, as in `dilate_sparse_coords`.
+    """
+    keys = _lattice_keys(coords, size)
+    val = values + alpha
+    sign = torch.sign(val.to(torch.float32))
+    mask = torch.zeros_like(keys, dtype=torch.bool)
+    if keys.shape[0] == 0:
+        return mask
+    num_axes = coords.shape[1]
+    for axis in range(num_axes - 3, num_axes):
+        for shift in (-1, 1):
+            neighbor = coords.clone()
+            neighbor[:, axis] += shift
+            inside = (neighbor[:, axis] >= 0) & (neighbor[:, axis] < size)
+            neighbor_keys = _lattice_keys(neighbor, size)
+            idx = torch.searchsorted(keys, neighbor_keys).clamp(max=keys.shape[0] - 1)
+            found = inside & (keys[idx] == neighbor_keys)
+            mask |= found & (torch.sign(val[idx].to(torch.float32)) != sign)
+    return mask
+
+
+def next_level_points(coords: torch.LongTensor, size: int, next_size: int, expand_num: int):
+    """Map near-surface points of one level to the points to decode at the next (twice as fine) level."""
+    coords = dilate_sparse_coords(coords, expand_num, size)
+    scale = coords.new_tensor([1] * (coords.shape[1] - 3) + [2, 2, 2])
+    return dilate_sparse_coords(coords * scale, 2 - expand_num, next_size)
+
+
+def refine_near_surface_band(
+    grid_logits: torch.FloatTensor,
+    resolutions: List[int],
+    bbox_min: np.ndarray,
+    bbox_size: np.ndarray,
+    decode_points: Callable,
+    mc_level: float = 0.0,
+):
+    """Decode the near-surface bands of a batch of coarse grids level by level.
+
+    The band of every sample of the ``(B, S, S, S)`` coarse grid is tracked as packed ``(N, 4)`` lattice
+    coordinates whose first column is the sample index, so each level decodes all samples at once through
+    ``decode_points(coords, points, resolution)``, which returns the logits of the ``(N, 3)`` query points.
+    Returns the packed coordinates and logits of the finest level.
+    """
+    if len(resolutions) == 1:
+        coords = torch.nonzero(torch.ones_like(grid_logits, dtype=torch.bool))
+        return coords, grid_logits.reshape(-1)
+
+    device = grid_logits.device
+    curr_points = extract_near_surface_mask(grid_logits, mc_level) | (grid_logits.abs() < 0.95)
+    coords = torch.nonzero(curr_points)
+    values = None
+    size = resolutions[0] + 1
+    for octree_depth_now in resolutions[1:]:
+        if values is not None:
+            band = extract_near_surface_points(coords, values, size, mc_level) | (values.abs() < 0.95)
+            coords = coords[band]
+
+        if octree_depth_now == resolutions[-1]:
+            expand_num = 0
+        else:
+            expand_num = 1
+        coords = next_level_points(coords, size, octree_depth_now + 1, expand_num)
+        size = octree_depth_now + 1
+
+        resolution = bbox_size / octree_depth_now
+        next_points = (coords[:, 1:] * torch.tensor(resolution, dtype=torch.float32, device=device) +
+                       torch.tensor(bbox_min, dtype=torch.float32, device=device))
+        values = decode_points(coords, next_points, octree_depth_now)
+
+    return coords, values
+
+
+def prepare_decoder_latents(geo_decoder: Callable, latents: torch.FloatTensor):
+    """Project the latents to the geo decoder's cross-attention K/V once, so every query chunk reuses them.
+
+    Decoders other than `CrossAttentionDecoder` get the latents unchanged.
+    """
+    if isinstance(geo_decoder, CrossAttentionDecoder):
+        return geo_decoder.prepare_latents(latents)
+    return latents
+
+
 class VanillaVolumeDecoder:
     @torch.no_grad()
     def __call__(
@@ -148,8 +501,13 @@ class VanillaVolumeDecoder:
         num_chunks: int = 10000,
         octree_resolution: int = None,
         enable_pbar: bool = True,
+        grid_cache: Optional[QueryGridCache] = None,
+        memory_budget: Optional[int] = None,
         **kwargs,
     ):
+        if memory_budget is not None:
+            num_chunks = num_chunks_for_budget(geo_decoder, latents, memory_budget)
+
         device = latents.device
         dtype = latents.dtype
         batch_size = latents.shape[0]
@@ -159,21 +517,25 @@ class VanillaVolumeDecoder:
             bounds = [-bounds, -bounds, -bounds, bounds, bounds, bounds]
 
         bbox_min, bbox_max = np.array(bounds[0:3]), np.array(bounds[3:6])
-        xyz_samples, grid_size, length = generate_dense_grid_points(
-            bbox_min=bbox_min,
-            bbox_max=bbox_max,
-            octree_resolution=octree_resolution,
-            indexing="ij"
+        xyz_samples, query_embeddings = get_query_grid(
+            geo_decoder, bbox_min, bbox_max, octree_resolution, dtype, device,
+            grid_cache=grid_cache, num_chunks=num_chunks,
         )
-        xyz_samples = torch.from_numpy(xyz_samples).to(device, dtype=dtype).contiguous().reshape(-1, 3)
+        grid_size = [int(octree_resolution) + 1] * 3
 
         # 2. latents to 3d volume
+        latents = prepare_decoder_latents(geo_decoder, latents)
         batch_logits = []
         for start in tqdm(range(0, xyz_samples.shape[0], num_chunks), desc=f"Volume Decoding",
                           disable=not enable_pbar):
-            chunk_queries = xyz_samples[start: start + num_chunks, :]
-            chunk_queries = repeat(chunk_queries, "p c -> b p c", b=batch_size)
-            logits = geo_decoder(queries=chunk_queries, latents=latents)
+            if query_embeddings is not None:
+                chunk_embeddings = query_embeddings[start: start + num_chunks]
+                chunk_embeddings = repeat(chunk_embeddings, "p c -> b p c", b=batch_size)
+                logits = geo_decoder(query_embeddings=chunk_embeddings, latents=latents)
+            else:
+                chunk_queries = xyz_samples[start: start + num_chunks, :]
+                chunk_queries = repeat(chunk_queries, "p c -> b p c", b=batch_size)
+                logits = geo_decoder(queries=chunk_queries, latents=latents)
             batch_logits.append(logits)
 
         grid_logits = torch.cat(batch_logits, dim=1)
@@ -183,6 +545,9 @@ class VanillaVolumeDecoder:
 
 
 class HierarchicalVolumeDecoding:
+    def __init__(self, sparse_output: bool = False):
+        self.sparse_output = sparse_output
+
     @torch.no_grad()
     def __call__(
         self,
@@ -194,8 +559,13 @@ class HierarchicalVolumeDecoding:
         octree_resolution: int = None,
         min_resolution: int = 63,
         enable_pbar: bool = True,
+        grid_cache: Optional[QueryGridCache] = None,
+        memory_budget: Optional[int] = None,
         **kwargs,
     ):
+        if memory_budget is not None:
+            num_chunks = num_chunks_for_budget(geo_decoder, latents, memory_budget)
+
         device = latents.device
         dtype = latents.dtype
 
@@ -214,71 +584,75 @@ class HierarchicalVolumeDecoding:
         bbox_max = np.array(bounds[3:6])
         bbox_size = bbox_max - bbox_min
 
-        xyz_samples, grid_size, length = generate_dense_grid_points(
-            bbox_min=bbox_min,
-            bbox_max=bbox_max,
-            octree_resolution=resolutions[0],
-            indexing="ij"
+        xyz_samples, query_embeddings = get_query_grid(
+            geo_decoder, bbox_min, bbox_max, resolutions[0], dtype, device,
+            grid_cache=grid_cache, num_chunks=num_chunks,
         )
-
-        dilate = nn.Conv3d(1, 1, 3, padding=1, bias=False, device=device, dtype=dtype)
-        dilate.weight = torch.nn.Parameter(torch.ones(dilate.weight.shape, dtype=dtype, device=device))
-
-        grid_size = np.array(grid_size)
-        xyz_samples = torch.from_numpy(xyz_samples).to(device, dtype=dtype).contiguous().reshape(-1, 3)
+        grid_size = np.array([resolutions[0] + 1] * 3)
 
         # 2. latents to 3d volume
+        latents = prepare_decoder_latents(geo_decoder, latents)
         batch_logits = []
         batch_size = latents.shape[0]
         for start in tqdm(range(0, xyz_samples.shape[0], num_chunks),
                           desc=f"Hierarchical Volume Decoding [r{resolutions[0] + 1}]"):
-            queries = xyz_samples[start: start + num_chunks, :]
-            batch_queries = repeat(queries, "p c -> b p c", b=batch_size)
-            logits = geo_decoder(queries=batch_queries, latents=latents)
+            if query_embeddings is not None:
+                embeddings = query_embeddings[start: start + num_chunks]
+                batch_embeddings = repeat(embeddings, "p c -> b p c", b=batch_size)
+                logits = geo_decoder(query_embeddings=batch_embeddings, latents=latents)
+            else:
+                queries = xyz_samples[start: start + num_chunks, :]
+                batch_queries = repeat(queries, "p c -> b p c", b=batch_size)
+                logits = geo_decoder(queries=batch_queries, latents=latents)
             batch_logits.append(logits)
 
         grid_logits = torch.cat(batch_logits, dim=1).view((batch_size, grid_size[0], grid_size[1], grid_size[2]))
 
-        for octree_depth_now in resolutions[1:]:
-            grid_size = np.array([octree_depth_now + 1] * 3)
-            resolution = bbox_size / octree_depth_now
-            next_index = torch.zeros(tuple(grid_size), dtype=dtype, device=device)
-            next_logits = torch.full(next_index.shape, -10000., dtype=dtype, device=device)
-            curr_points = extract_near_surface_volume_fn(grid_logits.squeeze(0), mc_level)
-            curr_points += grid_logits.squeeze(0).abs() < 0.95
-
-            if octree_depth_now == resolutions[-1]:
-                expand_num = 0
+        # 3. refine the near-surface bands of all samples together
+        coords, values = refine_near_surface_band(
+            grid_logits,
+            resolutions,
+            bbox_min,
+            bbox_size,
+            partial(self.decode_points, latents=latents, geo_decoder=geo_decoder, num_chunks=num_chunks),
+            mc_level=mc_level,
+        )
+        volume = SparseVolume.from_packed(coords, values, batch_size, resolutions[-1])
+        if self.sparse_output:
+            return volume
+        return volume.to_dense()
+
+    @staticmethod
+    def decode_points(coords, points, resolution, *, latents, geo_decoder, num_chunks=10000):
+        """Decode packed per-sample points, `num_chunks` of every sample per call with the samples side by side.
+
+        Samples whose points are all decoded drop out of the later calls.
+        """
+        device = points.device
+        batch_size = latents.shape[0]
+        sample = coords[:, 0]
+        counts = torch.bincount(sample, minlength=batch_size)
+        offsets = torch.arange(sample.shape[0], device=device) - (torch.cumsum(counts, 0) - counts)[sample]
+        counts = counts.tolist()
+        max_count = max(counts)
+
+        queries = torch.zeros((batch_size, max_count, 3), dtype=latents.dtype, device=device)
+        queries[sample, offsets] = points.to(latents.dtype)
+        grid_logits = torch.zeros((batch_size, max_count), dtype=latents.dtype, device=device)
+        for start in tqdm(range(0, max_count, num_chunks),
+                          desc=f"Hierarchical Volume Decoding [r{resolution + 1}]"):
+            rows = [b for b, count in enumerate(counts) if count > start]
+            if len(rows) == batch_size:
+                logits = geo_decoder(queries=queries[:, start: start + num_chunks], latents=latents)
             else:
-                expand_num = 1
-            for i in range(expand_num):
-                curr_points = dilate(curr_points.unsqueeze(0).to(dtype)).squeeze(0)
-            (cidx_x, cidx_y, cidx_z) = torch.where(curr_points > 0)
-            next_index[cidx_x * 2, cidx_y * 2, cidx_z * 2] = 1
-            for i in range(2 - expand_num):
-                next_index = dilate(next_index.unsqueeze(0)).squeeze(0)
-            nidx = torch.where(next_index > 0)
-
-            next_points = torch.stack(nidx, dim=1)
-            next_points = (next_points * torch.tensor(resolution, dtype=next_points.dtype, device=device) +
-                           torch.tensor(bbox_min, dtype=next_points.dtype, device=device))
-            batch_logits = []
-            for start in tqdm(range(0, next_points.shape[0], num_chunks),
-                              desc=f"Hierarchical Volume Decoding [r{octree_depth_now + 1}]"):
-                queries = next_points[start: start + num_chunks, :]
-                batch_queries = repeat(queries, "p c -> b p c", b=batch_size)
-                logits = geo_decoder(queries=batch_queries.to(latents.dtype), latents=latents)
-                batch_logits.append(logits)
-            grid_logits = torch.cat(batch_logits, dim=1)
-            next_logits[nidx] = grid_logits[0, ..., 0]
-            grid_logits = next_logits.unsqueeze(0)
-        grid_logits[grid_logits == -10000.] = float('nan')
-
-        return grid_logits
+                rows = torch.tensor(rows, device=device)
+                logits = geo_decoder(queries=queries[rows, start: start + num_chunks], latents=latents[rows])
+            grid_logits[rows, start: start + num_chunks] = logits[..., 0]
+        return grid_logits[sample, offsets]
 
 
 class FlashVDMVolumeDecoding:
-    def __init__(self, topk_mode='mean'):
+    def __init__(self, topk_mode='mean', sparse_output: bool = False):
         if topk_mode not in ['mean', 'merge']:
             raise ValueError(f'Unsupported topk_mode {topk_mode}, available: {["mean", "merge"]}')
 
@@ -286,6 +660,7 @@ class FlashVDMVolumeDecoding:
             self.processor = FlashVDMCrossAttentionProcessor()
         else:
             self.processor = FlashVDMTopMCrossAttentionProcessor()
+        self.sparse_output = sparse_output
 
     @torch.no_grad()
     def __call__(
@@ -299,8 +674,13 @@ class FlashVDMVolumeDecoding:
         min_resolution: int = 63,
         mini_grid_num: int = 4,
         enable_pbar: bool = True,
+        grid_cache: Optional[QueryGridCache] = None,
+        memory_budget: Optional[int] = None,
         **kwargs,
     ):
+        if memory_budget is not None:
+            num_chunks = num_chunks_for_budget(geo_decoder, latents, memory_budget)
+
         processor = self.processor
         geo_decoder.set_cross_attention_processor(processor)
 
@@ -327,109 +707,112 @@ class FlashVDMVolumeDecoding:
         bbox_max = np.array(bounds[3:6])
         bbox_size = bbox_max - bbox_min
 
-        xyz_samples, grid_size, length = generate_dense_grid_points(
-            bbox_min=bbox_min,
-            bbox_max=bbox_max,
-            octree_resolution=resolutions[0],
-            indexing="ij"
+        xyz_samples, query_embeddings = get_query_grid(
+            geo_decoder, bbox_min, bbox_max, resolutions[0], dtype, device,
+            mini_grid_num=mini_grid_num, grid_cache=grid_cache, num_chunks=num_chunks,
         )
-
-        dilate = nn.Conv3d(1, 1, 3, padding=1, bias=False, device=device, dtype=dtype)
-        dilate.weight = torch.nn.Parameter(torch.ones(dilate.weight.shape, dtype=dtype, device=device))
-
-        grid_size = np.array(grid_size)
+        grid_size = np.array([resolutions[0] + 1] * 3)
+        mini_grid_size = grid_size[0] // mini_grid_num
 
         # 2. latents to 3d volume
-        xyz_samples = torch.from_numpy(xyz_samples).to(device, dtype=dtype)
         batch_size = latents.shape[0]
-        mini_grid_size = xyz_samples.shape[0] // mini_grid_num
-        xyz_samples = xyz_samples.view(
-            mini_grid_num, mini_grid_size,
-            mini_grid_num, mini_grid_size,
-            mini_grid_num, mini_grid_size, 3
-        ).permute(
-            0, 2, 4, 1, 3, 5, 6
-        ).reshape(
-            -1, mini_grid_size * mini_grid_size * mini_grid_size, 3
-        )
-        batch_logits = []
         num_batchs = max(num_chunks // xyz_samples.shape[1], 1)
+        latents = prepare_decoder_latents(geo_decoder, latents)
+        # a single cached K/V broadcasts against every mini grid of a chunk; a batch needs one per
+        # (mini grid, sample) pair, mini grid-major
+        tiled_latents = None
+        if batch_size > 1:
+            tiled_latents = latents[torch.arange(batch_size, device=device).repeat(num_batchs)]
+        batch_logits = []
         for start in tqdm(range(0, xyz_samples.shape[0], num_batchs),
                           desc=f"FlashVDM Volume Decoding", disable=not enable_pbar):
-            queries = xyz_samples[start: start + num_batchs, :]
-            batch = queries.shape[0]
-            batch_latents = repeat(latents.squeeze(0), "p c -> b p c", b=batch)
             processor.topk = True
-            logits = geo_decoder(queries=queries, latents=batch_latents)
-            batch_logits.append(logits)
-        grid_logits = torch.cat(batch_logits, dim=0).reshape(
+            if query_embeddings is not None:
+                embeddings = query_embeddings[start: start + num_batchs]
+                num_grids = embeddings.shape[0]
+                embeddings = repeat(embeddings, "n p c -> (n b) p c", b=batch_size)
+                chunk_latents = latents if tiled_latents is None else tiled_latents[:num_grids * batch_size]
+                logits = geo_decoder(query_embeddings=embeddings, latents=chunk_latents)
+            else:
+                queries = xyz_samples[start: start + num_batchs, :]
+                num_grids = queries.shape[0]
+                queries = repeat(queries, "n p c -> (n b) p c", b=batch_size)
+                chunk_latents = latents if tiled_latents is None else tiled_latents[:num_grids * batch_size]
+                logits = geo_decoder(queries=queries, latents=chunk_latents)
+            batch_logits.append(logits.view(num_grids, batch_size, -1).transpose(0, 1))
+        grid_logits = torch.cat(batch_logits, dim=1).reshape(
+            batch_size,
             mini_grid_num, mini_grid_num, mini_grid_num,
             mini_grid_size, mini_grid_size,
             mini_grid_size
-        ).permute(0, 3, 1, 4, 2, 5).contiguous().view(
+        ).permute(0, 1, 4, 2, 5, 3, 6).contiguous().view(
             (batch_size, grid_size[0], grid_size[1], grid_size[2])
         )
 
-        for octree_depth_now in resolutions[1:]:
-            grid_size = np.array([octree_depth_now + 1] * 3)
-            resolution = bbox_size / octree_depth_now
-            next_index = torch.zeros(tuple(grid_size), dtype=dtype, device=device)
-            next_logits = torch.full(next_index.shape, -10000., dtype=dtype, device=device)
-            curr_points = extract_near_surface_volume_fn(grid_logits.squeeze(0), mc_level)
-            curr_points += grid_logits.squeeze(0).abs() < 0.95
-
-            if octree_depth_now == resolutions[-1]:
-                expand_num = 0
-            else:
-                expand_num = 1
-            for i in range(expand_num):
-                curr_points = dilate(curr_points.unsqueeze(0).to(dtype)).squeeze(0)
-            (cidx_x, cidx_y, cidx_z) = torch.where(curr_points > 0)
-
-            next_index[cidx_x * 2, cidx_y * 2, cidx_z * 2] = 1
-            for i in range(2 - expand_num):
-                next_index = dilate(next_index.unsqueeze(0)).squeeze(0)
-            nidx = torch.where(next_index > 0)
-
-            next_points = torch.stack(nidx, dim=1)
-            next_points = (next_points * torch.tensor(resolution, dtype=torch.float32, device=device) +
-                           torch.tensor(bbox_min, dtype=torch.float32, device=device))
-
-            query_grid_num = 6
-            min_val = next_points.min(axis=0).values
-            max_val = next_points.max(axis=0).values
-            vol_queries_index = (next_points - min_val) / (max_val - min_val) * (query_grid_num - 0.001)
-            index = torch.floor(vol_queries_index).long()
-            index = index[..., 0] * (query_grid_num ** 2) + index[..., 1] * query_grid_num + index[..., 2]
-            index = index.sort()
-            next_points = next_points[index.indices].unsqueeze(0).contiguous()
-            unique_values = torch.unique(index.values, return_counts=True)
-            grid_logits = torch.zeros((next_points.shape[1]), dtype=latents.dtype, device=latents.device)
-            input_grid = [[], []]
-            logits_grid_list = []
-            start_num = 0
-            sum_num = 0
-            for grid_index, count in zip(unique_values[0].cpu().tolist(), unique_values[1].cpu().tolist()):
-                if sum_num + count < num_chunks or sum_num == 0:
-                    sum_num += count
-                    input_grid[0].append(grid_index)
-                    input_grid[1].append(count)
-                else:
-                    processor.topk = input_grid
-                    logits_grid = geo_decoder(queries=next_points[:, start_num:start_num + sum_num], latents=latents)
-                    start_num = start_num + sum_num
-                    logits_grid_list.append(logits_grid)
-                    input_grid = [[grid_index], [count]]
-                    sum_num = count
-            if sum_num > 0:
-                processor.topk = input_grid
-                logits_grid = geo_decoder(queries=next_points[:, start_num:start_num + sum_num], latents=latents)
-                logits_grid_list.append(logits_grid)
-            logits_grid = torch.cat(logits_grid_list, dim=1)
-            grid_logits[index.indices] = logits_grid.squeeze(0).squeeze(-1)
-            next_logits[nidx] = grid_logits
-            grid_logits = next_logits.unsqueeze(0)
-
-        grid_logits[grid_logits == -10000.] = float('nan')
+        # 3. refine the near-surface bands of all samples together
+        coords, values = refine_near_surface_band(
+            grid_logits,
+            resolutions,
+            bbox_min,
+            bbox_size,
+            partial(self.decode_points, latents=latents, geo_decoder=geo_decoder, num_chunks=num_chunks),
+            mc_level=mc_level,
+        )
+        volume = SparseVolume.from_packed(coords, values, batch_size, resolutions[-1])
+        if self.sparse_output:
+            return volume
+        return volume.to_dense()
 
-        return grid_logits
+    def decode_points(self, coords, points, resolution, *, latents, geo_decoder, num_chunks=10000):
+        """Decode packed per-sample points in cells, with the cells of all samples packed into common chunks."""
+        processor = self.processor
+        device = points.device
+        if points.shape[0] == 0:
+            return torch.zeros((0,), dtype=latents.dtype, device=device)
+        batch_size = latents.shape[0]
+        sample = coords[:, 0]
+
+        # split the bounding box of every sample's points into query_grid_num ** 3 cells
+        query_grid_num = 6
+        sample_index = sample[:, None].expand(-1, 3)
+        min_val = points.new_full((batch_size, 3), float('inf')).scatter_reduce(0, sample_index, points, 'amin')
+        max_val = points.new_full((batch_size, 3), float('-inf')).scatter_reduce(0, sample_index, points, 'amax')
+        vol_queries_index = (points - min_val[sample]) / (max_val - min_val)[sample] * (query_grid_num - 0.001)
+        index = torch.floor(vol_queries_index).long()
+        index = index[..., 0] * (query_grid_num ** 2) + index[..., 1] * query_grid_num + index[..., 2]
+        index = sample * query_grid_num ** 3 + index
+        cell_index, order = torch.sort(index, stable=True)
+        cell_ids, counts = torch.unique_consecutive(cell_index, return_counts=True)
+        cell_batch = cell_ids // query_grid_num ** 3
+
+        # visit the cells from small to large so that every chunk holds cells of similar size and the
+        # cell padding of the batched attention stays small
+        cell_order = torch.argsort(counts, stable=True)
+        cell_starts = torch.cumsum(counts, 0) - counts
+        counts = counts[cell_order]
+        cell_batch = cell_batch[cell_order]
+        packed_starts = torch.cumsum(counts, 0) - counts
+        offsets = torch.arange(order.shape[0], device=device) - torch.repeat_interleave(packed_starts, counts)
+        order = order[torch.repeat_interleave(cell_starts[cell_order], counts) + offsets]
+        next_points = points[order].unsqueeze(0).contiguous()
+
+        # a chunk takes the cells whose first query falls in its window of num_chunks queries
+        cell_chunk = packed_starts // num_chunks
+        cells_per_chunk = torch.unique_consecutive(cell_chunk, return_counts=True)[1]
+        cell_bounds = torch.cumsum(cells_per_chunk, 0)
+        query_bounds = torch.cumsum(counts, 0)[cell_bounds - 1]
+        cell_bounds, query_bounds = torch.stack([cell_bounds, query_bounds]).cpu().tolist()
+
+        logits_grid_list = []
+        cell_start = query_start = 0
+        for cell_end, query_end in zip(cell_bounds, query_bounds):
+            processor.topk = counts[cell_start:cell_end]
+            # the queries of all samples share one batch, every cell attends to its own sample's tokens
+            processor.cell_batch = cell_batch[cell_start:cell_end] if batch_size > 1 else None
+            logits_grid = geo_decoder(queries=next_points[:, query_start:query_end], latents=latents)
+            logits_grid_list.append(logits_grid)
+            cell_start, query_start = cell_end, query_end
+        logits_grid = torch.cat(logits_grid_list, dim=1)
+        values = torch.zeros((next_points.shape[1]), dtype=latents.dtype, device=device)
+        values[order] = logits_grid.squeeze(0).squeeze(-1)
+        return values
@@ -13,3 +13,4 @@
 # by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
 
 from .hunyuan3ddit import Hunyuan3DDiT
+from .block_cache import DiTBlockCache
@@ -0,0 +1,106 @@
+# Hunyuan 3D is licensed under the TENCENT HUNYUAN NON-COMMERCIAL LICENSE AGREEMENT
+# except for the third-party components listed below.
+# Hunyuan 3D does not impose any additional limitations beyond what is outlined
+# in the repsective licenses of these third-party components.
+# Users must comply with all terms and conditions of original licenses of these third-party
+# components and must ensure that the usage of the third party components adheres to
+# all relevant laws and regulations.
+
+# For avoidance of doubts, Hunyuan 3D means the large language models and
+# their software and algorithms, including trained model weights, parameters (including
+# optimizer states), machine-learning model code, inference-enabling code, training-enabling code,
+# fine-tuning enabling code and other elements of the foregoing made publicly available
+# by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
+
+import torch
+
+from ...utils import logger
+
+
+class DiTBlockCache:
+    """ Timestep-aware cache that reuses the residual of a span of DiT blocks across denoising steps.
+
+        Adjacent flow-matching steps produce nearly identical block outputs. After a full forward pass the cache
+        stores `hidden_out - hidden_in` of the cached span; on the next steps, as long as the relative L1 change of
+        the timestep (modulation) embedding accumulated since that pass stays below `threshold`, the span is skipped
+        and the stored residual is added to its input instead (TeaCache). A recompute is forced after
+        `max_consecutive_skips` reuses, during the first `warmup_steps` calls, and whenever the batch shape changes.
+
+        Reuse policies:
+            - 'all': the whole block stack is cached.
+            - 'partial': the first `num_fresh_blocks` blocks are recomputed every step and only the remaining ones
+              are cached (DeepCache). For `Hunyuan3DDiT` the count refers to single-stream blocks, the double-stream
+              blocks are always recomputed because their text stream feeds the single-stream ones.
+
+        `skipped_blocks` holds the number of skipped blocks for every forward call since the last `reset()`; the
+        pipelines log it after sampling, which is the number to watch when tuning `threshold` per model variant.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.3,
+        policy: str = 'all',
+        num_fresh_blocks: int = 0,
+        warmup_steps: int = 1,
+        max_consecutive_skips: int = 2,
+    ):
+        if policy not in ['all', 'partial']:
+            raise ValueError(f'Unsupported policy {policy}, available: {["all", "partial"]}')
+        self.threshold = threshold
+        self.policy = policy
+        self.num_fresh_blocks = num_fresh_blocks if policy == 'partial' else 0
+        self.warmup_steps = warmup_steps
+        self.max_consecutive_skips = max_consecutive_skips
+        self.reset()
+
+    def reset(self):
+        self.prev_vec = None
+        self.residual = None
+        self.accumulated = 0.0
+        self.consecutive_skips = 0
+        self.skipped_blocks = []
+
+    @torch.no_grad()
+    def should_reuse(self, vec: torch.Tensor, shape) -> bool:
+        step = len(self.skipped_blocks)
+        prev_vec, self.prev_vec = self.prev_vec, vec.detach()
+        if prev_vec is None or prev_vec.shape != vec.shape:
+            self.accumulated = 0.0
+            return False
+
+        change = (vec - prev_vec).abs().mean() / (prev_vec.abs().mean() + 1e-8)
+        self.accumulated += change.item()
+        reuse = (
+            step >= self.warmup_steps
+            and self.residual is not None
+            and self.residual.shape == shape
+            and self.accumulated < self.threshold
+            and self.consecutive_skips < self.max_consecutive_skips
+        )
+        if reuse:
+            self.consecutive_skips += 1
+        else:
+            self.consecutive_skips = 0
+            self.accumulated = 0.0
+        return reuse
+
+    def store(self, hidden_in: torch.Tensor, hidden_out: torch.Tensor):
+        self.residual = hidden_out - hidden_in
+
+    def apply(self, hidden_in: torch.Tensor) -> torch.Tensor:
+        return hidden_in + self.residual
+
+    def record(self, num_skipped: int):
+        self.skipped_blocks.append(num_skipped)
+
+    def stats(self):
+        return {
+            'steps': len(self.skipped_blocks),
+            'skipped_blocks': list(self.skipped_blocks),
+            'total_skipped_blocks': sum(self.skipped_blocks),
+        }
+
+    def log_stats(self, num_blocks: int):
+        total = len(self.skipped_blocks) * num_blocks
+        skipped = sum(self.skipped_blocks)
+        logger.info(f'DiT block cache skipped {skipped}/{total} block evaluations, per step: {self.skipped_blocks}')
@@ -354,6 +354,7 @@ class Hunyuan3DDiT(nn.Module):
         )
 
         self.final_layer = LastLayer(self.hidden_size, 1, self.out_channels)
+        self.block_cache = None
 
         if ckpt_path is not None:
             print('restored denoiser ckpt', ckpt_path)
@@ -398,13 +399,41 @@ class Hunyuan3DDiT(nn.Module):
         cond = self.cond_in(cond)
         pe = None
 
+        cache = self.block_cache
+        if cache is not None and cache.policy == 'all':
+            if cache.should_reuse(vec, latent.shape):
+                cache.record(len(self.double_blocks) + len(self.single_blocks))
+                latent = cache.apply(latent)
+            else:
+                latent_in = latent
+                latent = self.forward_blocks(latent, cond, vec, pe)
+                cache.store(latent_in, latent)
+                cache.record(0)
+        else:
+            latent = self.forward_blocks(latent, cond, vec, pe, cache=cache)
+
+        latent = self.final_layer(latent, vec)
+        return latent
+
+    def forward_blocks(self, latent, cond, vec, pe, cache=None):
         for block in self.double_blocks:
             latent, cond = block(img=latent, txt=cond, vec=vec, pe=pe)
 
         latent = torch.cat((cond, latent), 1)
-        for block in self.single_blocks:
+        num_fresh = len(self.single_blocks) if cache is None else min(cache.num_fresh_blocks, len(self.single_blocks))
+        for block in self.single_blocks[:num_fresh]:
             latent = block(latent, vec=vec, pe=pe)
 
+        if num_fresh < len(self.single_blocks):
+            if cache.should_reuse(vec, latent.shape):
+                cache.record(len(self.single_blocks) - num_fresh)
+                latent = cache.apply(latent)
+            else:
+                hidden_in = latent
+                for block in self.single_blocks[num_fresh:]:
+                    latent = block(latent, vec=vec, pe=pe)
+                cache.store(hidden_in, latent)
+                cache.record(0)
+
         latent = latent[:, cond.shape[1]:, ...]
-        latent = self.final_layer(latent, vec)
         return latent
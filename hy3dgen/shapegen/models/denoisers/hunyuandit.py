@@ -551,6 +551,7 @@ class HunYuanDiTPlain(nn.Module):
         self.depth = depth
 
         self.final_layer = FinalLayer(hidden_size, self.out_channels)
+        self.block_cache = None
 
     def forward(self, x, t, contexts, **kwargs):
         cond = contexts['main']
@@ -574,12 +575,29 @@ class HunYuanDiTPlain(nn.Module):
 
         x = torch.cat([c, x], dim=1)
 
+        cache = self.block_cache
+        num_fresh = self.depth if cache is None else min(cache.num_fresh_blocks, self.depth)
         skip_value_list = []
-        for layer, block in enumerate(self.blocks):
-            skip_value = None if layer <= self.depth // 2 else skip_value_list.pop()
-            x = block(x, c, cond, skip_value=skip_value)
-            if layer < self.depth // 2:
-                skip_value_list.append(x)
+        for layer in range(num_fresh):
+            x = self.forward_block(layer, x, c, cond, skip_value_list)
+
+        if num_fresh < self.depth:
+            if cache.should_reuse(c, x.shape):
+                cache.record(self.depth - num_fresh)
+                x = cache.apply(x)
+            else:
+                hidden_in = x
+                for layer in range(num_fresh, self.depth):
+                    x = self.forward_block(layer, x, c, cond, skip_value_list)
+                cache.store(hidden_in, x)
+                cache.record(0)
 
         x = self.final_layer(x)
         return x
+
+    def forward_block(self, layer, x, c, cond, skip_value_list):
+        skip_value = None if layer <= self.depth // 2 else skip_value_list.pop()
+        x = self.blocks[layer](x, c, cond, skip_value=skip_value)
+        if layer < self.depth // 2:
+            skip_value_list.append(x)
+        return x
@@ -16,7 +16,7 @@ import copy
 import importlib
 import inspect
 import os
-from typing import List, Optional, Union
+from typing import List, Optional, Tuple, Union
 
 import numpy as np
 import torch
@@ -29,7 +29,8 @@ from tqdm import tqdm
 
 from .models.autoencoders import ShapeVAE
 from .models.autoencoders import SurfaceExtractors
-from .utils import logger, synchronize_timer, smart_load_model
+from .models.denoisers import DiTBlockCache
+from .utils import logger, synchronize_timer, smart_load_model, ConditionCache, map_tensors
 
 
 def retrieve_timesteps(
@@ -248,6 +249,8 @@ class Hunyuan3DDiTPipeline:
         self.conditioner = conditioner
         self.image_processor = image_processor
         self.kwargs = kwargs
+        self.cond_cache = None
+        self.sampler_stats = None
         self.to(device, dtype)
 
     def compile(self):
@@ -255,6 +258,38 @@ class Hunyuan3DDiTPipeline:
         self.model = torch.compile(self.model)
         self.conditioner = torch.compile(self.conditioner)
 
+    def enable_cond_cache(self, enabled: bool = True, max_bytes: int = 1024 ** 3, device='cpu'):
+        if enabled:
+            self.cond_cache = ConditionCache(max_bytes=max_bytes, device=device)
+        else:
+            self.cond_cache = None
+
+    @property
+    def num_dit_blocks(self):
+        if hasattr(self.model, 'double_blocks'):
+            return len(self.model.double_blocks) + len(self.model.single_blocks)
+        return len(self.model.blocks)
+
+    def enable_block_cache(
+        self,
+        enabled: bool = True,
+        threshold: float = 0.3,
+        policy: str = 'all',
+        num_fresh_blocks: int = 0,
+        warmup_steps: int = 1,
+        max_consecutive_skips: int = 2,
+    ):
+        if enabled:
+            self.model.block_cache = DiTBlockCache(
+                threshold=threshold,
+                policy=policy,
+                num_fresh_blocks=num_fresh_blocks,
+                warmup_steps=warmup_steps,
+                max_consecutive_skips=max_consecutive_skips,
+            )
+        else:
+            self.model.block_cache = None
+
     def enable_flashvdm(
         self,
         enabled: bool = True,
@@ -262,6 +297,7 @@ class Hunyuan3DDiTPipeline:
         topk_mode='mean',
         mc_algo='mc',
         replace_vae=True,
+        sparse_output=False,
     ):
         if enabled:
             model_path = self.kwargs['from_pretrained_kwargs']['model_path']
@@ -282,7 +318,8 @@ class Hunyuan3DDiTPipeline:
                 enabled=enabled,
                 adaptive_kv_selection=adaptive_kv_selection,
                 topk_mode=topk_mode,
-                mc_algo=mc_algo
+                mc_algo=mc_algo,
+                sparse_output=sparse_output,
             )
         else:
             model_path = self.kwargs['from_pretrained_kwargs']['model_path']
@@ -423,10 +460,24 @@ class Hunyuan3DDiTPipeline:
     @synchronize_timer('Encode cond')
     def encode_cond(self, image, additional_cond_inputs, do_classifier_free_guidance, dual_guidance):
         bsz = image.shape[0]
-        cond = self.conditioner(image=image, **additional_cond_inputs)
+        cond_cache = self.cond_cache
+        if cond_cache is None:
+            cond = self.conditioner(image=image, **additional_cond_inputs)
+        else:
+            key = cond_cache.make_key(image, self.conditioner, additional_cond_inputs)
+            cond = cond_cache.get(key, device=self.device)
+            if cond is None:
+                cond = self.conditioner(image=image, **additional_cond_inputs)
+                cond_cache.put(key, cond)
 
         if do_classifier_free_guidance:
-            un_cond = self.conditioner.unconditional_embedding(bsz, **additional_cond_inputs)
+            if cond_cache is None:
+                un_cond = self.conditioner.unconditional_embedding(bsz, **additional_cond_inputs)
+            else:
+                un_cond = cond_cache.get_unconditional(
+                    cond_cache.make_unconditional_key(bsz, self.conditioner, additional_cond_inputs),
+                    lambda: self.conditioner.unconditional_embedding(bsz, **additional_cond_inputs),
+                )
 
             if dual_guidance:
                 un_cond_drop_main = copy.deepcopy(un_cond)
@@ -546,7 +597,12 @@ class Hunyuan3DDiTPipeline:
                     'pipeline.vae.surface_extractor = SurfaceExtractors[mc_algo]() instead\n')
         if mc_algo not in SurfaceExtractors.keys():
             raise ValueError(f"Unknown mc_algo {mc_algo}")
-        self.vae.surface_extractor = SurfaceExtractors[mc_algo]()
+        # keep the current extractor, and any worker pool it owns, when it is already of the requested kind
+        current = self.vae.surface_extractor
+        if type(current) is not SurfaceExtractors[mc_algo]:
+            if hasattr(current, 'shutdown'):
+                current.shutdown()
+            self.vae.surface_extractor = SurfaceExtractors[mc_algo]()
 
     @torch.no_grad()
     def __call__(
@@ -568,6 +624,7 @@ class Hunyuan3DDiTPipeline:
         output_type: Optional[str] = "trimesh",
         enable_pbar=True,
         output_dir=None,
+        memory_budget: Optional[int] = None,
         **kwargs,
     ) -> List[List[trimesh.Trimesh]]:
         callback = kwargs.pop("callback", None)
@@ -605,6 +662,9 @@ class Hunyuan3DDiTPipeline:
             guidance_cond = self.get_guidance_scale_embedding(
                 guidance_scale_tensor, embedding_dim=self.model.guidance_cond_proj_dim
             ).to(device=device, dtype=latents.dtype)
+        block_cache = getattr(self.model, 'block_cache', None)
+        if block_cache is not None:
+            block_cache.reset()
         with synchronize_timer('Diffusion Sampling'):
             for i, t in enumerate(tqdm(timesteps, disable=not enable_pbar, desc="Diffusion Sampling:", leave=False)):
                 # expand the latents if we are doing classifier free guidance
@@ -640,10 +700,14 @@ class Hunyuan3DDiTPipeline:
                     step_idx = i // getattr(self.scheduler, "order", 1)
                     callback(step_idx, t, outputs)
 
+        if block_cache is not None:
+            block_cache.log_stats(self.num_dit_blocks)
+
         return self._export(
             latents,
             output_type,
             box_v, mc_level, num_chunks, octree_resolution, mc_algo,
+            memory_budget=memory_budget,
         )
 
     def _export(
@@ -655,35 +719,91 @@ class Hunyuan3DDiTPipeline:
         num_chunks=20000,
         octree_resolution=256,
         mc_algo='mc',
-        enable_pbar=True
+        enable_pbar=True,
+        memory_budget: Optional[int] = None,
     ):
+        """Decode the latents to meshes.
+
+        With `memory_budget` (bytes) set, `num_chunks` is derived from it and the decoder config, see
+        `ShapeVAE.calibrate_decoder_memory`.
+        """
         if not output_type == "latent":
-            latents = 1. / self.vae.scale_factor * latents
-            latents = self.vae(latents)
-            outputs = self.vae.latents2mesh(
-                latents,
-                bounds=box_v,
-                mc_level=mc_level,
-                num_chunks=num_chunks,
-                octree_resolution=octree_resolution,
-                mc_algo=mc_algo,
+            grid_logits = self.decode_volume(
+                latents, box_v, mc_level, num_chunks, octree_resolution, mc_algo,
                 enable_pbar=enable_pbar,
+                memory_budget=memory_budget,
             )
+            outputs = self.extract_surface(grid_logits, output_type, box_v, mc_level, octree_resolution)
         else:
             outputs = latents
 
+        return outputs
+
+    def decode_volume(
+        self,
+        latents,
+        box_v=1.01,
+        mc_level=0.0,
+        num_chunks=20000,
+        octree_resolution=256,
+        mc_algo='mc',
+        enable_pbar=True,
+        memory_budget: Optional[int] = None,
+    ):
+        """The accelerator half of `_export`: VAE decoding of the latents into grid logits."""
+        latents = 1. / self.vae.scale_factor * latents
+        latents = self.vae(latents)
+        return self.vae.latents2grid(
+            latents,
+            bounds=box_v,
+            mc_level=mc_level,
+            num_chunks=num_chunks,
+            octree_resolution=octree_resolution,
+            mc_algo=mc_algo,
+            enable_pbar=enable_pbar,
+            memory_budget=memory_budget,
+        )
+
+    def extract_surface(self, grid_logits, output_type='trimesh', box_v=1.01, mc_level=0.0, octree_resolution=256):
+        """The CPU half of `_export`: surface extraction from the grid logits of `decode_volume`."""
+        outputs = self.vae.grid2mesh(grid_logits, bounds=box_v, mc_level=mc_level, octree_resolution=octree_resolution)
         if output_type == 'trimesh':
             outputs = export_to_trimesh(outputs)
-
         return outputs
 
 
 class Hunyuan3DDiTFlowMatchingPipeline(Hunyuan3DDiTPipeline):
 
+    def save_cond_images(self, image, cond_inputs, output_dir):
+        """Dump the preprocessed condition images, one file per sample (and per view)."""
+        idx_dir_map = {
+            0: 'front',
+            1: 'left',
+            2: 'back',
+            3: 'right',
+        }
+        batch_size = image.shape[0]
+        for b in range(batch_size):
+            prefix = '' if batch_size == 1 else f'{b}_'
+            if 'view_idxs' in cond_inputs:
+                view_idxs = cond_inputs['view_idxs'][b]
+                images = image[b]
+                names = [idx_dir_map[view_idx] for view_idx in view_idxs]
+            else:
+                images = image[b:b + 1]
+                names = ['input']
+            for img, name in zip(images, names):
+                img = img.cpu().clone()
+                img = (img + 1) / 2
+                img = (img * 255).clamp(0, 255).byte()
+                img = img.permute(1, 2, 0)
+                img_pil = Image.fromarray(img.numpy())
+                img_pil.save(f'{output_dir}/{prefix}{name}.png')
+
     @torch.inference_mode()
     def __call__(
         self,
-        image: Union[str, List[str], Image.Image, dict, List[dict]] = None,
+        image: Union[str, List[str], Image.Image, List[Image.Image], dict, List[dict]] = None,
         num_inference_steps: int = 50,
         timesteps: List[int] = None,
         sigmas: List[float] = None,
@@ -698,8 +818,23 @@ class Hunyuan3DDiTFlowMatchingPipeline(Hunyuan3DDiTPipeline):
         output_type: Optional[str] = "trimesh",
         enable_pbar=True,
         output_dir=None,
+        memory_budget: Optional[int] = None,
+        num_samples_per_image: int = 1,
+        guidance_interval: Tuple[float, float] = (0.0, 1.0),
+        guidance_convergence_threshold: Optional[float] = None,
         **kwargs,
     ) -> List[List[trimesh.Trimesh]]:
+        """
+        `num_samples_per_image` candidates are generated for every input image from a single conditioning pass.
+        Outputs are ordered image-major, i.e. `[img0_sample0, img0_sample1, ..., img1_sample0, ...]`, and `generator`
+        may be a list with one generator per output.
+
+        Classifier-free guidance is only applied for the fraction of steps inside `guidance_interval`, e.g. `(0.0, 0.6)`
+        drops the unconditional branch for the last 40% of the steps. With `guidance_convergence_threshold` set, it is
+        also dropped for the remaining steps once the relative L1 distance between the conditional and unconditional
+        predictions falls below the threshold. Steps without guidance run the DiT at the un-doubled batch size; see
+        `self.sampler_stats` after the call.
+        """
         callback = kwargs.pop("callback", None)
         callback_steps = kwargs.pop("callback_steps", None)
 
@@ -714,31 +849,8 @@ class Hunyuan3DDiTFlowMatchingPipeline(Hunyuan3DDiTPipeline):
 
         cond_inputs = self.prepare_image(image)
         image = cond_inputs.pop('image')
-        image_copy = image.clone()
-        if 'view_idxs' in cond_inputs:
-            view_idxs = cond_inputs['view_idxs'][0]
-            # save image to output_dir
-            image_reshape = image.reshape(-1, *image.shape[-3:])
-            idx_dir_map = {
-                0: 'front',
-                1: 'left',
-                2: 'back',
-                3: 'right',
-            }
-            for i, img in enumerate(image_reshape):
-                img = img.cpu().clone()
-                img = (img + 1) / 2
-                img = (img * 255).clamp(0, 255).byte()
-                img = img.permute(1, 2, 0) 
-                img_pil = Image.fromarray(img.numpy())
-                img_pil.save(f'{output_dir}/{idx_dir_map[view_idxs[i]]}.png')
-        else:
-            img = image.squeeze(0).cpu().clone()
-            img = (img + 1) / 2
-            img = (img * 255).clamp(0, 255).byte()
-            img = img.permute(1, 2, 0) 
-            img_pil = Image.fromarray(img.numpy())
-            img_pil.save(f'{output_dir}/input.png')
+        if output_dir is not None:
+            self.save_cond_images(image, cond_inputs, output_dir)
 
         cond = self.encode_cond(
             image=image,
@@ -746,7 +858,10 @@ class Hunyuan3DDiTFlowMatchingPipeline(Hunyuan3DDiTPipeline):
             do_classifier_free_guidance=do_classifier_free_guidance,
             dual_guidance=False,
         )
-        batch_size = image.shape[0]
+        batch_size = image.shape[0] * num_samples_per_image
+        if num_samples_per_image > 1:
+            # [cond; uncond] stays split at the middle after interleaving, so CFG chunking still works
+            cond = map_tensors(lambda t: t.repeat_interleave(num_samples_per_image, dim=0), cond)
 
         # 5. Prepare timesteps
         # NOTE: this is slightly different from common usage, we start from 0.
@@ -765,10 +880,30 @@ class Hunyuan3DDiTFlowMatchingPipeline(Hunyuan3DDiTPipeline):
             guidance = torch.tensor([guidance_scale] * batch_size, device=device, dtype=dtype)
             # logger.info(f'Using guidance embed with scale {guidance_scale}')
 
+        block_cache = getattr(self.model, 'block_cache', None)
+        if block_cache is not None:
+            block_cache.reset()
+
+        # conditional half of [cond; uncond], used on steps that skip guidance
+        cond_only = map_tensors(lambda t: t[:batch_size], cond) if do_classifier_free_guidance else cond
+        guidance_start, guidance_end = guidance_interval
+        guidance_converged = False
+        self.sampler_stats = {
+            'num_steps': len(timesteps),
+            'guided_steps': 0,
+            'model_batch_evals': 0,
+            'guidance_converged_at': None,
+            'cond_uncond_distance': [],
+        }
         with synchronize_timer('Diffusion Sampling'):
             for i, t in enumerate(tqdm(timesteps, disable=not enable_pbar, desc="Diffusion Sampling:")):
+                use_guidance = (
+                    do_classifier_free_guidance
+                    and not guidance_converged
+                    and guidance_start <= i / len(timesteps) < guidance_end
+                )
                 # expand the latents if we are doing classifier free guidance
-                if do_classifier_free_guidance:
+                if use_guidance:
                     latent_model_input = torch.cat([latents] * 2)
                 else:
                     latent_model_input = latents
@@ -776,11 +911,21 @@ class Hunyuan3DDiTFlowMatchingPipeline(Hunyuan3DDiTPipeline):
                 # NOTE: we assume model get timesteps ranged from 0 to 1
                 timestep = t.expand(latent_model_input.shape[0]).to(
                     latents.dtype) / self.scheduler.config.num_train_timesteps
-                noise_pred = self.model(latent_model_input, timestep, cond, guidance=guidance)
+                noise_pred = self.model(latent_model_input, timestep, cond if use_guidance else cond_only,
+                                        guidance=guidance)
+                self.sampler_stats['model_batch_evals'] += latent_model_input.shape[0]
 
-                if do_classifier_free_guidance:
+                if use_guidance:
                     noise_pred_cond, noise_pred_uncond = noise_pred.chunk(2)
                     noise_pred = noise_pred_uncond + guidance_scale * (noise_pred_cond - noise_pred_uncond)
+                    self.sampler_stats['guided_steps'] += 1
+                    if guidance_convergence_threshold is not None:
+                        distance = ((noise_pred_cond - noise_pred_uncond).abs().mean() /
+                                    (noise_pred_cond.abs().mean() + 1e-8)).item()
+                        self.sampler_stats['cond_uncond_distance'].append(distance)
+                        if distance < guidance_convergence_threshold:
+                            guidance_converged = True
+                            self.sampler_stats['guidance_converged_at'] = i
 
                 # compute the previous noisy sample x_t -> x_t-1
                 outputs = self.scheduler.step(noise_pred, t, latents)
@@ -790,9 +935,16 @@ class Hunyuan3DDiTFlowMatchingPipeline(Hunyuan3DDiTPipeline):
                     step_idx = i // getattr(self.scheduler, "order", 1)
                     callback(step_idx, t, outputs)
 
+        if block_cache is not None:
+            block_cache.log_stats(self.num_dit_blocks)
+        if do_classifier_free_guidance and (guidance_interval != (0.0, 1.0) or guidance_convergence_threshold):
+            logger.info(f"Guided {self.sampler_stats['guided_steps']}/{self.sampler_stats['num_steps']} steps, "
+                        f"converged at step {self.sampler_stats['guidance_converged_at']}")
+
         return self._export(
             latents,
             output_type,
             box_v, mc_level, num_chunks, octree_resolution, mc_algo,
             enable_pbar=enable_pbar,
+            memory_budget=memory_budget,
         )
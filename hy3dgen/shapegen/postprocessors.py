@@ -12,17 +12,29 @@
 # fine-tuning enabling code and other elements of the foregoing made publicly available
 # by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
 
+from __future__ import annotations
+
 import os
+import subprocess
 import tempfile
-from typing import Union
+import time
+from typing import Union, List, Tuple, Dict, Any
 
 import numpy as np
-import pymeshlab
 import torch
 import trimesh
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+try:
+    import pymeshlab
+except ImportError:
+    # the NumPy postprocessors below work without it
+    pymeshlab = None
 
 from .models.autoencoders import Latent2MeshOutput
-from .utils import synchronize_timer
+from .simplification import simplify_quadric
+from .utils import logger, synchronize_timer
 
 
 def load_mesh(path):
@@ -34,7 +46,7 @@ def load_mesh(path):
     return mesh
 
 
-def reduce_face(mesh: pymeshlab.MeshSet, max_facenum: int = 200000):
+def reduce_face(mesh: pymeshlab.MeshSet, max_facenum: int = 200000, boundary_weight: float = 3):
     if max_facenum > mesh.current_mesh().face_number():
         return mesh
 
@@ -43,7 +55,7 @@ def reduce_face(mesh: pymeshlab.MeshSet, max_facenum: int = 200000):
         targetfacenum=max_facenum,
         qualitythr=1.0,
         preserveboundary=True,
-        boundaryweight=3,
+        boundaryweight=boundary_weight,
         preservenormal=True,
         preservetopology=True,
         autoclean=True
@@ -59,55 +71,82 @@ def remove_floater(mesh: pymeshlab.MeshSet):
     return mesh
 
 
-def pymeshlab2trimesh(mesh: pymeshlab.MeshSet):
-    with tempfile.NamedTemporaryFile(suffix='.ply', delete=False) as temp_file:
-        mesh.save_current_mesh(temp_file.name)
-        mesh = trimesh.load(temp_file.name)
-    # 检查加载的对象类型
-    if isinstance(mesh, trimesh.Scene):
-        combined_mesh = trimesh.Trimesh()
-        # 如果是Scene，遍历所有的geometry并合并
-        for geom in mesh.geometry.values():
-            combined_mesh = trimesh.util.concatenate([combined_mesh, geom])
-        mesh = combined_mesh
+def remove_degenerate_face(mesh: pymeshlab.MeshSet):
+    mesh.apply_filter("meshing_remove_null_faces")
+    mesh.apply_filter("meshing_remove_unreferenced_vertices")
     return mesh
 
 
+def _merge_scene(mesh: trimesh.Scene) -> trimesh.Trimesh:
+    return trimesh.util.concatenate(list(mesh.geometry.values()))
+
+
+def pymeshlab2trimesh(mesh: pymeshlab.MeshSet):
+    """Build a `trimesh.Trimesh` from the current mesh of `mesh`, keeping normals, UVs and vertex colors."""
+    current = mesh.current_mesh()
+    kwargs = dict(vertex_normals=current.vertex_normal_matrix())
+    if current.has_vertex_tex_coord():
+        kwargs['visual'] = trimesh.visual.TextureVisuals(uv=current.vertex_tex_coord_matrix())
+    elif current.has_vertex_color():
+        kwargs['vertex_colors'] = np.round(current.vertex_color_matrix() * 255).astype(np.uint8)
+    return trimesh.Trimesh(current.vertex_matrix(), current.face_matrix(), **kwargs)
+
+
 def trimesh2pymeshlab(mesh: trimesh.Trimesh):
-    with tempfile.NamedTemporaryFile(suffix='.ply', delete=False) as temp_file:
-        if isinstance(mesh, trimesh.scene.Scene):
-            for idx, obj in enumerate(mesh.geometry.values()):
-                if idx == 0:
-                    temp_mesh = obj
-                else:
-                    temp_mesh = temp_mesh + obj
-            mesh = temp_mesh
-        mesh.export(temp_file.name)
-        mesh = pymeshlab.MeshSet()
-        mesh.load_new_mesh(temp_file.name)
-    return mesh
+    """Wrap the arrays of `mesh` in a `pymeshlab.MeshSet`, keeping cached normals, UVs and vertex colors."""
+    if isinstance(mesh, trimesh.scene.Scene):
+        mesh = _merge_scene(mesh)
+    kwargs = dict(
+        vertex_matrix=np.asarray(mesh.vertices, dtype=np.float64),
+        face_matrix=np.asarray(mesh.faces, dtype=np.int32),
+    )
+    # only pass normals trimesh already has, computing them here would be wasted work
+    if 'vertex_normals' in mesh._cache:
+        kwargs['v_normals_matrix'] = np.asarray(mesh.vertex_normals, dtype=np.float64)
+    if isinstance(mesh.visual, trimesh.visual.TextureVisuals) and mesh.visual.uv is not None:
+        kwargs['v_tex_coords_matrix'] = np.asarray(mesh.visual.uv, dtype=np.float64)
+    elif mesh.visual.kind == 'vertex':
+        kwargs['v_color_matrix'] = np.asarray(mesh.visual.vertex_colors, dtype=np.float64) / 255
+    ms = pymeshlab.MeshSet()
+    ms.add_mesh(pymeshlab.Mesh(**kwargs), "converted_mesh")
+    return ms
+
+
+def compact_meshset(mesh: pymeshlab.MeshSet) -> pymeshlab.MeshSet:
+    """Rebuild the current mesh from its matrices, which leaves out the elements flagged as deleted."""
+    current = mesh.current_mesh()
+    ms = pymeshlab.MeshSet()
+    ms.add_mesh(pymeshlab.Mesh(vertex_matrix=current.vertex_matrix(), face_matrix=current.face_matrix()),
+                "converted_mesh")
+    return ms
+
+
+def pymeshlab2latent(mesh: pymeshlab.MeshSet) -> Latent2MeshOutput:
+    current = mesh.current_mesh()
+    return Latent2MeshOutput(mesh_v=current.vertex_matrix(), mesh_f=current.face_matrix())
 
 
 def export_mesh(input, output):
     if isinstance(input, pymeshlab.MeshSet):
         mesh = output
     elif isinstance(input, Latent2MeshOutput):
-        output = Latent2MeshOutput()
-        output.mesh_v = output.current_mesh().vertex_matrix()
-        output.mesh_f = output.current_mesh().face_matrix()
-        mesh = output
+        mesh = pymeshlab2latent(output)
     else:
         mesh = pymeshlab2trimesh(output)
     return mesh
 
 
 def import_mesh(mesh: Union[pymeshlab.MeshSet, trimesh.Trimesh, Latent2MeshOutput, str]) -> pymeshlab.MeshSet:
+    if pymeshlab is None:
+        raise ImportError('Please install the package "pymeshlab", or use the NumPy postprocessors.')
     if isinstance(mesh, str):
         mesh = load_mesh(mesh)
     elif isinstance(mesh, Latent2MeshOutput):
-        mesh = pymeshlab.MeshSet()
-        mesh_pymeshlab = pymeshlab.Mesh(vertex_matrix=mesh.mesh_v, face_matrix=mesh.mesh_f)
-        mesh.add_mesh(mesh_pymeshlab, "converted_mesh")
+        ms = pymeshlab.MeshSet()
+        mesh_pymeshlab = pymeshlab.Mesh(vertex_matrix=np.asarray(mesh.mesh_v, dtype=np.float64),
+                                        face_matrix=np.asarray(mesh.mesh_f, dtype=np.int32))
+        ms.add_mesh(mesh_pymeshlab, "converted_mesh")
+        mesh = ms
 
     if isinstance(mesh, (trimesh.Trimesh, trimesh.scene.Scene)):
         mesh = trimesh2pymeshlab(mesh)
@@ -147,16 +186,200 @@ class DegenerateFaceRemover:
         mesh: Union[pymeshlab.MeshSet, trimesh.Trimesh, Latent2MeshOutput, str],
     ) -> Union[pymeshlab.MeshSet, trimesh.Trimesh, Latent2MeshOutput]:
         ms = import_mesh(mesh)
-
-        with tempfile.NamedTemporaryFile(suffix='.ply', delete=False) as temp_file:
-            ms.save_current_mesh(temp_file.name)
-            ms = pymeshlab.MeshSet()
-            ms.load_new_mesh(temp_file.name)
-
+        ms = compact_meshset(ms)
         mesh = export_mesh(mesh, ms)
         return mesh
 
 
+MESH_CLEANUP_OPERATIONS = {
+    'remove_floater': remove_floater,
+    'remove_degenerate_face': remove_degenerate_face,
+    'reduce_face': reduce_face,
+}
+
+
+class MeshCleanupPipeline:
+    """Run an ordered list of cleanup operations in one `pymeshlab.MeshSet`, converting in and out once.
+
+    Each operation is a name from `MESH_CLEANUP_OPERATIONS` or a `(name, kwargs)` pair, e.g.
+    ``MeshCleanupPipeline(['remove_floater', 'remove_degenerate_face', ('reduce_face', {'max_facenum': 40000})])``.
+    After every call, `report` holds the seconds and face counts of each operation.
+    """
+
+    def __init__(self, operations: List[Union[str, Tuple[str, Dict[str, Any]]]] = None):
+        if operations is None:
+            operations = ['remove_floater', 'remove_degenerate_face', ('reduce_face', {'max_facenum': 40000})]
+        self.operations = []
+        for operation in operations:
+            name, kwargs = (operation, {}) if isinstance(operation, str) else operation
+            if name not in MESH_CLEANUP_OPERATIONS:
+                raise ValueError(f'Unknown cleanup operation {name}, available: {list(MESH_CLEANUP_OPERATIONS)}')
+            self.operations.append((name, dict(kwargs)))
+        self.report = []
+
+    @synchronize_timer('MeshCleanupPipeline')
+    def __call__(
+        self,
+        mesh: Union[pymeshlab.MeshSet, trimesh.Trimesh, Latent2MeshOutput, str],
+    ) -> Union[pymeshlab.MeshSet, trimesh.Trimesh, Latent2MeshOutput]:
+        ms = import_mesh(mesh)
+        self.report = []
+        for name, kwargs in self.operations:
+            faces_before = ms.current_mesh().face_number()
+            start = time.perf_counter()
+            ms = MESH_CLEANUP_OPERATIONS[name](ms, **kwargs)
+            self.report.append(dict(
+                operation=name,
+                seconds=time.perf_counter() - start,
+                faces_before=faces_before,
+                faces_after=ms.current_mesh().face_number(),
+            ))
+        for entry in self.report:
+            logger.info(f"{entry['operation']}: {entry['faces_before']} -> {entry['faces_after']} faces "
+                        f"in {entry['seconds'] * 1000:.1f} ms")
+        return export_mesh(mesh, ms)
+
+
+def face_components(faces: np.ndarray):
+    """Label the connected components of the faces, two faces being adjacent when they share an edge."""
+    num_faces = len(faces)
+    edges = np.sort(faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1).astype(np.int64)
+    edge_keys = edges[:, 0] * (int(faces.max()) + 1) + edges[:, 1]
+    _, edge_index = np.unique(edge_keys, return_inverse=True)
+    # bipartite face-edge graph: faces are nodes [0, F), edges are nodes [F, F + E)
+    rows = np.repeat(np.arange(num_faces), 3)
+    cols = num_faces + edge_index.reshape(-1)
+    size = num_faces + int(edge_index.max()) + 1
+    graph = coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(size, size))
+    _, labels = connected_components(graph, directed=False)
+    _, labels = np.unique(labels[:num_faces], return_inverse=True)
+    return labels.reshape(-1)
+
+
+def triangle_areas(vertices: np.ndarray, faces: np.ndarray):
+    v0, v1, v2 = (vertices[faces[:, i]] for i in range(3))
+    return 0.5 * np.linalg.norm(np.cross(v1 - v0, v2 - v0), axis=1)
+
+
+def compact_arrays(vertices: np.ndarray, faces: np.ndarray):
+    """Drop the vertices no face references and reindex the faces."""
+    used = np.zeros(len(vertices), dtype=bool)
+    used[faces.reshape(-1)] = True
+    new_index = np.cumsum(used) - 1
+    return vertices[used], new_index[faces]
+
+
+def remove_floater_arrays(vertices: np.ndarray, faces: np.ndarray, nbfaceratio: float = 0.005,
+                          by_area: bool = False):
+    """Drop the components smaller than `nbfaceratio` times the largest one, like `remove_floater`.
+
+    Components are compared by face count as pymeshlab does, or by surface area with `by_area`.
+    """
+    if len(faces) == 0:
+        return vertices, faces
+    labels = face_components(faces)
+    weights = triangle_areas(vertices, faces) if by_area else None
+    sizes = np.bincount(labels, weights=weights)
+    keep = sizes[labels] >= nbfaceratio * sizes.max()
+    return compact_arrays(vertices, faces[keep])
+
+
+def cluster_vertices(vertices: np.ndarray, faces: np.ndarray, resolution: int):
+    """Merge the vertices falling into the same cell of a `resolution`^3 grid over the bounding box."""
+    vmin = vertices.min(axis=0)
+    extent = max(float((vertices.max(axis=0) - vmin).max()), 1e-12)
+    cells = np.minimum(((vertices - vmin) / extent * resolution).astype(np.int64), resolution - 1)
+    keys = (cells[:, 0] * resolution + cells[:, 1]) * resolution + cells[:, 2]
+    _, cluster, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    cluster = cluster.reshape(-1)
+    new_vertices = np.zeros((len(counts), 3), dtype=np.float64)
+    np.add.at(new_vertices, cluster, vertices)
+    new_vertices /= counts[:, None]
+    new_faces = cluster[faces]
+    valid = (new_faces[:, 0] != new_faces[:, 1]) & (new_faces[:, 1] != new_faces[:, 2]) & \
+            (new_faces[:, 2] != new_faces[:, 0])
+    new_faces = new_faces[valid]
+    # the same triangle can come out of several original ones, keep one copy per winding-free key
+    _, unique_faces = np.unique(np.sort(new_faces, axis=1), axis=0, return_index=True)
+    new_faces = new_faces[np.sort(unique_faces)]
+    return compact_arrays(new_vertices.astype(vertices.dtype), new_faces)
+
+
+def reduce_face_arrays(vertices: np.ndarray, faces: np.ndarray, max_facenum: int = 200000):
+    """Reduce the face count below `max_facenum` with vertex clustering on the finest grid that fits."""
+    if max_facenum > len(faces):
+        return vertices, faces
+    low, high = 1, 2048
+    best = cluster_vertices(vertices, faces, low)
+    while low < high:
+        resolution = (low + high + 1) // 2
+        result = cluster_vertices(vertices, faces, resolution)
+        if len(result[1]) <= max_facenum:
+            low, best = resolution, result
+        else:
+            high = resolution - 1
+    return best
+
+
+def _mesh_to_arrays(mesh: Union[trimesh.Trimesh, Latent2MeshOutput]):
+    if isinstance(mesh, Latent2MeshOutput):
+        return np.asarray(mesh.mesh_v), np.asarray(mesh.mesh_f)
+    if isinstance(mesh, trimesh.Scene):
+        mesh = _merge_scene(mesh)
+    return np.asarray(mesh.vertices), np.asarray(mesh.faces)
+
+
+def _arrays_to_mesh(input, vertices: np.ndarray, faces: np.ndarray):
+    if isinstance(input, Latent2MeshOutput):
+        return Latent2MeshOutput(mesh_v=vertices, mesh_f=faces)
+    return trimesh.Trimesh(vertices, faces, process=False)
+
+
+class NumpyFloaterRemover:
+    """`FloaterRemover` on NumPy/SciPy only, for workers without pymeshlab.
+
+    Works on the geometry alone: a `trimesh.Trimesh` input comes back without its visuals.
+    """
+
+    def __init__(self, nbfaceratio: float = 0.005, by_area: bool = False):
+        self.nbfaceratio = nbfaceratio
+        self.by_area = by_area
+
+    @synchronize_timer('NumpyFloaterRemover')
+    def __call__(
+        self,
+        mesh: Union[trimesh.Trimesh, Latent2MeshOutput],
+    ) -> Union[trimesh.Trimesh, Latent2MeshOutput]:
+        vertices, faces = _mesh_to_arrays(mesh)
+        vertices, faces = remove_floater_arrays(vertices, faces, self.nbfaceratio, self.by_area)
+        return _arrays_to_mesh(mesh, vertices, faces)
+
+
+class NumpyFaceReducer:
+    """`FaceReducer` on NumPy only, with vertex clustering in place of quadric edge collapse."""
+
+    @synchronize_timer('NumpyFaceReducer')
+    def __call__(
+        self,
+        mesh: Union[trimesh.Trimesh, Latent2MeshOutput],
+        max_facenum: int = 40000
+    ) -> Union[trimesh.Trimesh, Latent2MeshOutput]:
+        vertices, faces = _mesh_to_arrays(mesh)
+        vertices, faces = reduce_face_arrays(vertices, faces, max_facenum=max_facenum)
+        return _arrays_to_mesh(mesh, vertices, faces)
+
+
+FloaterRemovers = {
+    'pymeshlab': FloaterRemover,
+    'numpy': NumpyFloaterRemover,
+}
+
+FaceReducers = {
+    'pymeshlab': FaceReducer,
+    'numpy': NumpyFaceReducer,
+}
+
+
 def mesh_normalize(mesh):
     """
     Normalize mesh vertices to sphere
@@ -177,26 +400,63 @@ def mesh_normalize(mesh):
 
 
 class MeshSimplifier:
+    """In-process quadric edge-collapse simplification.
+
+    Runs pymeshlab's `meshing_decimation_quadric_edge_collapse` on the mesh arrays, with the settings of
+    `reduce_face`. Without pymeshlab it falls back to the much slower pure-Python
+    `simplification.simplify_quadric`.
+    """
+
+    def __init__(self, target_facenum: int = 40000, boundary_weight: float = 3.0):
+        self.target_facenum = target_facenum
+        self.boundary_weight = boundary_weight
+
+    @synchronize_timer('MeshSimplifier')
+    def __call__(
+        self,
+        mesh: Union[trimesh.Trimesh],
+    ) -> Union[trimesh.Trimesh]:
+        if isinstance(mesh, trimesh.Scene):
+            mesh = _merge_scene(mesh)
+        if pymeshlab is not None:
+            ms = trimesh2pymeshlab(trimesh.Trimesh(mesh.vertices, mesh.faces, process=False))
+            ms = reduce_face(ms, max_facenum=self.target_facenum, boundary_weight=self.boundary_weight)
+            current = ms.current_mesh()
+            vertices, faces = current.vertex_matrix(), current.face_matrix()
+        else:
+            logger.warning('pymeshlab is not installed, simplifying with the pure-Python quadric collapse.')
+            vertices, faces = simplify_quadric(
+                mesh.vertices,
+                mesh.faces,
+                target_facenum=self.target_facenum,
+                boundary_weight=self.boundary_weight,
+            )
+        ms = trimesh.Trimesh(vertices, faces, process=False)
+        ms = mesh_normalize(ms)
+        return ms
+
+
+class SubprocessMeshSimplifier:
+    """Simplification through the external `mesh_simplifier.bin`, kept for comparison with `MeshSimplifier`."""
+
     def __init__(self, executable: str = None):
         if executable is None:
             CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
             executable = os.path.join(CURRENT_DIR, "mesh_simplifier.bin")
         self.executable = executable
 
-    @synchronize_timer('MeshSimplifier')
+    @synchronize_timer('SubprocessMeshSimplifier')
     def __call__(
         self,
         mesh: Union[trimesh.Trimesh],
     ) -> Union[trimesh.Trimesh]:
-        with tempfile.NamedTemporaryFile(suffix='.obj', delete=False) as temp_input:
-            with tempfile.NamedTemporaryFile(suffix='.obj', delete=False) as temp_output:
-                mesh.export(temp_input.name)
-                os.system(f'{self.executable} {temp_input.name} {temp_output.name}')
-                ms = trimesh.load(temp_output.name, process=False)
-                if isinstance(ms, trimesh.Scene):
-                    combined_mesh = trimesh.Trimesh()
-                    for geom in ms.geometry.values():
-                        combined_mesh = trimesh.util.concatenate([combined_mesh, geom])
-                    ms = combined_mesh
-                ms = mesh_normalize(ms)
-                return ms
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_path = os.path.join(temp_dir, 'input.obj')
+            output_path = os.path.join(temp_dir, 'output.obj')
+            mesh.export(input_path)
+            subprocess.run([self.executable, input_path, output_path], check=True, capture_output=True)
+            ms = trimesh.load(output_path, process=False)
+        if isinstance(ms, trimesh.Scene):
+            ms = _merge_scene(ms)
+        ms = mesh_normalize(ms)
+        return ms
@@ -321,6 +321,257 @@ class FlowMatchEulerDiscreteScheduler(SchedulerMixin, ConfigMixin):
         return self.config.num_train_timesteps
 
 
+class FlowMatchHeunDiscreteScheduler(FlowMatchEulerDiscreteScheduler):
+    """
+    Second-order Heun (explicit trapezoidal) solver for the flow-matching ODE.
+
+    Every interval `[sigma_i, sigma_{i+1}]` of the schedule is integrated with two model evaluations: an Euler
+    predictor at `sigma_i` and a corrector at `sigma_{i+1}`. `timesteps` therefore lists the evaluation points (about
+    twice `num_inference_steps` of them), so the pipeline's denoising loop runs unchanged. A schedule of 10-15 steps
+    typically matches the 50-step Euler result at 40-60% of the DiT evaluations.
+
+    Zero-length intervals (e.g. the trailing `1 -> 1` step of the pipeline's `linspace(0, 1, n)` schedule) are
+    skipped instead of wasting two model evaluations on them.
+
+    Example:
+    ```python
+    pipeline.scheduler = FlowMatchHeunDiscreteScheduler.from_config(pipeline.scheduler.config)
+    mesh = pipeline(image=image, num_inference_steps=12)[0]
+    ```
+    """
+
+    order = 2
+
+    def _second_stage_sigma(self, sigma, sigma_next):
+        return sigma_next
+
+    def set_timesteps(
+        self,
+        num_inference_steps: int = None,
+        device: Union[str, torch.device] = None,
+        sigmas: Optional[List[float]] = None,
+        mu: Optional[float] = None,
+    ):
+        super().set_timesteps(num_inference_steps, device=device, sigmas=sigmas, mu=mu)
+
+        grid = self.sigmas.cpu()
+        eval_sigmas = []
+        interval_sigmas = []
+        for sigma, sigma_next in zip(grid[:-1].tolist(), grid[1:].tolist()):
+            if sigma_next == sigma:
+                continue
+            eval_sigmas += [sigma, self._second_stage_sigma(sigma, sigma_next)]
+            interval_sigmas.append((sigma, sigma_next))
+
+        self.interval_sigmas = interval_sigmas
+        sigmas = torch.tensor(eval_sigmas, dtype=torch.float32)
+        self.timesteps = (sigmas * self.config.num_train_timesteps).to(device=device)
+        self.sigmas = torch.cat([sigmas, grid[-1:]])
+        self.num_inference_steps = len(self.timesteps)
+
+        self._sample = None
+        self._derivative = None
+
+    def index_for_timestep(self, timestep, schedule_timesteps=None):
+        if schedule_timesteps is None:
+            schedule_timesteps = self.timesteps
+        # intermediate timesteps appear twice, the very first one is always unique
+        return (schedule_timesteps == timestep).nonzero()[0].item()
+
+    def step(
+        self,
+        model_output: torch.FloatTensor,
+        timestep: Union[float, torch.FloatTensor],
+        sample: torch.FloatTensor,
+        generator: Optional[torch.Generator] = None,
+        return_dict: bool = True,
+        **kwargs,
+    ) -> Union[FlowMatchEulerDiscreteSchedulerOutput, Tuple]:
+        if (
+            isinstance(timestep, int)
+            or isinstance(timestep, torch.IntTensor)
+            or isinstance(timestep, torch.LongTensor)
+        ):
+            raise ValueError(
+                (
+                    "Passing integer indices (e.g. from `enumerate(timesteps)`) as timesteps to"
+                    " `FlowMatchHeunDiscreteScheduler.step()` is not supported. Make sure to pass"
+                    " one of the `scheduler.timesteps` as a timestep."
+                ),
+            )
+
+        if self.step_index is None:
+            self._init_step_index(timestep)
+
+        sigma, sigma_next = self.interval_sigmas[self.step_index // 2]
+        model_output_fp32 = model_output.to(torch.float32)
+
+        if self.step_index % 2 == 0:
+            # predictor: Euler step to the second evaluation point
+            self._sample = sample.to(torch.float32)
+            self._derivative = model_output_fp32
+            sigma_stage = self.sigmas[self.step_index + 1].item()
+            prev_sample = self._sample + (sigma_stage - sigma) * model_output_fp32
+        else:
+            # corrector: full step from the stored sample with the combined slope
+            derivative = self._combine(self._derivative, model_output_fp32)
+            prev_sample = self._sample + (sigma_next - sigma) * derivative
+            self._sample = None
+            self._derivative = None
+
+        prev_sample = prev_sample.to(model_output.dtype)
+        self._step_index += 1
+
+        if not return_dict:
+            return (prev_sample,)
+
+        return FlowMatchEulerDiscreteSchedulerOutput(prev_sample=prev_sample)
+
+    def _combine(self, first_derivative, second_derivative):
+        return 0.5 * (first_derivative + second_derivative)
+
+
+class FlowMatchMidpointDiscreteScheduler(FlowMatchHeunDiscreteScheduler):
+    """
+    Second-order explicit midpoint solver for the flow-matching ODE. Same two-evaluations-per-interval contract as
+    [`FlowMatchHeunDiscreteScheduler`], but the second evaluation happens halfway through the interval and its
+    slope alone drives the full step.
+    """
+
+    def _second_stage_sigma(self, sigma, sigma_next):
+        return 0.5 * (sigma + sigma_next)
+
+    def _combine(self, first_derivative, second_derivative):
+        return second_derivative
+
+
+class FlowMatchMultistepScheduler(FlowMatchEulerDiscreteScheduler):
+    """
+    Variable step-size Adams-Bashforth multistep solver for the flow-matching ODE.
+
+    Like Euler it needs a single model evaluation per timestep, but it extrapolates the velocity from the last
+    `solver_order` evaluations, which gives a 2nd/3rd order method at no extra cost. The first steps warm up with
+    lower orders, and with `lower_order_final` the order is also reduced on the last steps of short (<15 step)
+    schedules, which keeps them stable. Zero-length intervals are dropped from the schedule, like in
+    [`FlowMatchHeunDiscreteScheduler`], so no model evaluation is spent on them.
+
+    Args:
+        num_train_timesteps (`int`, defaults to 1000):
+            The number of diffusion steps to train the model.
+        shift (`float`, defaults to 1.0):
+            The shift value for the timestep schedule.
+        solver_order (`int`, defaults to 2):
+            The order of the Adams-Bashforth method, one of 1 (Euler), 2 or 3.
+        lower_order_final (`bool`, defaults to `True`):
+            Whether to use lower-order updates for the final steps.
+    """
+
+    @register_to_config
+    def __init__(
+        self,
+        num_train_timesteps: int = 1000,
+        shift: float = 1.0,
+        use_dynamic_shifting=False,
+        solver_order: int = 2,
+        lower_order_final: bool = True,
+    ):
+        if solver_order not in [1, 2, 3]:
+            raise ValueError(f"Unsupported solver_order {solver_order}, available: {[1, 2, 3]}")
+        super().__init__(
+            num_train_timesteps=num_train_timesteps,
+            shift=shift,
+            use_dynamic_shifting=use_dynamic_shifting,
+        )
+        self.model_outputs = []
+        self.sigma_history = []
+
+    def set_timesteps(
+        self,
+        num_inference_steps: int = None,
+        device: Union[str, torch.device] = None,
+        sigmas: Optional[List[float]] = None,
+        mu: Optional[float] = None,
+    ):
+        super().set_timesteps(num_inference_steps, device=device, sigmas=sigmas, mu=mu)
+        self.model_outputs = []
+        self.sigma_history = []
+
+        grid = self.sigmas.cpu()
+        sigmas = grid[:-1][grid[1:] != grid[:-1]]
+        self.timesteps = (sigmas * self.config.num_train_timesteps).to(device=device)
+        self.sigmas = torch.cat([sigmas, grid[-1:]])
+        self.num_inference_steps = len(self.timesteps)
+
+        # keep a host copy so stepping doesn't sync with the device
+        self._sigmas_list = self.sigmas.tolist()
+        # number of steps left, including the current one
+        self._remaining_steps = list(range(len(sigmas), 0, -1))
+        self._lower_order_final = self.config.lower_order_final and len(sigmas) < 15
+
+    @staticmethod
+    def _adams_bashforth_coefficients(nodes: List[float], sigma: float, sigma_next: float) -> List[float]:
+        """Integrals over `[sigma, sigma_next]` of the Lagrange basis polynomials built on `nodes`."""
+        coefficients = []
+        for j, node in enumerate(nodes):
+            others = [m for i, m in enumerate(nodes) if i != j]
+            basis = np.polynomial.Polynomial.fromroots(others) if others else np.polynomial.Polynomial([1.0])
+            basis = basis / np.prod([node - m for m in others])
+            antiderivative = basis.integ()
+            coefficients.append(float(antiderivative(sigma_next) - antiderivative(sigma)))
+        return coefficients
+
+    def step(
+        self,
+        model_output: torch.FloatTensor,
+        timestep: Union[float, torch.FloatTensor],
+        sample: torch.FloatTensor,
+        generator: Optional[torch.Generator] = None,
+        return_dict: bool = True,
+        **kwargs,
+    ) -> Union[FlowMatchEulerDiscreteSchedulerOutput, Tuple]:
+        if (
+            isinstance(timestep, int)
+            or isinstance(timestep, torch.IntTensor)
+            or isinstance(timestep, torch.LongTensor)
+        ):
+            raise ValueError(
+                (
+                    "Passing integer indices (e.g. from `enumerate(timesteps)`) as timesteps to"
+                    " `FlowMatchMultistepScheduler.step()` is not supported. Make sure to pass"
+                    " one of the `scheduler.timesteps` as a timestep."
+                ),
+            )
+
+        if self.step_index is None:
+            self._init_step_index(timestep)
+
+        sample = sample.to(torch.float32)
+        sigma = self._sigmas_list[self.step_index]
+        sigma_next = self._sigmas_list[self.step_index + 1]
+
+        self.model_outputs.append(model_output.to(torch.float32))
+        self.sigma_history.append(sigma)
+        self.model_outputs = self.model_outputs[-self.config.solver_order:]
+        self.sigma_history = self.sigma_history[-self.config.solver_order:]
+
+        order = len(self.model_outputs)
+        if self._lower_order_final:
+            order = min(order, self._remaining_steps[self.step_index])
+
+        coefficients = self._adams_bashforth_coefficients(self.sigma_history[-order:], sigma, sigma_next)
+        prev_sample = sample
+        for coefficient, derivative in zip(coefficients, self.model_outputs[-order:]):
+            prev_sample = prev_sample + coefficient * derivative
+
+        prev_sample = prev_sample.to(model_output.dtype)
+        self._step_index += 1
+
+        if not return_dict:
+            return (prev_sample,)
+
+        return FlowMatchEulerDiscreteSchedulerOutput(prev_sample=prev_sample)
+
+
 @dataclass
 class ConsistencyFlowMatchEulerDiscreteSchedulerOutput(BaseOutput):
     prev_sample: torch.FloatTensor
@@ -0,0 +1,185 @@
+# Hunyuan 3D is licensed under the TENCENT HUNYUAN NON-COMMERCIAL LICENSE AGREEMENT
+# except for the third-party components listed below.
+# Hunyuan 3D does not impose any additional limitations beyond what is outlined
+# in the repsective licenses of these third-party components.
+# Users must comply with all terms and conditions of original licenses of these third-party
+# components and must ensure that the usage of the third party components adheres to
+# all relevant laws and regulations.
+
+# For avoidance of doubts, Hunyuan 3D means the large language models and
+# their software and algorithms, including trained model weights, parameters (including
+# optimizer states), machine-learning model code, inference-enabling code, training-enabling code,
+# fine-tuning enabling code and other elements of the foregoing made publicly available
+# by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
+
+"""
+In-process quadric edge-collapse simplification (Garland & Heckbert).
+
+The quadrics and the initial collapse costs are computed for the whole mesh at once with NumPy. The
+collapses then run greedily from a heap, cheapest first. Every entry carries the versions of its two
+vertices, so entries made stale by an earlier collapse are skipped when they are popped. A collapse is
+rejected when it would break the manifold (link condition) or flip one of the surrounding faces.
+"""
+
+import heapq
+
+import numpy as np
+
+
+def _planes_to_quadrics(planes: np.ndarray, weights: np.ndarray):
+    return planes[:, :, None] * planes[:, None, :] * weights[:, None, None]
+
+
+def compute_vertex_quadrics(vertices: np.ndarray, faces: np.ndarray, boundary_weight: float = 3.0):
+    """Area-weighted sum of the face plane quadrics around each vertex.
+
+    With `boundary_weight` > 0, every boundary edge also adds the plane through it perpendicular to its face,
+    which keeps the open borders in place.
+    """
+    v0, v1, v2 = (vertices[faces[:, i]] for i in range(3))
+    normals = np.cross(v1 - v0, v2 - v0)
+    double_areas = np.linalg.norm(normals, axis=1)
+    normals = normals / np.maximum(double_areas, 1e-20)[:, None]
+    planes = np.concatenate([normals, -(normals * v0).sum(axis=1, keepdims=True)], axis=1)
+    face_quadrics = _planes_to_quadrics(planes, 0.5 * double_areas)
+
+    quadrics = np.zeros((len(vertices), 4, 4), dtype=np.float64)
+    for i in range(3):
+        np.add.at(quadrics, faces[:, i], face_quadrics)
+
+    boundary = np.zeros(len(vertices), dtype=bool)
+    edges = faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2)
+    _, edge_index, counts = np.unique(np.sort(edges, axis=1), axis=0, return_inverse=True, return_counts=True)
+    is_boundary_edge = counts[edge_index.reshape(-1)] == 1
+    if is_boundary_edge.any():
+        start, end = edges[is_boundary_edge, 0], edges[is_boundary_edge, 1]
+        boundary[start] = True
+        boundary[end] = True
+        if boundary_weight > 0:
+            direction = vertices[end] - vertices[start]
+            face_normals = np.repeat(normals, 3, axis=0)[is_boundary_edge]
+            side = np.cross(direction, face_normals)
+            side = side / np.maximum(np.linalg.norm(side, axis=1), 1e-20)[:, None]
+            side_planes = np.concatenate([side, -(side * vertices[start]).sum(axis=1, keepdims=True)], axis=1)
+            side_quadrics = _planes_to_quadrics(side_planes, boundary_weight * (direction ** 2).sum(axis=1))
+            np.add.at(quadrics, start, side_quadrics)
+            np.add.at(quadrics, end, side_quadrics)
+    return quadrics, boundary
+
+
+def collapse_targets(quadrics: np.ndarray, positions_a: np.ndarray, positions_b: np.ndarray):
+    """Optimal position and error of collapsing each (a, b) pair whose summed quadric is `quadrics`.
+
+    The minimizer of the quadric is used when its 3x3 block is well conditioned. Otherwise, or when an
+    endpoint or the midpoint is cheaper, the best of those three is used instead.
+    """
+    A = quadrics[:, :3, :3]
+    b = -quadrics[:, :3, 3]
+    scale = np.abs(A).sum(axis=(1, 2)) / 9
+    det = np.linalg.det(A)
+    solvable = np.abs(det) > 1e-6 * scale ** 3 + 1e-30
+    optimal = np.zeros_like(positions_a)
+    if solvable.any():
+        optimal[solvable] = np.linalg.solve(A[solvable], b[solvable][:, :, None])[:, :, 0]
+
+    candidates = np.stack([optimal, positions_a, positions_b, 0.5 * (positions_a + positions_b)], axis=1)
+    homogeneous = np.concatenate([candidates, np.ones(candidates.shape[:2] + (1,))], axis=2)
+    errors = np.einsum('kci,kij,kcj->kc', homogeneous, quadrics, homogeneous)
+    errors[~solvable, 0] = np.inf
+    best = errors.argmin(axis=1)
+    index = np.arange(len(best))
+    return candidates[index, best], np.maximum(errors[index, best], 0.0)
+
+
+def simplify_quadric(vertices: np.ndarray, faces: np.ndarray, target_facenum: int, boundary_weight: float = 3.0,
+                     preserve_boundary: bool = True):
+    """Collapse edges until at most `target_facenum` faces remain, or no valid collapse is left.
+
+    Returns the compacted vertices (float64) and faces (int64).
+    """
+    positions = np.asarray(vertices, dtype=np.float64).copy()
+    faces = np.asarray(faces, dtype=np.int64).copy()
+    num_faces = len(faces)
+    if target_facenum >= num_faces:
+        return positions, faces
+
+    quadrics, boundary = compute_vertex_quadrics(positions, faces, boundary_weight)
+    boundary = boundary.tolist()
+    face_alive = np.ones(num_faces, dtype=bool)
+    vertex_faces = [set() for _ in range(len(positions))]
+    for f, (i, j, k) in enumerate(faces.tolist()):
+        vertex_faces[i].add(f)
+        vertex_faces[j].add(f)
+        vertex_faces[k].add(f)
+    version = [0] * len(positions)
+
+    def neighbours(v):
+        return {u for f in vertex_faces[v] for u in faces[f].tolist()} - {v}
+
+    def push(a, others):
+        others = np.asarray(others, dtype=np.int64)
+        targets, errors = collapse_targets(quadrics[a] + quadrics[others],
+                                           np.repeat(positions[a][None], len(others), axis=0), positions[others])
+        for other, target, error in zip(others.tolist(), targets.tolist(), errors.tolist()):
+            heapq.heappush(heap, (error, a, other, version[a], version[other], tuple(target)))
+
+    edges = np.unique(np.sort(faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1), axis=0)
+    targets, errors = collapse_targets(quadrics[edges[:, 0]] + quadrics[edges[:, 1]],
+                                       positions[edges[:, 0]], positions[edges[:, 1]])
+    heap = [(error, a, b, 0, 0, tuple(target))
+            for (a, b), target, error in zip(edges.tolist(), targets.tolist(), errors.tolist())]
+    heapq.heapify(heap)
+
+    while num_faces > target_facenum and heap:
+        _, a, b, version_a, version_b, target = heapq.heappop(heap)
+        if version[a] != version_a or version[b] != version_b:
+            continue
+        shared = vertex_faces[a] & vertex_faces[b]
+        if not shared:
+            continue
+        # link condition: the common neighbours of a and b are exactly the apexes of the faces on the edge
+        apexes = {u for f in shared for u in faces[f].tolist()} - {a, b}
+        if neighbours(a) & neighbours(b) != apexes:
+            continue
+        if boundary[a] and boundary[b] and len(shared) > 1:
+            continue
+        if preserve_boundary and boundary[a] != boundary[b]:
+            # move the interior vertex onto the boundary one rather than the other way round
+            if boundary[b]:
+                a, b = b, a
+            target = tuple(positions[a].tolist())
+
+        moved = np.fromiter((vertex_faces[a] | vertex_faces[b]) - shared, dtype=np.int64)
+        if len(moved):
+            corners = positions[faces[moved]]
+            before = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+            corners[np.isin(faces[moved], (a, b))] = target
+            after = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+            # faces that were already degenerate cannot flip, so they do not block the collapse
+            if (((before * after).sum(axis=1) <= 0) & ((before ** 2).sum(axis=1) > 0)).any():
+                continue
+
+        for f in shared:
+            face_alive[f] = False
+            for u in faces[f].tolist():
+                vertex_faces[u].discard(f)
+        for f in vertex_faces[b]:
+            faces[f][faces[f] == b] = a
+        vertex_faces[a] |= vertex_faces[b]
+        vertex_faces[b] = set()
+        num_faces -= len(shared)
+
+        positions[a] = target
+        quadrics[a] += quadrics[b]
+        boundary[a] = boundary[a] or boundary[b]
+        version[a] += 1
+        version[b] += 1
+        others = neighbours(a)
+        if others:
+            push(a, sorted(others))
+
+    faces = faces[face_alive]
+    used = np.zeros(len(positions), dtype=bool)
+    used[faces.reshape(-1)] = True
+    new_index = np.cumsum(used) - 1
+    return positions[used], new_index[faces]
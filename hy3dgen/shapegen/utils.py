@@ -12,8 +12,12 @@
 # fine-tuning enabling code and other elements of the foregoing made publicly available
 # by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
 
+import hashlib
+import itertools
 import logging
 import os
+import weakref
+from collections import OrderedDict
 from functools import wraps
 
 import torch
@@ -124,3 +128,145 @@ def smart_load_model(
     config_path = os.path.join(model_path, 'config.yaml')
     ckpt_path = os.path.join(model_path, ckpt_name)
     return config_path, ckpt_path
+
+
+def map_tensors(fn, obj):
+    """Apply `fn` to every tensor inside a (possibly nested) dict/list/tuple."""
+    if isinstance(obj, torch.Tensor):
+        return fn(obj)
+    if isinstance(obj, dict):
+        return {k: map_tensors(fn, v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(map_tensors(fn, v) for v in obj)
+    return obj
+
+
+def tensor_nbytes(obj):
+    nbytes = 0
+
+    def count(t):
+        nonlocal nbytes
+        nbytes += t.numel() * t.element_size()
+        return t
+
+    map_tensors(count, obj)
+    return nbytes
+
+
+class ConditionCache:
+    """ LRU cache for the outputs of the image conditioner.
+
+        Entries are keyed by a content hash of the preprocessed image tensor, the
+        additional conditioner inputs (e.g. `view_idxs`) and the identity of the
+        conditioner, so regenerating the same image with a new seed, step count
+        or octree resolution skips the DINO/CLIP forward pass. Cached `cond`
+        dicts live on `device` and are evicted least-recently-used first once
+        their total size exceeds `max_bytes`.
+
+        The constant unconditional embeddings are cached as well, per batch size
+        and view set, on the device they were created on. They share the LRU order
+        and the `max_bytes` budget with the `cond` entries.
+
+        Conditioners are told apart by a token held in a weak mapping rather than
+        by `id()`, so a reloaded conditioner never hits the entries of the one it
+        replaced.
+
+        Example:
+        ```python
+        pipeline.enable_cond_cache(max_bytes=2 * 1024 ** 3, device='cpu')
+        ...
+        logger.info(pipeline.cond_cache.stats())
+        ```
+    """
+
+    def __init__(self, max_bytes: int = 1024 ** 3, device='cpu'):
+        self.max_bytes = max_bytes
+        self.device = None if device is None else torch.device(device)
+        self._entries = OrderedDict()
+        self._conditioner_tokens = weakref.WeakKeyDictionary()
+        self._token_counter = itertools.count()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _hash_inputs(hasher, obj):
+        if isinstance(obj, torch.Tensor):
+            hasher.update(f'{obj.dtype}{tuple(obj.shape)}'.encode())
+            hasher.update(obj.detach().to('cpu', torch.float32).contiguous().numpy().tobytes())
+        elif isinstance(obj, dict):
+            for k in sorted(obj.keys()):
+                hasher.update(str(k).encode())
+                ConditionCache._hash_inputs(hasher, obj[k])
+        else:
+            hasher.update(repr(obj).encode())
+
+    def make_key(self, image, conditioner, additional_cond_inputs=None):
+        hasher = hashlib.sha1()
+        self._hash_inputs(hasher, image)
+        self._hash_inputs(hasher, additional_cond_inputs or {})
+        dtype = next(conditioner.parameters()).dtype
+        return self._conditioner_token(conditioner), str(dtype), hasher.hexdigest()
+
+    def make_unconditional_key(self, batch_size, conditioner, additional_cond_inputs=None):
+        view_idxs = (additional_cond_inputs or {}).get('view_idxs', None)
+        if view_idxs is not None:
+            view_idxs = tuple(tuple(v) for v in view_idxs)
+        return 'unconditional', self._conditioner_token(conditioner), batch_size, view_idxs
+
+    def _conditioner_token(self, conditioner):
+        if conditioner not in self._conditioner_tokens:
+            self._conditioner_tokens[conditioner] = next(self._token_counter)
+        return self._conditioner_tokens[conditioner]
+
+    def get(self, key, device=None):
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        cond = self._entries[key]
+        return map_tensors(lambda t: t.to(device, non_blocking=True) if device is not None else t, cond)
+
+    def put(self, key, cond):
+        if self.device is not None:
+            cond = map_tensors(lambda t: t.detach().to(self.device), cond)
+        self._insert(key, cond)
+
+    def _insert(self, key, cond):
+        nbytes = tensor_nbytes(cond)
+        if nbytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self.nbytes -= tensor_nbytes(self._entries.pop(key))
+        self._entries[key] = cond
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= tensor_nbytes(evicted)
+            self.evictions += 1
+
+    def get_unconditional(self, key, create_fn):
+        un_cond = self._entries.get(key)
+        if un_cond is None:
+            un_cond = create_fn()
+            self._insert(key, un_cond)
+        else:
+            self._entries.move_to_end(key)
+        # hand out a fresh container so callers can't mutate the cached one
+        return map_tensors(lambda t: t, un_cond)
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'nbytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }